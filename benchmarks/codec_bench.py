@@ -0,0 +1,88 @@
+"""Compares frame size and encode/decode time of the json and msgpack wire
+formats on trade messages shaped like the ones MT4/MT5 terminals send.
+
+    python benchmarks/codec_bench.py [-n NUMBER]
+"""
+import argparse
+import random
+import timeit
+from uuid import uuid4
+
+from tradecopier.application.domain import value_objects as vo
+from tradecopier.application.domain.entities.message import (IncomingMessage,
+                                                             InTradeMessage,
+                                                             OutgoingMessage,
+                                                             OutTradeMessage)
+from tradecopier.application.domain.entities.order import Order
+from tradecopier.infrastructure.adapters import codec as wire
+
+
+def realistic_order(rnd: random.Random) -> Order:
+    price = round(rnd.uniform(1.05, 1.25), 5)
+    return Order(
+        action=vo.TradeAction.DEAL,
+        symbol=rnd.choice(("EURUSD", "GBPUSD", "USDJPY", "XAUUSD")),
+        magic=rnd.randint(1, 10 ** 6),
+        volume=round(rnd.uniform(0.01, 5), 2),
+        volume_percent=round(rnd.uniform(0, 100), 2),
+        price=price,
+        sl=round(price - 0.0030, 5),
+        sl_points=30,
+        tp=round(price + 0.0060, 5),
+        tp_points=60,
+        deviation=10,
+        order_type=vo.OrderType.ORDER_TYPE_BUY,
+        order_type_filling=vo.OrderTypeFilling.ORDER_FILLING_FOK,
+        type_time=vo.TypeTime.ORDER_TIME_GTC,
+        comment="copied by tradecopier",
+        position=rnd.randint(10 ** 6, 10 ** 7),
+        reason=vo.OrderReason.ORDER_REASON_EXPERT,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    orders = [realistic_order(rnd) for _ in range(100)]
+    incoming = [
+        IncomingMessage(
+            message=InTradeMessage(terminal_id=uuid4(), account_id="1", body=order)
+        ).dict()
+        for order in orders
+    ]
+    outgoing = [
+        OutgoingMessage(message=OutTradeMessage(body=order)).dict() for order in orders
+    ]
+
+    print(
+        f"{'codec':<22}{'in bytes':>10}{'out bytes':>10}"
+        f"{'encode us':>11}{'decode us':>11}"
+    )
+    for name in sorted(set(c.name for c in wire.CODECS.values())):
+        codec = wire.CODECS[name]
+        in_frames = [codec.dumps(m) for m in incoming]
+        out_frames = [codec.dumps(m) for m in outgoing]
+        in_size = sum(len(f) for f in in_frames) / len(in_frames)
+        out_size = sum(len(f) for f in out_frames) / len(out_frames)
+        enc = timeit.timeit(
+            "for m in outgoing: dumps(m)",
+            globals={"outgoing": outgoing, "dumps": codec.dumps},
+            number=args.number // len(outgoing),
+        )
+        dec = timeit.timeit(
+            "for f in frames: decode(f)",
+            globals={"frames": in_frames, "decode": wire.decode},
+            number=args.number // len(in_frames),
+        )
+        per = 10 ** 6 / (args.number // len(outgoing) * len(outgoing))
+        print(
+            f"{name:<22}{in_size:>10.0f}{out_size:>10.0f}"
+            f"{enc * per:>11.2f}{dec * per:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
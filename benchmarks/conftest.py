@@ -0,0 +1,24 @@
+import json
+import random
+from uuid import uuid4
+
+import pytest
+from codec_bench import realistic_order
+from tradecopier.application.domain.entities.message import (IncomingMessage,
+                                                             InTradeMessage)
+
+
+@pytest.fixture
+def order():
+    return realistic_order(random.Random(42))
+
+
+@pytest.fixture
+def trade_message(order):
+    return InTradeMessage(terminal_id=uuid4(), account_id="1", body=order)
+
+
+@pytest.fixture
+def trade_frame(trade_message):
+    # what a terminal sends, as decoded from the wire
+    return json.loads(IncomingMessage(message=trade_message).json())
@@ -0,0 +1,63 @@
+"""Compares full pydantic validation of inbound trade frames with the fast
+path used for registered connections.
+
+    python benchmarks/decoder_bench.py [-n NUMBER]
+"""
+import argparse
+import json
+import random
+import timeit
+from uuid import uuid4
+
+from codec_bench import realistic_order
+from tradecopier.application.domain.entities.message import (IncomingMessage,
+                                                             InTradeBatchMessage,
+                                                             InTradeMessage)
+from tradecopier.infrastructure.adapters.decoder import decode_incoming
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    orders = [realistic_order(rnd) for _ in range(100)]
+    cases = {
+        "single": [
+            InTradeMessage(terminal_id=uuid4(), account_id="1", body=order)
+            for order in orders
+        ],
+        "batch of 5": [
+            InTradeBatchMessage(
+                terminal_id=uuid4(), account_id="1", body=orders[i : i + 5]
+            )
+            for i in range(0, len(orders), 5)
+        ],
+    }
+
+    print(f"{'frame':<12}{'pydantic us':>13}{'fast us':>10}{'speedup':>9}")
+    for name, messages in cases.items():
+        frames = [
+            json.loads(json.dumps(IncomingMessage(message=m).dict())) for m in messages
+        ]
+        assert all(decode_incoming(f) == IncomingMessage(**f) for f in frames)
+        repeat = max(1, args.number // len(frames))
+        slow = timeit.timeit(
+            "for f in frames: parse(**f)",
+            globals={"frames": frames, "parse": IncomingMessage},
+            number=repeat,
+        )
+        fast = timeit.timeit(
+            "for f in frames: parse(f)",
+            globals={"frames": frames, "parse": decode_incoming},
+            number=repeat,
+        )
+        per = 10 ** 6 / (repeat * len(frames))
+        print(
+            f"{name:<12}{slow * per:>13.2f}{fast * per:>10.2f}{slow / fast:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
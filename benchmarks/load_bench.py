@@ -0,0 +1,392 @@
+"""Drives a locally started router with simulated terminals and reports
+throughput and end-to-end latency per fan-out size.
+
+For every fan-out size a group of sources is routed to that many
+destinations each, routes and rules are written in bulk to a fresh SQLite
+database before the router starts. Sources replay pre-built order streams
+with poisson arrivals, destinations time every copy they receive.
+
+    python benchmarks/load_bench.py [--fanouts 1,10,100] [--sources 10]
+        [--rate 5] [--duration 20] [--workers 1] [--output load_bench.json]
+
+Clients share one process and event loop, so at high rates their own
+scheduling shows up in the latencies; compare runs made with the same
+parameters on the same box.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from uuid import uuid4
+
+import websockets as ws
+from codec_bench import realistic_order
+from sqlalchemy import create_engine
+from tradecopier.application.domain import value_objects as vo
+from tradecopier.application.domain.entities.message import (IncomingMessage,
+                                                             InTradeMessage,
+                                                             RegisterMessage)
+from tradecopier.application.domain.entities.route import Route
+from tradecopier.application.domain.entities.rule import (Expression,
+                                                          TransformRule)
+from tradecopier.application.domain.entities.terminal import Terminal
+from tradecopier.infrastructure.adapters import codec as wire
+from tradecopier.infrastructure.repositories.route_repo import \
+    SqlAlchemyRouteRepo
+from tradecopier.infrastructure.repositories.rule_repo import \
+    SqlAlchemyRuleRepo
+from tradecopier.infrastructure.repositories.sql_model import metadata
+from tradecopier.infrastructure.repositories.terminal_repo import \
+    SqlAlchemyTerminalRepo
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+# most copies change the volume, followers share a handful of multipliers
+MULTIPLIERS = (None, 0.5, 2.0, 3.0)
+ACTIONS = (
+    (vo.TradeAction.DEAL, 0.5),
+    (vo.TradeAction.SLTP, 0.3),
+    (vo.TradeAction.MODIFY, 0.1),
+    (vo.TradeAction.PENDING, 0.1),
+)
+
+
+class Group(NamedTuple):
+    fanout: int
+    sources: List[Terminal]
+    destinations: List[List[Terminal]]
+
+
+class Stats:
+    def __init__(self):
+        self.sent: Dict[int, Tuple[float, int]] = {}
+        self.latencies: Dict[int, List[float]] = {}
+        self.warm: set = set()
+
+
+def terminal(name: str) -> Terminal:
+    return Terminal(
+        terminal_id=uuid4(),
+        name=name,
+        broker=f"bench@{name}: mt5.{name}",
+        customer_type=vo.CustomerType.GOLD,
+    )
+
+
+def configure(dsn: str, fanouts: List[int], sources: int, rnd: random.Random):
+    groups = [
+        Group(
+            fanout,
+            [terminal(f"src-{fanout}-{i}") for i in range(sources)],
+            [
+                [terminal(f"dst-{fanout}-{i}-{j}") for j in range(fanout)]
+                for i in range(sources)
+            ],
+        )
+        for fanout in fanouts
+    ]
+    engine = create_engine(dsn)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        term_repo = SqlAlchemyTerminalRepo(conn)
+        route_repo = SqlAlchemyRouteRepo(conn)
+        rule_repo = SqlAlchemyRuleRepo(conn)
+        for group in groups:
+            for source, destinations in zip(group.sources, group.destinations):
+                term_repo.save(source)
+                for destination in destinations:
+                    term_repo.save(destination)
+                    route_repo.save(
+                        Route(
+                            source=source,
+                            destination=destination,
+                            status=vo.RouteStatus.BOTH,
+                        )
+                    )
+                    if (multiplier := rnd.choice(MULTIPLIERS)) is not None:
+                        rule_repo.save(
+                            TransformRule(
+                                destination.terminal_id,
+                                Expression(
+                                    field="volume",
+                                    value=multiplier,
+                                    operator=vo.TransformOperation.MULTIPLY,
+                                ),
+                            )
+                        )
+    engine.dispose()
+    return groups
+
+
+def encode(message, codec: wire.Codec) -> wire.Frame:
+    return codec.dumps(json.loads(IncomingMessage(message=message).json()))
+
+
+def order_stream(
+    source: Terminal, count: int, first_magic: int, codec: wire.Codec, rnd
+) -> List[Tuple[int, wire.Frame]]:
+    actions, weights = zip(*ACTIONS)
+    stream = []
+    for magic in range(first_magic, first_magic + count):
+        order = realistic_order(rnd).copy(
+            update={"magic": magic, "action": rnd.choices(actions, weights)[0]}
+        )
+        message = InTradeMessage(
+            terminal_id=source.terminal_id, account_id="1", body=order
+        )
+        stream.append((magic, encode(message, codec)))
+    return stream
+
+
+def register_frame(term: Terminal, codec: wire.Codec) -> wire.Frame:
+    return encode(
+        RegisterMessage(
+            terminal_id=term.terminal_id,
+            name=term.name,
+            broker=term.broker,
+            wire_format=codec.name,
+        ),
+        codec,
+    )
+
+
+async def destination(
+    url: str, term: Terminal, fanout: int, codec: wire.Codec, stats: Stats
+):
+    latencies = stats.latencies.setdefault(fanout, [])
+    async with ws.connect(url, subprotocols=[codec.name]) as conn:
+        await conn.send(register_frame(term, codec))
+        async for frame in conn:
+            received = time.perf_counter()
+            body = wire.decode(frame)["message"]["body"]
+            for order in body if isinstance(body, list) else (body,):
+                if order["magic"] == 0:
+                    stats.warm.add(term.terminal_id)
+                elif (sent := stats.sent.get(order["magic"])) is not None:
+                    latencies.append(received - sent[0])
+
+
+async def source(
+    url: str,
+    term: Terminal,
+    fanout: int,
+    codec: wire.Codec,
+    stream: List[Tuple[int, wire.Frame]],
+    warmup: wire.Frame,
+    rate: float,
+    started: asyncio.Event,
+    stats: Stats,
+    rnd: random.Random,
+):
+    async with ws.connect(url, subprotocols=[codec.name]) as conn:
+        await conn.send(register_frame(term, codec))
+        while not started.is_set():
+            await conn.send(warmup)
+            try:
+                await asyncio.wait_for(started.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+        deadline = time.perf_counter()
+        for magic, frame in stream:
+            deadline += rnd.expovariate(rate)
+            if (delay := deadline - time.perf_counter()) > 0:
+                await asyncio.sleep(delay)
+            stats.sent[magic] = (time.perf_counter(), fanout)
+            await conn.send(frame)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(int(q / 100 * len(values)), len(values) - 1)]
+
+
+def report(groups: List[Group], stats: Stats, duration: float) -> List[dict]:
+    results = []
+    for group in groups:
+        sent = sum(1 for _, fanout in stats.sent.values() if fanout == group.fanout)
+        latencies = sorted(stats.latencies.get(group.fanout, []))
+        results.append(
+            {
+                "fanout": group.fanout,
+                "sources": len(group.sources),
+                "destinations": sum(map(len, group.destinations)),
+                "sent": sent,
+                "expected": sent * group.fanout,
+                "delivered": len(latencies),
+                "sent_per_sec": round(sent / duration, 1),
+                "delivered_per_sec": round(len(latencies) / duration, 1),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+                "p999_ms": round(percentile(latencies, 99.9) * 1000, 3),
+                "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            }
+        )
+    return results
+
+
+async def wait_for_port(host: str, port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run(args, groups: List[Group], rnd: random.Random) -> dict:
+    url = f"ws://127.0.0.1:{args.port}"
+    codec = wire.get_codec(args.codec)
+    stats = Stats()
+    started = asyncio.Event()
+    await wait_for_port("127.0.0.1", args.port, 30)
+
+    count = int(args.rate * args.duration)
+    warmups, streams, magic = {}, {}, 1
+    for group in groups:
+        for term in group.sources:
+            streams[term.terminal_id] = order_stream(term, count, magic, codec, rnd)
+            warmups[term.terminal_id] = order_stream(term, 1, 0, codec, rnd)[0][1]
+            magic += count
+
+    clients = [
+        asyncio.ensure_future(destination(url, dst, group.fanout, codec, stats))
+        for group in groups
+        for destinations in group.destinations
+        for dst in destinations
+    ]
+    await asyncio.sleep(0.5)
+    senders = [
+        asyncio.ensure_future(
+            source(
+                url,
+                term,
+                group.fanout,
+                codec,
+                streams[term.terminal_id],
+                warmups[term.terminal_id],
+                args.rate,
+                started,
+                stats,
+                random.Random(rnd.random()),
+            )
+        )
+        for group in groups
+        for term in group.sources
+    ]
+    total = sum(len(d) for group in groups for d in group.destinations)
+    deadline = time.monotonic() + 60
+    while len(stats.warm) < total:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"only {len(stats.warm)} of {total} terminals linked")
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(0.5)
+    for latencies in stats.latencies.values():
+        latencies.clear()
+
+    begin = time.perf_counter()
+    started.set()
+    await asyncio.gather(*senders)
+    duration = time.perf_counter() - begin
+    expected = sum(group.fanout * len(group.sources) * count for group in groups)
+    drain = time.monotonic() + args.drain
+    while time.monotonic() < drain:
+        if sum(map(len, stats.latencies.values())) >= expected:
+            break
+        await asyncio.sleep(0.1)
+    for client in clients:
+        client.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    return {
+        "duration_sec": round(duration, 3),
+        "results": report(groups, stats, duration),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fanouts", default="1,10,100")
+    parser.add_argument("--sources", type=int, default=10, help="per fan-out size")
+    parser.add_argument("--rate", type=float, default=5.0, help="orders/sec per source")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--drain", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=16789)
+    parser.add_argument("--codec", default="json", choices=("json", "msgpack"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="load_bench.json")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    fanouts = [int(f) for f in args.fanouts.split(",")]
+    workdir = tempfile.mkdtemp(prefix="tradecopier-bench-")
+    dsn = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    groups = configure(dsn, fanouts, args.sources, rnd)
+
+    env = dict(
+        os.environ,
+        DB_DSN=dsn,
+        ROUTER_HOST="127.0.0.1",
+        ROUTER_PORT=str(args.port),
+        ROUTER_WORKERS=str(args.workers),
+        ROUTER_SOCKET_DIR=workdir,
+        CONFIG_PATH=os.devnull,
+        LOGURU_LEVEL="WARNING",
+    )
+    router = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "src", "router_main.py")], env=env
+    )
+    try:
+        outcome = asyncio.get_event_loop().run_until_complete(run(args, groups, rnd))
+    finally:
+        router.terminate()
+        router.wait()
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        **outcome,
+    }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(
+        f"{'fanout':>7}{'sent/s':>9}{'copies/s':>10}{'lost':>7}"
+        f"{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    )
+    for row in outcome["results"]:
+        print(
+            f"{row['fanout']:>7}{row['sent_per_sec']:>9}{row['delivered_per_sec']:>10}"
+            f"{row['expected'] - row['delivered']:>7}{row['p50_ms']:>9}"
+            f"{row['p99_ms']:>9}{row['max_ms']:>9}"
+        )
+    print(f"written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
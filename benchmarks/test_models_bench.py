@@ -0,0 +1,74 @@
+"""Micro benchmarks of the domain models and wire formats, see `make bench`."""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from tradecopier.application.domain.entities.message import (IncomingMessage,
+                                                             OutgoingMessage,
+                                                             OutTradeMessage)
+from tradecopier.application.domain.entities.terminal import Terminal
+from tradecopier.application.domain.value_objects import CustomerType
+from tradecopier.infrastructure.adapters import codec as wire
+from tradecopier.infrastructure.adapters.decoder import decode_incoming
+
+
+@pytest.mark.benchmark(group="order")
+def test_order_hash(benchmark, order):
+    assert benchmark(hash, order) == hash(order)
+
+
+@pytest.mark.benchmark(group="parse")
+def test_incoming_parse(benchmark, trade_frame):
+    message = benchmark(lambda: IncomingMessage(**trade_frame))
+    assert message.message.body.magic == trade_frame["message"]["body"]["magic"]
+
+
+@pytest.mark.benchmark(group="parse")
+def test_incoming_decode_fast_path(benchmark, trade_frame):
+    message = benchmark(decode_incoming, trade_frame)
+    assert message.message.body.magic == trade_frame["message"]["body"]["magic"]
+
+
+@pytest.mark.benchmark(group="serialize")
+def test_outgoing_dict_json(benchmark, order):
+    message = OutgoingMessage(message=OutTradeMessage(body=order))
+    frame = benchmark(lambda: json.dumps(message.dict()))
+    assert json.loads(frame)["message"]["body"]["magic"] == order.magic
+
+
+@pytest.mark.benchmark(group="serialize")
+@pytest.mark.parametrize("codec", [wire.JSON, wire.MSGPACK], ids=["json", "msgpack"])
+def test_outgoing_encode(benchmark, order, codec):
+    # a fresh message each round, encode() caches its frame
+    frame = benchmark(
+        lambda: OutgoingMessage(message=OutTradeMessage(body=order)).encode(
+            codec.dumps
+        )
+    )
+    assert wire.decode(frame)["message"]["body"]["magic"] == order.magic
+
+
+@pytest.mark.benchmark(group="serialize")
+@pytest.mark.parametrize("codec", [wire.JSON, wire.MSGPACK], ids=["json", "msgpack"])
+def test_outgoing_passthrough(benchmark, trade_frame, codec):
+    # same as test_outgoing_encode, the body spliced from the inbound frame
+    raw = codec.dumps(trade_frame)
+    inbound = decode_incoming(codec.loads(raw), raw).message
+    assert inbound._raw_encoder is not None
+    frame = benchmark(
+        lambda: OutgoingMessage.passthrough(inbound).encode(codec.dumps)
+    )
+    assert wire.decode(frame)["message"]["body"] == trade_frame["message"]["body"]
+
+
+@pytest.mark.benchmark(group="terminal")
+@pytest.mark.parametrize(
+    "customer_type", [CustomerType.BRONZE, CustomerType.GOLD], ids=["bronze", "gold"]
+)
+def test_terminal_is_active(benchmark, customer_type):
+    terminal = Terminal(
+        broker="bench: mt5.1",
+        customer_type=customer_type,
+        expire_at=datetime.now() + timedelta(days=1),
+    )
+    assert benchmark(lambda: terminal.is_active)
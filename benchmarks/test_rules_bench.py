@@ -0,0 +1,75 @@
+"""Micro benchmarks of rule evaluation, see `make bench`."""
+from uuid import uuid4
+
+import pytest
+from tradecopier.application.domain.entities.rule import (ComplexRule,
+                                                          Expression,
+                                                          FilterRule,
+                                                          TransformRule)
+from tradecopier.application.domain.value_objects import (FilterOperation,
+                                                          TransformOperation)
+
+# rounds re-apply rules to the same message, so transforms are chosen to
+# leave it unchanged or, for REVERSE, to flip it back and forth
+EXPRESSIONS = (
+    Expression(field="symbol", value="USD", operator=FilterOperation.IN),
+    Expression(field="volume", value=1.0, operator=TransformOperation.MULTIPLY),
+    Expression(field="volume", value=0.0, operator=FilterOperation.GE),
+    Expression(field="comment", value="copy", operator=TransformOperation.SET),
+    Expression(field="deviation", value=10, operator=FilterOperation.LE),
+)
+
+
+def make_rule(expr: Expression):
+    if isinstance(expr.operator, FilterOperation):
+        return FilterRule(uuid4(), expr)
+    return TransformRule(uuid4(), expr)
+
+
+def complex_rule(size: int) -> ComplexRule:
+    return ComplexRule(
+        uuid4(), [make_rule(EXPRESSIONS[i % len(EXPRESSIONS)]) for i in range(size)]
+    )
+
+
+@pytest.mark.benchmark(group="filter")
+@pytest.mark.parametrize(
+    "expr",
+    [
+        Expression(field="volume", value=0.0, operator=FilterOperation.GE),
+        Expression(field="symbol", value="USD", operator=FilterOperation.IN),
+    ],
+    ids=["ge", "in"],
+)
+def test_filter_apply(benchmark, trade_message, expr):
+    rule = FilterRule(uuid4(), expr)
+    assert benchmark(rule.apply, trade_message) is trade_message
+
+
+@pytest.mark.benchmark(group="transform")
+@pytest.mark.parametrize(
+    "expr",
+    [
+        Expression(field="volume", value=1.0, operator=TransformOperation.MULTIPLY),
+        Expression(field="comment", value="copy", operator=TransformOperation.SET),
+        Expression(field="", value="", operator=TransformOperation.REVERSE),
+    ],
+    ids=["multiply", "set", "reverse"],
+)
+def test_transform_apply(benchmark, trade_message, expr):
+    rule = TransformRule(uuid4(), expr)
+    assert benchmark(rule.apply, trade_message) is not None
+
+
+@pytest.mark.benchmark(group="complex")
+@pytest.mark.parametrize("size", [1, 5, 10, 20])
+def test_complex_apply(benchmark, trade_message, size):
+    rule = complex_rule(size)
+    assert benchmark(rule.apply, trade_message) is not None
+
+
+@pytest.mark.benchmark(group="complex-compiled")
+@pytest.mark.parametrize("size", [1, 5, 10, 20])
+def test_complex_compiled(benchmark, trade_message, size):
+    pipeline = complex_rule(size).compile()
+    assert benchmark(pipeline, trade_message) is not None
@@ -0,0 +1,29 @@
+import asyncio
+import os
+import sys
+from typing import List, Optional
+
+import dotenv
+from loguru import logger
+
+from tradecopier.infrastructure.adapters.tcp_backplane import BackplaneBroker
+
+
+def main(argv: Optional[List[str]]) -> None:
+    config_path = os.environ.get(
+        "CONFIG_PATH",
+        os.path.join(os.path.dirname(__file__), os.pardir, ".env"),
+    )
+    dotenv.load_dotenv(config_path)
+    broker = BackplaneBroker(
+        os.environ.get("BROKER_HOST", "127.0.0.1"),
+        int(os.environ.get("BROKER_PORT", 7000)),
+    )
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(broker.start())
+    logger.info(f"backplane broker listening on {broker.port}")
+    loop.run_forever()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,11 +2,12 @@ import asyncio
 import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
 
 import dotenv
 
-from main import SqlAlchemyTerminalRepo, get_db_connection
+from router_main import get_db_engine
 from tradecopier.application.domain import value_objects as vo
 from tradecopier.application.domain.entities import message as msg
 from tradecopier.application.domain.entities.order import Order
@@ -16,6 +17,9 @@ from tradecopier.application.use_case.receiving_message import \
     ReceivingMessageUseCase
 from tradecopier.infrastructure.adapters.connection_adapter import (
     ReceivingMessagePresenter, WebSocketsConnectionAdapter)
+from tradecopier.infrastructure.repositories.executor_repo import (
+    ExecutorRouteRepo, ExecutorRuleRepo, ExecutorTerminalRepo,
+    ThreadLocalConnection)
 from tradecopier.infrastructure.repositories.route_repo import \
     SqlAlchemyRouteRepo
 from tradecopier.infrastructure.repositories.rule_repo import \
@@ -56,6 +60,7 @@ def build_src():
         magic=100,
         order_ticket=100,
         volume=10.1,
+        volume_percent=0,
         price=1.2,
         order_type=vo.OrderType.ORDER_TYPE_BUY,
         order_type_filling=vo.OrderTypeFilling.ORDER_FILLING_FOK,
@@ -107,11 +112,13 @@ def main(argv: Optional[List[str]]) -> None:
     )
     dotenv.load_dotenv(config_path)
     wsca = WebSocketsConnectionAdapter()
-    db_conn = get_db_connection()
+    db_conn = ThreadLocalConnection(get_db_engine(1))
     rec_msg_presenter = ReceivingMessagePresenter()
-    route_repo = SqlAlchemyRouteRepo(db_conn)
-    term_repo = SqlAlchemyTerminalRepo(db_conn)
-    rule_repo = SqlAlchemyRuleRepo(db_conn)
+    # the use case is async, the repositories run on a worker thread
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+    route_repo = ExecutorRouteRepo(SqlAlchemyRouteRepo(db_conn), executor)
+    term_repo = ExecutorTerminalRepo(SqlAlchemyTerminalRepo(db_conn), executor)
+    rule_repo = ExecutorRuleRepo(SqlAlchemyRuleRepo(db_conn), executor)
     uc = ReceivingMessageUseCase(
         conn_handler=wsca,
         route_repo=route_repo,
@@ -124,7 +131,7 @@ def main(argv: Optional[List[str]]) -> None:
     for t in dst_term:
         build_dst(t["terminal_id"], t["broker"])
     configure(db_conn)
-    start_server = wsca.start_server(uc, rec_msg_presenter)
+    start_server = wsca.start_server(uc)
 
     asyncio.get_event_loop().run_until_complete(start_server)
     asyncio.get_event_loop().run_forever()
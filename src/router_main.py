@@ -1,67 +1,311 @@
 from __future__ import annotations
 
 import asyncio
+import multiprocessing
 import os
+import signal
+import socket
 import sys
-from typing import List, Optional
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from typing import Dict, List, Optional, Type, TypeVar
+from uuid import UUID
 
 import dotenv
 from loguru import logger
 from sqlalchemy import create_engine
 
+from tradecopier.application import tracing
+from tradecopier.application.domain.entities.routing_table import \
+    RoutingTable
+from tradecopier.application.domain.value_objects import (CustomerType,
+                                                          TradeAction)
+from tradecopier.application.repositories.route_repo import AsyncRouteRepo
+from tradecopier.application.use_case.expiring_terminals import \
+    ExpiringTerminalsUseCase
 from tradecopier.application.use_case.receiving_message import \
     ReceivingMessageUseCase
-from tradecopier.infrastructure.adapters.connection_adapter import (
-    ReceivingMessagePresenter, WebSocketsConnectionAdapter)
+from tradecopier.infrastructure.adapters.backplane import Backplane
+from tradecopier.infrastructure.adapters.connection_adapter import \
+    WebSocketsConnectionAdapter
+from tradecopier.infrastructure.adapters.forwarding import Forwarder
+from tradecopier.infrastructure.adapters.metrics import (HistogramMetrics,
+                                                         MetricsEndpoint)
+from tradecopier.infrastructure.adapters.outbound import (ExpiryPolicy,
+                                                          OverflowPolicy)
+from tradecopier.infrastructure.adapters.scheduler import FairScheduler
+from tradecopier.infrastructure.adapters.tcp_backplane import TcpBackplane
+from tradecopier.infrastructure.repositories.executor_repo import (
+    ExecutorRouteRepo, ExecutorRuleRepo, ExecutorTerminalRepo,
+    ThreadLocalConnection)
 from tradecopier.infrastructure.repositories.route_repo import \
     SqlAlchemyRouteRepo
-from tradecopier.infrastructure.repositories.rule_repo import \
-    SqlAlchemyRuleRepo
+from tradecopier.infrastructure.repositories.rule_repo import (
+    AsyncCachedRuleRepo, SqlAlchemyRuleRepo)
 from tradecopier.infrastructure.repositories.sql_model import metadata
-from tradecopier.infrastructure.repositories.terminal_repo import \
-    SqlAlchemyTerminalRepo
+from tradecopier.infrastructure.repositories.terminal_repo import (
+    AsyncCachedTerminalRepo, SqlAlchemyTerminalRepo, UnknownTerminalCache)
 
 
-def get_db_connection():
-    engine = create_engine(os.environ["DB_DSN"])
+def get_db_engine(pool_size: int):
+    dsn = os.environ["DB_DSN"]
+    options = (
+        {}
+        if dsn.startswith("sqlite")
+        else {"pool_size": pool_size, "isolation_level": "READ COMMITTED"}
+    )
+    engine = create_engine(dsn, pool_pre_ping=True, **options)
     create_db(engine)
     logger.debug("db created")
-    db_conn = engine.connect()
-    db_conn.execute("set session transaction ISOLATION LEVEL READ COMMITTED;")
-    logger.debug("sql engine connected")
-    return db_conn
+    return engine
 
 
 def create_db(engine):
     metadata.create_all(engine)
 
 
-def main(argv: Optional[List[str]]) -> None:
-    config_path = os.environ.get(
-        "CONFIG_PATH",
-        os.path.join(os.path.dirname(__file__), os.pardir, ".env"),
+async def refresh_caches(
+    route_repo: AsyncRouteRepo,
+    routing_table: RoutingTable,
+    rule_repo: AsyncCachedRuleRepo,
+    expiring: ExpiringTerminalsUseCase,
+    interval: float,
+):
+    # rules and routes are edited by the rest api process, so local caches are
+    # only as fresh as the last refresh
+    while True:
+        await asyncio.sleep(interval)
+        if routing_table.load(await route_repo.get_all()):
+            logger.info(f"routing table updated, version {routing_table.version}")
+            expiring.sync()
+        rule_repo.cache.clear()
+
+
+async def log_outbound_stats(wsca: WebSocketsConnectionAdapter, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        for terminal_id, stats in wsca.outbound_stats().items():
+            if stats["depth"] or stats["dropped"] or stats["expired"]:
+                logger.info(f"outbound {terminal_id}: {stats}")
+
+
+async def log_latencies(metrics: HistogramMetrics, interval: float):
+    # interval histograms, so every dump reflects the last period only
+    while True:
+        await asyncio.sleep(interval)
+        for stage, summary in metrics.snapshot().items():
+            logger.info(f"latency {stage} us: {summary}")
+        metrics.reset()
+
+
+def get_tracer() -> Optional[tracing.Tracer]:
+    sample_every = int(os.environ.get("TRACE_SAMPLE", 0))
+    terminals = [
+        UUID(t) for t in os.environ.get("TRACE_TERMINALS", "").split(",") if t
+    ]
+    if not (sample_every or terminals):
+        return None
+    # trace records go to their own sink, written by a background thread so
+    # the event loop never waits on it
+    logger.remove()
+    logger.add(sys.stderr, filter=lambda r: not tracing.is_trace_record(r))
+    logger.add(
+        os.environ.get("TRACE_PATH") or sys.stderr,
+        filter=tracing.is_trace_record,
+        level="DEBUG",
+        enqueue=True,
     )
-    dotenv.load_dotenv(config_path)
-    # logger.add(sys.stderr, level=f"{os.getenv('LOG_LEVEL')}")
-    wsca = WebSocketsConnectionAdapter()
-    db_conn = get_db_connection()
-    rec_msg_presenter = ReceivingMessagePresenter()
-    route_repo = SqlAlchemyRouteRepo(db_conn)
-    term_repo = SqlAlchemyTerminalRepo(db_conn)
-    rule_repo = SqlAlchemyRuleRepo(db_conn)
+    return tracing.Tracer(sample_every, terminals)
+
+
+E = TypeVar("E", bound=IntEnum)
+
+
+def get_by_name(variable: str, enum: Type[E]) -> Dict[E, float]:
+    # e.g. MAX_AGE_SEC=DEAL=2,PENDING=30
+    values = {}
+    for item in os.environ.get(variable, "").split(","):
+        if item:
+            name, _, value = item.partition("=")
+            values[enum[name.strip()]] = float(value)
+    return values
+
+
+def get_by_terminal(variable: str, enum: Type[E]) -> Dict[UUID, E]:
+    # e.g. OUTBOUND_OVERFLOW_POLICY_BY_TERMINAL=<terminal id>=DISCONNECT,...
+    values = {}
+    for item in os.environ.get(variable, "").split(","):
+        if item:
+            terminal_id, _, name = item.partition("=")
+            values[UUID(terminal_id.strip())] = enum[name.strip()]
+    return values
+
+
+def get_scheduler() -> FairScheduler:
+    # e.g. INGRESS_RATE=BRONZE=20,SILVER=50, customer types left out are not
+    # rate limited
+    weights = get_by_name("SCHEDULER_WEIGHTS", CustomerType)
+    return FairScheduler(
+        quantum=float(os.environ.get("SCHEDULER_QUANTUM_MS", 1)) / 1000,
+        weights={t: int(weight) for t, weight in weights.items()} or None,
+        rates=get_by_name("INGRESS_RATE", CustomerType),
+        burst=float(os.environ.get("INGRESS_BURST_SEC", 1)),
+        concurrency=int(os.environ.get("SCHEDULER_CONCURRENCY", 16)),
+    )
+
+
+def get_backplane(worker_id: int, workers: int) -> Optional[Backplane]:
+    # a broker joins all workers of all nodes into one cluster, without it
+    # the workers of this box are linked directly
+    broker = os.environ.get("BACKPLANE_BROKER")
+    if broker:
+        host, _, port = broker.rpartition(":")
+        node_id = f"{socket.gethostname()}-{os.getpid()}"
+        return TcpBackplane(node_id, host or "127.0.0.1", int(port))
+    if workers > 1:
+        socket_dir = os.environ.get(
+            "ROUTER_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "tradecopier")
+        )
+        os.makedirs(socket_dir, exist_ok=True)
+        return Forwarder(worker_id, workers, socket_dir)
+    return None
+
+
+def serve(worker_id: int = 0, workers: int = 1) -> None:
+    metrics_port = os.environ.get("METRICS_PORT")
+    metrics_dump = float(os.environ.get("METRICS_DUMP_SEC", 0))
+    metrics = HistogramMetrics() if metrics_port or metrics_dump else None
+    backplane = get_backplane(worker_id, workers)
+    wsca = WebSocketsConnectionAdapter(
+        host=os.environ.get("ROUTER_HOST", ""),
+        port=int(os.environ.get("ROUTER_PORT", 6789)),
+        send_timeout=float(os.environ.get("SEND_TIMEOUT_SEC", 5)),
+        queue_size=int(os.environ.get("OUTBOUND_QUEUE_SIZE", 256)),
+        overflow_policy=OverflowPolicy[
+            os.environ.get("OUTBOUND_OVERFLOW_POLICY", "DROP_OLDEST")
+        ],
+        backplane=backplane,
+        reuse_port=workers > 1,
+        metrics=metrics,
+        tracer=get_tracer(),
+        ask_registration_interval=float(
+            os.environ.get("ASK_REGISTRATION_INTERVAL_SEC", 5)
+        ),
+        # actions left out never expire
+        max_age=get_by_name("MAX_AGE_SEC", TradeAction),
+        expiry_policy=ExpiryPolicy[os.environ.get("EXPIRY_POLICY", "DROP")],
+        scheduler=get_scheduler(),
+    )
+    # terminals left out get OUTBOUND_OVERFLOW_POLICY
+    for terminal_id, policy in get_by_terminal(
+        "OUTBOUND_OVERFLOW_POLICY_BY_TERMINAL", OverflowPolicy
+    ).items():
+        wsca.set_overflow_policy(terminal_id, policy)
+    db_workers = int(os.environ.get("DB_WORKERS", 4))
+    db_conn = ThreadLocalConnection(get_db_engine(db_workers))
+    logger.debug("sql engine connected")
+    executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="db")
+    route_repo = ExecutorRouteRepo(SqlAlchemyRouteRepo(db_conn), executor)
+    term_repo = AsyncCachedTerminalRepo(
+        ExecutorTerminalRepo(SqlAlchemyTerminalRepo(db_conn), executor),
+        UnknownTerminalCache(float(os.environ.get("UNKNOWN_TERMINAL_TTL_SEC", 10))),
+    )
+    if backplane is not None:
+        # a terminal connected to another worker has registered by now
+        backplane.on_presence(term_repo.unknown.discard)
+    rule_repo = AsyncCachedRuleRepo(
+        ExecutorRuleRepo(SqlAlchemyRuleRepo(db_conn), executor)
+    )
+    loop = asyncio.get_event_loop()
+    routing_table = RoutingTable(loop.run_until_complete(route_repo.get_all()))
+    logger.info(f"routing table loaded, {len(routing_table)} routes")
+    expiring = ExpiringTerminalsUseCase(conn_handler=wsca, routing_table=routing_table)
+    expiring.sync()
     uc = ReceivingMessageUseCase(
         conn_handler=wsca,
         route_repo=route_repo,
         terminal_repo=term_repo,
         rule_repo=rule_repo,
-        outboundary=rec_msg_presenter,
+        routing_table=routing_table,
+        metrics=metrics,
+    )
+
+    start_server = wsca.start_server(uc)
+    logger.info(f"Starting the server, worker {worker_id + 1} of {workers}")
+
+    loop.run_until_complete(start_server)
+    if metrics_port:
+        # one port per worker, each worker measures its own traffic
+        endpoint = MetricsEndpoint(metrics, port=int(metrics_port) + worker_id)
+        loop.run_until_complete(endpoint.start())
+    if metrics_dump:
+        loop.create_task(log_latencies(metrics, metrics_dump))
+    loop.create_task(
+        refresh_caches(
+            route_repo,
+            routing_table,
+            rule_repo,
+            expiring,
+            float(os.environ.get("ROUTES_REFRESH_SEC", 30)),
+        )
+    )
+    loop.create_task(expiring.run())
+    loop.create_task(
+        log_outbound_stats(wsca, float(os.environ.get("STATS_INTERVAL_SEC", 60)))
     )
+    loop.run_forever()
 
-    start_server = wsca.start_server(uc, rec_msg_presenter)
-    logger.info("Starting the server")
 
-    asyncio.get_event_loop().run_until_complete(start_server)
-    asyncio.get_event_loop().run_forever()
+def supervise(workers: int) -> None:
+    # every worker accepts on the shared port and owns the sockets it got,
+    # frames for terminals held elsewhere go through the forwarder
+    context = multiprocessing.get_context("spawn")
+    processes: Dict[int, multiprocessing.process.BaseProcess] = {}
+
+    def spawn(worker_id: int):
+        process = context.Process(
+            target=serve, args=(worker_id, workers), name=f"router-{worker_id}"
+        )
+        process.start()
+        processes[worker_id] = process
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # once, so the workers don't race creating tables
+    get_db_engine(1).dispose()
+    for worker_id in range(workers):
+        spawn(worker_id)
+    try:
+        while True:
+            time.sleep(1)
+            for worker_id, process in list(processes.items()):
+                if not process.is_alive():
+                    logger.warning(
+                        f"worker {worker_id} exited ({process.exitcode}), restarting"
+                    )
+                    spawn(worker_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+
+def main(argv: Optional[List[str]]) -> None:
+    config_path = os.environ.get(
+        "CONFIG_PATH",
+        os.path.join(os.path.dirname(__file__), os.pardir, ".env"),
+    )
+    dotenv.load_dotenv(config_path)
+    # logger.add(sys.stderr, level=f"{os.getenv('LOG_LEVEL')}")
+    workers = int(os.environ.get("ROUTER_WORKERS", 1))
+    if workers > 1:
+        supervise(workers)
+    else:
+        serve()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,24 @@
+import abc
+from enum import IntEnum
+
+
+class Stage(IntEnum):
+    DECODE = 0
+    PARSE = 1
+    TERMINAL_LOOKUP = 2
+    ROUTE_LOOKUP = 3
+    SOURCE_RULE = 4
+    DESTINATION_RULE = 5
+    SERIALIZE = 6
+    SEND = 7
+
+
+class MetricsAdapter(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def observe(self, stage: Stage, elapsed_ns: int):
+        """Records one `stage` run that took `elapsed_ns` nanoseconds."""
+
+
+class NullMetrics(MetricsAdapter):
+    def observe(self, stage: Stage, elapsed_ns: int):
+        pass
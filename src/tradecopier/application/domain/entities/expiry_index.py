@@ -0,0 +1,53 @@
+import heapq
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from tradecopier.application.domain.value_objects import TerminalId
+
+
+class ExpiryIndex:
+    """Priority queue of terminal expiry times.
+
+    Rescheduling or discarding a terminal leaves its old heap entry behind,
+    entries not matching `_expiries` are skipped when they surface.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, TerminalId]] = []
+        self._expiries: Dict[TerminalId, datetime] = {}
+
+    def schedule(self, terminal_id: TerminalId, when: datetime) -> None:
+        if self._expiries.get(terminal_id) == when:
+            return
+        self._expiries[terminal_id] = when
+        heapq.heappush(self._heap, (when, terminal_id))
+
+    def discard(self, terminal_id: TerminalId) -> None:
+        self._expiries.pop(terminal_id, None)
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._expiries.clear()
+
+    def next_expiry(self) -> Optional[datetime]:
+        self._skip_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: datetime) -> List[TerminalId]:
+        expired = []
+        while self._skip_stale() and self._heap[0][0] <= now:
+            _, terminal_id = heapq.heappop(self._heap)
+            del self._expiries[terminal_id]
+            expired.append(terminal_id)
+        return expired
+
+    def __len__(self):
+        return len(self._expiries)
+
+    def _skip_stale(self) -> bool:
+        while self._heap:
+            when, terminal_id = self._heap[0]
+            if self._expiries.get(terminal_id) == when:
+                return True
+            heapq.heappop(self._heap)
+        return False
@@ -1,8 +1,30 @@
-from typing import Optional, Union
+import json
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from tradecopier.application.domain.entities.order import Order
-from tradecopier.application.domain.value_objects import AccountId, TerminalId
+from tradecopier.application.domain.value_objects import (AccountId, Priority,
+                                                          Symbol, TerminalId,
+                                                          TradeAction)
+
+
+Dumps = Callable[[Dict[str, Any]], Any]
+# builds the frame of the outgoing copy straight from the inbound one, None
+# when it can't for the given format
+RawEncoder = Callable[[Dumps], Optional[Any]]
+
+
+# actions reducing the exposure of followers, closing deals included
+_PROTECTIVE = frozenset((TradeAction.SLTP, TradeAction.REMOVE, TradeAction.CLOSE_BY))
+# actions whose pending copy is outdated by a later one for the same ticket
+_COALESCED = frozenset((TradeAction.SLTP, TradeAction.MODIFY))
+
+
+def _priority(order: Order) -> Priority:
+    action = order.action
+    if action in _PROTECTIVE or (action == TradeAction.DEAL and order.position):
+        return Priority.PROTECTIVE
+    return Priority.REGULAR
 
 
 class Message(BaseModel):
@@ -18,17 +40,38 @@ class RegisterMessage(Message):
     name: Optional[str] = None
     broker: str
     is_cyphered: bool = False
+    wire_format: Optional[str] = None
 
 
 class InTradeMessage(Message):
     body: Order
     account_id: AccountId
     is_cyphered: bool = False
+    _raw_encoder: Optional[RawEncoder] = PrivateAttr(default=None)
+
+
+class InTradeBatchMessage(Message):
+    body: List[Order]
+    account_id: AccountId
+    is_cyphered: bool = False
+    _raw_encoder: Optional[RawEncoder] = PrivateAttr(default=None)
+
+    def split(self) -> List[InTradeMessage]:
+        return [
+            InTradeMessage.construct(
+                terminal_id=self.terminal_id,
+                body=order,
+                account_id=self.account_id,
+                is_cyphered=self.is_cyphered,
+            )
+            for order in self.body
+        ]
 
 
 class IncomingMessage(BaseModel):
     message: Union[
         InTradeMessage,
+        InTradeBatchMessage,
         RegisterMessage,
     ]
 
@@ -47,8 +90,77 @@ class OutTradeMessage(BaseModel):
         return hash(self.body)
 
 
+class OutTradeBatchMessage(BaseModel):
+    body: List[Order]
+
+    def __hash__(self):
+        return hash(tuple(self.body))
+
+
 class OutgoingMessage(BaseModel):
-    message: Union[AskRegistrationMessage, OutTradeMessage]
+    message: Union[AskRegistrationMessage, OutTradeMessage, OutTradeBatchMessage]
+    _frames: Dict[Callable, Any] = PrivateAttr(default_factory=dict)
+    _raw_encoder: Optional[RawEncoder] = PrivateAttr(default=None)
+    _delivery: Optional[
+        Tuple[Priority, Optional[Hashable], Optional[int], Optional[Symbol]]
+    ] = PrivateAttr(default=None)
+
+    @classmethod
+    def passthrough(
+        cls, message: Union[InTradeMessage, InTradeBatchMessage]
+    ) -> "OutgoingMessage":
+        """Unchanged copy of `message`, encoded from the inbound frame when
+        the decoder kept it."""
+        # the orders were validated on the way in
+        body = message.body
+        if isinstance(message, InTradeMessage):
+            outgoing = cls.construct(message=OutTradeMessage.construct(body=body))
+        elif len(body) > 1:
+            outgoing = cls.construct(message=OutTradeBatchMessage.construct(body=body))
+        else:
+            # a lone order goes out unbatched, unlike its inbound frame
+            return cls.construct(message=OutTradeMessage.construct(body=body[0]))
+        outgoing._raw_encoder = message._raw_encoder
+        return outgoing
+
+    def encode(self, dumps: Dumps = json.dumps):
+        # the message is shared by all destinations of a group, so it is
+        # serialized once per wire format and must not be mutated afterwards
+        frame = self._frames.get(dumps)
+        if frame is None:
+            if self._raw_encoder is not None:
+                frame = self._raw_encoder(dumps)
+            if frame is None:
+                frame = dumps(self.dict())
+            self._frames[dumps] = frame
+        return frame
+
+    def delivery(
+        self,
+    ) -> Tuple[Priority, Optional[Hashable], Optional[int], Optional[Symbol]]:
+        """Lane of the message, the key under which it replaces a pending
+        copy of an earlier one (None if it must not), and the ticket and
+        symbol it is about (None if not a single one)."""
+        if self._delivery is None:
+            body = self.message.body
+            key = ticket = symbol = None
+            if isinstance(body, Order):
+                priority = _priority(body)
+                ticket = body.position or None
+                symbol = body.symbol
+                if body.action in _COALESCED and ticket:
+                    key = (body.action, ticket)
+            elif isinstance(body, list):
+                # a batch goes out as one frame, in the lane of its most
+                # urgent order
+                priority = min(map(_priority, body))
+                symbols = {order.symbol for order in body}
+                if len(symbols) == 1:
+                    symbol = symbols.pop()
+            else:
+                priority = Priority.REGULAR
+            self._delivery = (priority, key, ticket, symbol)
+        return self._delivery
 
     def __hash__(self):
         return hash(self.message)
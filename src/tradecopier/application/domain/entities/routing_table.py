@@ -0,0 +1,109 @@
+from typing import Dict, Iterable, List, Tuple
+
+from tradecopier.application.domain.entities.route import Route
+from tradecopier.application.domain.entities.terminal import Terminal
+from tradecopier.application.domain.value_objects import (RouteStatus,
+                                                          TerminalId)
+
+
+class RoutingTable:
+    """In-memory snapshot of routes keyed by source terminal.
+
+    Every mutation bumps `version`, so consumers holding derived data (plans,
+    sessions) can cheaply tell whether it is stale.
+
+    Terminal activity is evaluated when routes are loaded and afterwards only
+    changes through `deactivate`, so plans never hold inactive destinations.
+    """
+
+    def __init__(self, routes: Iterable[Route] = ()):
+        self._version = 0
+        self._routes: Dict[TerminalId, Dict[TerminalId, Route]] = {}
+        self._plans: Dict[TerminalId, Tuple[Terminal, ...]] = {}
+        self._terminals: Dict[TerminalId, Terminal] = {}
+        self._active: Dict[TerminalId, bool] = {}
+        self.load(routes)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def load(self, routes: Iterable[Route]) -> bool:
+        table: Dict[TerminalId, Dict[TerminalId, Route]] = {}
+        for route in routes:
+            table.setdefault(route.source.terminal_id, {})[
+                route.destination.terminal_id
+            ] = route
+        if table == self._routes:
+            return False
+        self._routes = table
+        self._terminals = {}
+        self._active = {}
+        for src_routes in table.values():
+            for route in src_routes.values():
+                self._track(route)
+        self._plans = {src: self._build_plan(dst) for src, dst in table.items()}
+        self._version += 1
+        return True
+
+    def upsert(self, route: Route) -> None:
+        src_id = route.source.terminal_id
+        src_routes = self._routes.setdefault(src_id, {})
+        src_routes[route.destination.terminal_id] = route
+        self._track(route)
+        self._plans[src_id] = self._build_plan(src_routes)
+        self._version += 1
+
+    def remove(self, source_id: TerminalId, destination_id: TerminalId) -> None:
+        src_routes = self._routes.get(source_id)
+        if src_routes is None or src_routes.pop(destination_id, None) is None:
+            return
+        if src_routes:
+            self._plans[source_id] = self._build_plan(src_routes)
+        else:
+            del self._routes[source_id]
+            del self._plans[source_id]
+        self._version += 1
+
+    def deactivate(self, terminal_id: TerminalId) -> bool:
+        if not self._active.get(terminal_id, False):
+            return False
+        self._active[terminal_id] = False
+        for src_id, src_routes in self._routes.items():
+            if terminal_id in src_routes:
+                self._plans[src_id] = self._build_plan(src_routes)
+        self._version += 1
+        return True
+
+    def is_active(self, terminal: Terminal) -> bool:
+        active = self._active.get(terminal.terminal_id)
+        return terminal.is_active if active is None else active
+
+    def terminals(self) -> List[Terminal]:
+        return [
+            terminal
+            for terminal_id, terminal in self._terminals.items()
+            if self._active[terminal_id]
+        ]
+
+    def get(self, source_id: TerminalId) -> List[Route]:
+        return list(self._routes.get(source_id, {}).values())
+
+    def destinations(self, source_id: TerminalId) -> Tuple[Terminal, ...]:
+        return self._plans.get(source_id, ())
+
+    def __len__(self):
+        return sum(len(v) for v in self._routes.values())
+
+    def _track(self, route: Route) -> None:
+        for terminal in (route.source, route.destination):
+            self._terminals[terminal.terminal_id] = terminal
+            self._active[terminal.terminal_id] = terminal.is_active
+
+    def _build_plan(self, routes: Dict[TerminalId, Route]) -> Tuple[Terminal, ...]:
+        return tuple(
+            route.destination
+            for route in routes.values()
+            if route.status == RouteStatus.BOTH
+            and self._active[route.destination.terminal_id]
+        )
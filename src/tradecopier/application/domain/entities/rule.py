@@ -1,7 +1,8 @@
 import json
 import operator
 from decimal import Decimal
-from typing import Generator, List, Optional, Union
+from typing import (Any, Callable, Dict, Generator, Hashable, List, Optional,
+                    Union)
 
 from loguru import logger
 from pydantic import BaseModel, validator
@@ -12,6 +13,66 @@ from tradecopier.application.domain.value_objects import (FilterOperation,
                                                           TerminalId,
                                                           TransformOperation)
 
+RulePipeline = Callable[[InTradeMessage], Optional[InTradeMessage]]
+
+
+def _pass(message: InTradeMessage) -> Optional[InTradeMessage]:
+    return message
+
+
+def _block(message: InTradeMessage) -> Optional[InTradeMessage]:
+    return None
+
+
+def _overlay(message: InTradeMessage, changes: Dict[str, Any]) -> InTradeMessage:
+    # shallow copies of the message and its order, everything not in `changes`
+    # stays shared with the original, which is never touched
+    return message.copy(update={"body": message.body.copy(update=changes)})
+
+
+def _reversal(body: Order) -> Dict[str, Any]:
+    order_type = body.order_type
+    if order_type in (
+        OrderType.ORDER_TYPE_CLOSE_BY,
+        OrderType.ORDER_TYPE_BUY_STOP_LIMIT,
+        OrderType.ORDER_TYPE_SELL_STOP_LIMIT,
+    ):
+        logger.debug(f"Order type {order_type} is not supported")
+    sl = body.sl
+    tp = body.tp
+    sl_points = body.sl_points
+    tp_points = body.tp_points
+    price = body.price
+    if sl is not None and sl_points is None:
+        raise ValueError(f"slL{sl}, but sl_points is None")
+    if tp is not None and tp_points is None:
+        raise ValueError(f"tp {tp}, but tp_points is None")
+    if order_type in (
+        OrderType.ORDER_TYPE_BUY,
+        OrderType.ORDER_TYPE_BUY_LIMIT,
+        OrderType.ORDER_TYPE_BUY_STOP,
+    ):
+        order_type = OrderType(int(order_type) + 1)  # buy -> sell
+        if sl != 0 and sl_points is not None:
+            price = price if price != 0 else sl + sl_points
+            sl = price + sl_points
+        if tp != 0 and tp_points is not None:
+            price = price if price != 0 else tp - tp_points
+            tp = price - tp_points
+    else:  # sell -> buy
+        order_type = OrderType(int(order_type) - 1)
+        if sl != 0 and sl_points is not None:
+            price = price if price != 0 else sl - sl_points
+            sl = price - sl_points
+        if tp != 0 and tp_points is not None:
+            price = price if price != 0 else tp + tp_points
+            tp = price + tp_points
+    return {"sl": sl, "tp": tp, "order_type": order_type}
+
+
+def _reverse(message: InTradeMessage) -> Optional[InTradeMessage]:
+    return _overlay(message, _reversal(message.body))
+
 
 class Expression(BaseModel):
     field: Union[str, None]
@@ -38,6 +99,22 @@ class Rule:
     def apply(self, message: InTradeMessage) -> Optional[InTradeMessage]:
         return message
 
+    def compile(self) -> RulePipeline:
+        """Pipeline equivalent to `apply` which never mutates its input: a
+        transformed message is a new one sharing all untouched fields."""
+        return _pass
+
+    @property
+    def fingerprint(self) -> Hashable:
+        """Content of the rule without its terminal: rules with equal
+        fingerprints produce the same result for the same message."""
+        return (self.__class__.__name__,)
+
+    @property
+    def transforms(self) -> bool:
+        """Whether messages let through may differ from the input ones."""
+        return False
+
     def dict(self):
         return self._expr.dict()
 
@@ -55,6 +132,15 @@ class Rule:
 
 
 class TransformRule(Rule):
+    @property
+    def fingerprint(self) -> Hashable:
+        expr = self._expr
+        return (self.__class__.__name__, expr.field, expr.value, expr.operator)
+
+    @property
+    def transforms(self) -> bool:
+        return True
+
     def __eq__(self, other):
         if not isinstance(other, TransformRule):
             return False
@@ -96,48 +182,45 @@ class TransformRule(Rule):
                 return message
 
         if self._expr.operator == TransformOperation.REVERSE:
-            order_type = message.body.order_type
-            if order_type in (
-                OrderType.ORDER_TYPE_CLOSE_BY,
-                OrderType.ORDER_TYPE_BUY_STOP_LIMIT,
-                OrderType.ORDER_TYPE_SELL_STOP_LIMIT,
-            ):
-                logger.debug(f"Order type {order_type} is not supported")
-            sl = message.body.sl
-            tp = message.body.tp
-            sl_points = message.body.sl_points
-            tp_points = message.body.tp_points
-            price = message.body.price
-            if sl is not None and sl_points is None:
-                raise ValueError(f"slL{sl}, but sl_points is None")
-            if tp is not None and tp_points is None:
-                raise ValueError(f"tp {tp}, but tp_points is None")
-            if order_type in (
-                OrderType.ORDER_TYPE_BUY,
-                OrderType.ORDER_TYPE_BUY_LIMIT,
-                OrderType.ORDER_TYPE_BUY_STOP,
-            ):
-                order_type = OrderType(int(order_type) + 1)  # buy -> sell
-                if sl != 0 and sl_points is not None:
-                    price = price if price != 0 else sl + sl_points
-                    sl = price + sl_points
-                if tp != 0 and tp_points is not None:
-                    price = price if price != 0 else tp - tp_points
-                    tp = price - tp_points
-            else:  # sell -> buy
-                order_type = OrderType(int(order_type) - 1)
-                if sl != 0 and sl_points is not None:
-                    price = price if price != 0 else sl - sl_points
-                    sl = price - sl_points
-                if tp != 0 and tp_points is not None:
-                    price = price if price != 0 else tp + tp_points
-                    tp = price + tp_points
-            message.body.sl = sl
-            message.body.tp = tp
-            message.body.order_type = order_type
+            for field, field_value in _reversal(message.body).items():
+                setattr(message.body, field, field_value)
             return message
         return None
 
+    def compile(self) -> RulePipeline:
+        field = self._expr.field
+        value = self._expr.value
+        if self._expr.operator == TransformOperation.REVERSE:
+            return _reverse
+        if field is None:
+            return _block
+        if self._expr.operator in (TransformOperation.ADD, TransformOperation.APPEND):
+
+            def transform(message: InTradeMessage) -> Optional[InTradeMessage]:
+                field_value = getattr(message.body, field)
+                return _overlay(
+                    message,
+                    {field: field_value + value if field_value is not None else value},
+                )
+
+        elif self._expr.operator == TransformOperation.MULTIPLY:
+
+            def transform(message: InTradeMessage) -> Optional[InTradeMessage]:
+                field_value = getattr(message.body, field)
+                return _overlay(
+                    message,
+                    {field: field_value * value if field_value is not None else value},
+                )
+
+        elif self._expr.operator == TransformOperation.SET:
+
+            def transform(message: InTradeMessage) -> Optional[InTradeMessage]:
+                return _overlay(message, {field: value})
+
+        else:
+            return _block
+        return transform
+
 
 class FilterRule(Rule):
     op_map = {
@@ -187,6 +270,11 @@ class FilterRule(Rule):
                     )
         return False
 
+    @property
+    def fingerprint(self) -> Hashable:
+        expr = self._expr
+        return (self.__class__.__name__, expr.field, expr.value, expr.operator)
+
     def __eq__(self, other):
         if not isinstance(other, FilterRule):
             return False
@@ -209,6 +297,28 @@ class FilterRule(Rule):
             )
         return message if filter_result else None
 
+    def compile(self) -> RulePipeline:
+        if (
+            self._expr.field is None
+            or self._expr.operator is None
+            or not isinstance(self._expr.operator, FilterOperation)
+        ):
+            return _block
+        getter = operator.attrgetter(self._expr.field)
+        value = self._expr.value
+        if self._expr.operator == FilterOperation.IN:
+
+            def check(message: InTradeMessage) -> Optional[InTradeMessage]:
+                return message if value in getter(message.body) else None
+
+        else:
+            op = FilterRule.op_map[self._expr.operator]
+
+            def check(message: InTradeMessage) -> Optional[InTradeMessage]:
+                return message if op(getter(message.body), value) else None
+
+        return check
+
     @property
     def is_valid(self) -> bool:
         return FilterRule.examine(self._expr) if self._expr is not None else True
@@ -244,6 +354,33 @@ class ComplexRule(Rule):
                 processing_message = rule.apply(processing_message)
         return processing_message
 
+    def compile(self) -> RulePipeline:
+        steps = tuple(rule.compile() for rule in self._rules)
+        if len(steps) == 0:
+            return _pass
+        if len(steps) == 1:
+            return steps[0]
+
+        def pipeline(message: InTradeMessage) -> Optional[InTradeMessage]:
+            processing_message: Optional[InTradeMessage] = message
+            for step in steps:
+                processing_message = step(processing_message)
+                if processing_message is None:
+                    return None
+            return processing_message
+
+        return pipeline
+
+    @property
+    def fingerprint(self) -> Hashable:
+        return (self.__class__.__name__,) + tuple(
+            rule.fingerprint for rule in self._rules
+        )
+
+    @property
+    def transforms(self) -> bool:
+        return any(rule.transforms for rule in self._rules)
+
     def __eq__(self, other):
         if not isinstance(other, ComplexRule):
             return False
@@ -254,3 +391,31 @@ class ComplexRule(Rule):
             and all(s == o for s, o in zip(self._rules, other._rules))
         )
         return result
+
+
+class CompiledRule(Rule):
+    def __init__(self, rule: Rule):
+        self.terminal_id = rule.terminal_id
+        self.source = rule
+        self._pipeline = rule.compile()
+        self._fingerprint = rule.fingerprint
+        self._transforms = rule.transforms
+
+    @property
+    def fingerprint(self) -> Hashable:
+        return self._fingerprint
+
+    @property
+    def transforms(self) -> bool:
+        return self._transforms
+
+    def apply(self, message: InTradeMessage) -> Optional[InTradeMessage]:
+        return self._pipeline(message)
+
+    def compile(self) -> RulePipeline:
+        return self._pipeline
+
+    def __eq__(self, other):
+        if isinstance(other, CompiledRule):
+            other = other.source
+        return self.source == other
@@ -31,6 +31,16 @@ class Terminal(BaseModel):
         if self.customer_type == CustomerType.BRONZE:
             return self.registered_at + timedelta(seconds=DEFAULT_LIFETIME)
 
+    @property
+    def active_until(self) -> Optional[datetime]:
+        """Moment after which the terminal stops being active by itself, None
+        if it never does."""
+        if not self.enabled or self.customer_type != CustomerType.BRONZE:
+            return None
+        if self.expire_at:
+            return self.expire_at
+        return self.registered_at + timedelta(seconds=DEFAULT_LIFETIME)
+
     @property
     def terminal_brand(self) -> int:
         result = TerminalBrand.UNKNOWN.value
@@ -131,6 +131,12 @@ class CustomerType(IntEnum):
     GOLD = 2
 
 
+class Priority(IntEnum):
+    # delivery lanes, lower ones are sent first
+    PROTECTIVE = 0
+    REGULAR = 1
+
+
 class EntityNotFoundException(Exception):
     pass
 
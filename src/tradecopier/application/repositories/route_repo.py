@@ -24,3 +24,31 @@ class RouteRepo(metaclass=abc.ABCMeta):
         self, terminal_id: TerminalId, term_type: TerminalType
     ) -> List[Route]:
         pass
+
+    @abc.abstractmethod
+    def get_all(self) -> List[Route]:
+        pass
+
+
+class AsyncRouteRepo(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    async def get(self, route_id: RouteId) -> Route:
+        pass
+
+    @abc.abstractmethod
+    async def delete(self, route_id: RouteId) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def save(self, route: Route) -> RouteId:
+        pass
+
+    @abc.abstractmethod
+    async def get_by_terminal_id(
+        self, terminal_id: TerminalId, term_type: TerminalType
+    ) -> List[Route]:
+        pass
+
+    @abc.abstractmethod
+    async def get_all(self) -> List[Route]:
+        pass
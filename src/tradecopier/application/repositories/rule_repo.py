@@ -1,4 +1,5 @@
 import abc
+from typing import Optional
 
 from tradecopier.application.domain.entities.rule import Rule
 from tradecopier.application.domain.value_objects import TerminalId
@@ -24,3 +25,18 @@ class RuleRepo(metaclass=abc.ABCMeta):
     # @abc.abstractmethod
     # def mark_change_consumed(self, terminal_id: TerminalId):
     #     pass
+
+
+class AsyncRuleRepo(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    async def get(self, terminal_id: TerminalId) -> Rule:
+        pass
+
+    @abc.abstractmethod
+    async def save(self, rule: Rule):
+        pass
+
+    @property
+    def version(self) -> Optional[int]:
+        """Changes whenever a rule may have changed, None if not tracked."""
+        return None
@@ -17,3 +17,20 @@ class TerminalRepo(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def save(self, terminal: Terminal) -> TerminalId:
         pass
+
+
+class AsyncTerminalRepo(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    async def get(self, terminal_id: TerminalId) -> Optional[Terminal]:
+        pass
+
+    @abc.abstractmethod
+    async def get_by_tail(self, terminal_id_tail: str) -> Optional[Terminal]:
+        pass
+
+    @abc.abstractmethod
+    async def save(self, terminal: Terminal) -> TerminalId:
+        pass
+
+    def forget(self, terminal_id: TerminalId) -> None:
+        """Makes the next `get` of `terminal_id` ask the storage."""
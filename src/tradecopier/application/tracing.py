@@ -0,0 +1,49 @@
+"""Sampled tracing of the message path.
+
+Whether a message is traced is decided once, when it arrives, and kept in a
+context variable while it is processed. Untraced messages cost one lookup
+and never build a log record.
+"""
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable
+
+from loguru import logger
+from tradecopier.application.domain.value_objects import TerminalId
+
+_traced: ContextVar[bool] = ContextVar("traced", default=False)
+_logger = logger.bind(trace=True)
+
+
+def active() -> bool:
+    return _traced.get()
+
+
+def trace(template: str, *args: Callable[[], Any]) -> None:
+    """Logs `template` formatted with the results of `args`, which are only
+    called once the record is really emitted."""
+    _logger.opt(lazy=True, depth=1).debug(template, *args)
+
+
+def is_trace_record(record: Dict[str, Any]) -> bool:
+    return record["extra"].get("trace", False)
+
+
+class Tracer:
+    """Picks the messages to trace: every one of `terminals` plus one in
+    `sample_every` of the rest."""
+
+    def __init__(self, sample_every: int = 0, terminals: Iterable[TerminalId] = ()):
+        self._sample_every = sample_every
+        self._seen = 0
+        self.terminals = frozenset(terminals)
+        self.enabled = bool(sample_every or self.terminals)
+
+    def begin(self, terminal_id: TerminalId) -> bool:
+        """Decides whether the message of `terminal_id` being processed in the
+        current context is traced."""
+        traced = terminal_id in self.terminals
+        if not traced and self._sample_every:
+            self._seen += 1
+            traced = self._seen % self._sample_every == 0
+        _traced.set(traced)
+        return traced
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime
+from typing import Callable, List
+
+from loguru import logger
+from tradecopier.application.adapters.connection_adapter import \
+    ConnectionHandlerAdapter
+from tradecopier.application.domain.entities.expiry_index import ExpiryIndex
+from tradecopier.application.domain.entities.routing_table import \
+    RoutingTable
+from tradecopier.application.domain.value_objects import TerminalId
+
+
+class ExpiringTerminalsUseCase:
+    """Deactivates terminals of the routing table the moment they expire.
+
+    Expired terminals are dropped from the fan-out plans and disconnected, so
+    the message path never has to evaluate expiry itself.
+    """
+
+    def __init__(
+        self,
+        *,
+        conn_handler: ConnectionHandlerAdapter,
+        routing_table: RoutingTable,
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        self._conn_adapter = conn_handler
+        self._routing_table = routing_table
+        self._now = now
+        self._index = ExpiryIndex()
+        self._changed = asyncio.Event()
+
+    def sync(self) -> None:
+        """Rebuilds the index after the routing table was (re)loaded."""
+        self._index.clear()
+        for terminal in self._routing_table.terminals():
+            if (active_until := terminal.active_until) is not None:
+                self._index.schedule(terminal.terminal_id, active_until)
+        self._changed.set()
+
+    def execute(self) -> List[TerminalId]:
+        expired = self._index.pop_expired(self._now())
+        for terminal_id in expired:
+            # one failure must not stop expiry of the others, now or later
+            try:
+                if self._routing_table.deactivate(terminal_id):
+                    logger.info(f"terminal {terminal_id} expired")
+                if self._conn_adapter.is_connected(terminal_id):
+                    self._conn_adapter.disconnect(terminal_id)
+            except Exception:
+                logger.exception(f"failed to expire terminal {terminal_id}")
+        return expired
+
+    async def run(self) -> None:
+        while True:
+            self.execute()
+            timeout = None
+            if (next_expiry := self._index.next_expiry()) is not None:
+                timeout = max((next_expiry - self._now()).total_seconds(), 0)
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
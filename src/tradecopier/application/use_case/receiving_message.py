@@ -1,47 +1,88 @@
 import abc
-import copy
+import operator
 from collections import defaultdict
-from typing import Iterable, List, Tuple
+from functools import lru_cache
+from time import perf_counter_ns
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple, Union
 
-from loguru import logger
+from tradecopier.application import tracing
 from tradecopier.application.adapters.connection_adapter import \
     ConnectionHandlerAdapter
+from tradecopier.application.adapters.metrics import (MetricsAdapter,
+                                                      NullMetrics, Stage)
 from tradecopier.application.domain.entities.message import (
-    AskRegistrationMessage, IncomingMessage, InTradeMessage, OutgoingMessage,
+    AskRegistrationMessage, IncomingMessage, InTradeBatchMessage,
+    InTradeMessage, OutgoingMessage, OutTradeBatchMessage, OutTradeMessage,
     RegisterMessage)
+from tradecopier.application.domain.entities.routing_table import \
+    RoutingTable
+from tradecopier.application.domain.entities.rule import Rule, RulePipeline
 from tradecopier.application.domain.entities.terminal import Terminal
 from tradecopier.application.domain.value_objects import (
     CustomerType, EntityNotFoundException, RouteStatus, TerminalId,
     TerminalType)
-from tradecopier.application.repositories.route_repo import RouteRepo
-from tradecopier.application.repositories.rule_repo import RuleRepo
-from tradecopier.application.repositories.terminal_repo import TerminalRepo
+from tradecopier.application.repositories.route_repo import AsyncRouteRepo
+from tradecopier.application.repositories.rule_repo import AsyncRuleRepo
+from tradecopier.application.repositories.terminal_repo import \
+    AsyncTerminalRepo
+
+Reply = List[Tuple[Iterable[TerminalId], OutgoingMessage]]
+
+
+@lru_cache(maxsize=1024)
+def _ask_registration(terminal_id: TerminalId) -> OutgoingMessage:
+    # shared by all replies to the terminal, so it is encoded only once
+    return OutgoingMessage(message=AskRegistrationMessage(terminal_id=terminal_id))
 
 
 class ReceivingMessageBoundary(metaclass=abc.ABCMeta):
     @abc.abstractmethod
-    def present(self, reply: List[Tuple[Iterable[TerminalId], OutgoingMessage]]):
+    def present(self, reply: Reply):
         pass
 
 
+class Session:
+    """Terminal of one connection with its source rule and route plan.
+
+    Resolved once the connection introduced itself and only resolved again
+    when the routing table or the rules change. Expiry deactivates the
+    terminal in the routing table, which is a change as well.
+    """
+
+    def __init__(self, terminal_id: TerminalId):
+        self.terminal_id = terminal_id
+        self.terminal: Optional[Terminal] = None
+        self.pipeline: Optional[RulePipeline] = None
+        # None while the terminal is inactive
+        self.destinations: Optional[Iterable[Terminal]] = None
+        self.version: Optional[Tuple[int, int]] = None
+
+
 class ReceivingMessageUseCase:
     def __init__(
         self,
         *,
         conn_handler: ConnectionHandlerAdapter,
-        route_repo: RouteRepo,
-        terminal_repo: TerminalRepo,
-        rule_repo: RuleRepo,
-        outboundary: ReceivingMessageBoundary,
+        route_repo: AsyncRouteRepo,
+        terminal_repo: AsyncTerminalRepo,
+        rule_repo: AsyncRuleRepo,
+        outboundary: Optional[ReceivingMessageBoundary] = None,
+        routing_table: Optional[RoutingTable] = None,
+        metrics: Optional[MetricsAdapter] = None,
     ):
         self._conn_adapter = conn_handler
         self._route_repo = route_repo
         self._terminal_repo = terminal_repo
         self._rule_repo = rule_repo
         self._out_bound = outboundary
+        self._routing_table = routing_table
+        self._metrics = metrics if metrics is not None else NullMetrics()
 
-    def _register_msg_case(self, message: RegisterMessage):
-        terminal = self._terminal_repo.get(message.terminal_id)
+    async def _register_msg_case(self, message: RegisterMessage) -> Reply:
+        # the terminal may have registered through another process since it
+        # was last looked up, saving it again would reset it
+        self._terminal_repo.forget(message.terminal_id)
+        terminal = await self._terminal_repo.get(message.terminal_id)
         if terminal is None:
             terminal = Terminal(
                 terminal_id=message.terminal_id,
@@ -51,64 +92,224 @@ class ReceivingMessageUseCase:
                 if message.is_cyphered
                 else CustomerType.BRONZE,
             )
-            self._terminal_repo.save(terminal)
+            await self._terminal_repo.save(terminal)
+        return []
+
+    async def _destinations(self, terminal: Terminal) -> Optional[Iterable[Terminal]]:
+        if self._routing_table is not None:
+            # expiry is tracked by the table, plans only hold active
+            # destinations
+            if not (terminal.enabled and self._routing_table.is_active(terminal)):
+                return None
+            return self._routing_table.destinations(terminal.terminal_id)
+        if not terminal.is_active:
+            return None
+        routes = await self._route_repo.get_by_terminal_id(
+            terminal.terminal_id, term_type=TerminalType.SOURCE
+        )
+        return set(
+            r.destination
+            for r in routes
+            if r.status == RouteStatus.BOTH and r.destination.is_active
+        )
 
-    def _trade_msg_case(self, terminal: Terminal, message: InTradeMessage):
+    async def _source_pipeline(self, terminal_id: TerminalId) -> RulePipeline:
+        if (src_rule := await self._rule_repo.get(terminal_id)) is None:
+            raise EntityNotFoundException(f"rule for terminal {terminal_id} not found")
+        # compiled pipelines never mutate their input, so the inbound messages
+        # are shared by all destinations and each transform only copies what
+        # it changes
+        return src_rule.compile()
+
+    def _version(self) -> Optional[Tuple[int, int]]:
+        if self._routing_table is None or self._rule_repo.version is None:
+            return None
+        return self._routing_table.version, self._rule_repo.version
+
+    async def open_session(self, terminal_id: TerminalId) -> Optional[Session]:
+        """Session for the connection of `terminal_id`, None if the terminal is
+        unknown or changes of routes and rules are not tracked."""
+        if self._version() is None:
+            return None
+        session = Session(terminal_id)
+        return session if await self._resolve(session) is not None else None
+
+    async def _resolve(self, session: Session) -> Optional[Terminal]:
+        version = self._version()
+        if session.version == version:
+            return session.terminal
+        session.version = None
+        session.terminal = terminal = await self._terminal_repo.get(
+            session.terminal_id
+        )
+        if terminal is None:
+            return None
+        session.destinations = await self._destinations(terminal)
+        if session.destinations is not None:
+            session.pipeline = await self._source_pipeline(terminal.terminal_id)
+        session.version = version
+        return terminal
+
+    async def _trade_msg_case(
+        self,
+        terminal: Terminal,
+        messages: List[InTradeMessage],
+        batched: bool,
+        session: Optional[Session] = None,
+        inbound: Optional[Union[InTradeMessage, InTradeBatchMessage]] = None,
+    ) -> Reply:
         # if someone wants to create DoS attack, he can create loop between 2 or
         # more terminals and drive trade around them
-        src_terminal_id = message.terminal_id
-        if terminal is None or not terminal.is_active:
-            return
+        if terminal is None:
+            return []
+        src_terminal_id = terminal.terminal_id
+        observe = self._metrics.observe
 
-        routes = self._route_repo.get_by_terminal_id(
-            src_terminal_id, term_type=TerminalType.SOURCE
-        )
-        routes = [r for r in routes if r.status == RouteStatus.BOTH]
+        if session is not None:
+            destinations, src_pipeline = session.destinations, session.pipeline
+            if destinations is None:
+                return []
+        else:
+            started = perf_counter_ns()
+            if (destinations := await self._destinations(terminal)) is None:
+                return []
+            observe(Stage.ROUTE_LOOKUP, perf_counter_ns() - started)
+            src_pipeline = await self._source_pipeline(src_terminal_id)
 
-        if (src_rule := self._rule_repo.get(src_terminal_id)) is None:
-            raise EntityNotFoundException(
-                f"rule for terminal {src_terminal_id} not found"
-            )
-        if (src_msg := src_rule.apply(message)) is None:
-            logger.debug("rules empty src message")
-            return
-        destinations = set(
-            [route.destination for route in routes if route.destination.is_active]
-        )
+        started = perf_counter_ns()
+        src_msgs = [
+            src_msg
+            for src_msg in (src_pipeline(message) for message in messages)
+            if src_msg is not None
+        ]
+        observe(Stage.SOURCE_RULE, perf_counter_ns() - started)
+        if not src_msgs:
+            if tracing.active():
+                tracing.trace("rules of {} dropped the message", lambda: src_terminal_id)
+            return []
+        # unchanged by the source rule, filter-only destinations get a copy
+        # encoded straight from the inbound frame
+        passthrough = None
+        if inbound is not None and self._unchanged(src_msgs, messages):
+            passthrough = OutgoingMessage.passthrough(inbound)
         out_msgs = defaultdict(set)
-        src_msg_copy = copy.deepcopy(src_msg)
+        # followers often share a rule set, evaluate each distinct one once
+        evaluated: Dict[Hashable, Optional[OutgoingMessage]] = {}
         for dst_terminal in destinations:
             if not self._conn_adapter.is_connected(dst_terminal.terminal_id):
                 continue
-            dst_rule = self._rule_repo.get(dst_terminal.terminal_id)
+            started = perf_counter_ns()
+            dst_rule = await self._rule_repo.get(dst_terminal.terminal_id)
             if not dst_rule:
                 continue
-            dst_msg = dst_rule.apply(src_msg_copy)
-            if dst_msg is not None:
-                msg = OutgoingMessage(message=dst_msg)
-                out_msgs[msg].add(dst_terminal.terminal_id)
+            fingerprint = dst_rule.fingerprint
+            if fingerprint in evaluated:
+                msg = evaluated[fingerprint]
             else:
-                logger.debug("message empty for dst")
-        self._out_bound.present([(v, k) for k, v in out_msgs.items()])
+                msg = evaluated[fingerprint] = self._evaluate(
+                    dst_rule, src_msgs, batched, passthrough
+                )
+            observe(Stage.DESTINATION_RULE, perf_counter_ns() - started)
+            if msg is not None:
+                out_msgs[msg].add(dst_terminal.terminal_id)
+            elif tracing.active():
+                tracing.trace(
+                    "rules of {} dropped the message", lambda: dst_terminal.terminal_id
+                )
+        return [(v, k) for k, v in out_msgs.items()]
+
+    @staticmethod
+    def _unchanged(
+        results: List[InTradeMessage], messages: List[InTradeMessage]
+    ) -> bool:
+        # rules never mutate their input, identity means nothing was
+        # transformed or dropped
+        return len(results) == len(messages) and all(
+            map(operator.is_, results, messages)
+        )
 
-    def execute(self, message: IncomingMessage):
-        if (terminal := self._terminal_repo.get(message.message.terminal_id)) is None:
+    @classmethod
+    def _evaluate(
+        cls,
+        rule: Rule,
+        messages: List[InTradeMessage],
+        batched: bool,
+        passthrough: Optional[OutgoingMessage] = None,
+    ) -> Optional[OutgoingMessage]:
+        pipeline = rule.compile()
+        dst_msgs = [
+            dst_msg
+            for dst_msg in (pipeline(message) for message in messages)
+            if dst_msg is not None
+        ]
+        if not dst_msgs:
+            return None
+        if (
+            passthrough is not None
+            and not rule.transforms
+            and cls._unchanged(dst_msgs, messages)
+        ):
+            return passthrough
+        return cls._outgoing(dst_msgs, batched)
+
+    @staticmethod
+    def _outgoing(messages: List[InTradeMessage], batched: bool) -> OutgoingMessage:
+        if batched and len(messages) > 1:
+            return OutgoingMessage(
+                message=OutTradeBatchMessage(body=[m.body for m in messages])
+            )
+        return OutgoingMessage(message=OutTradeMessage(body=messages[0].body))
+
+    async def execute(
+        self, message: IncomingMessage, session: Optional[Session] = None
+    ) -> Reply:
+        """Returns the delivery plan of `message`.
+
+        The plan is local to the call, so messages of any number of
+        connections may be executed concurrently. With the `session` of the
+        sending connection the terminal, its rule and routes are not looked
+        up again.
+        """
+        reply: Reply = []
+        if session is not None and session.terminal_id == message.message.terminal_id:
+            terminal = await self._resolve(session)
+        else:
+            session = None
+            started = perf_counter_ns()
+            terminal = await self._terminal_repo.get(message.message.terminal_id)
+            self._metrics.observe(Stage.TERMINAL_LOOKUP, perf_counter_ns() - started)
+        if terminal is None:
             if isinstance(message.message, RegisterMessage):
-                self._register_msg_case(message.message)
+                reply = await self._register_msg_case(message.message)
             else:
-                logger.debug("terminal is unknown, but it's not a register message")
-                self._out_bound.present(
-                    [
-                        (
-                            (message.message.terminal_id,),
-                            OutgoingMessage(
-                                message=AskRegistrationMessage(
-                                    terminal_id=message.message.terminal_id,
-                                )
-                            ),
-                        )
-                    ]
-                )
+                if tracing.active():
+                    tracing.trace(
+                        "{} is unknown, asking to register",
+                        lambda: message.message.terminal_id,
+                    )
+                reply = [
+                    (
+                        (message.message.terminal_id,),
+                        _ask_registration(message.message.terminal_id),
+                    )
+                ]
         else:
             if isinstance(message.message, InTradeMessage):
-                self._trade_msg_case(terminal, message.message)
+                reply = await self._trade_msg_case(
+                    terminal,
+                    [message.message],
+                    batched=False,
+                    session=session,
+                    inbound=message.message,
+                )
+            elif isinstance(message.message, InTradeBatchMessage):
+                reply = await self._trade_msg_case(
+                    terminal,
+                    message.message.split(),
+                    batched=True,
+                    session=session,
+                    inbound=message.message,
+                )
+        if self._out_bound is not None:
+            self._out_bound.present(reply)
+        return reply
@@ -4,7 +4,7 @@ from tradecopier.application.repositories.rule_repo import RuleRepo
 from tradecopier.application.repositories.terminal_repo import TerminalRepo
 from tradecopier.infrastructure.repositories.route_repo import \
     SqlAlchemyRouteRepo
-from tradecopier.infrastructure.repositories.rule_repo import \
-    SqlAlchemyRuleRepo
+from tradecopier.infrastructure.repositories.rule_repo import (
+    CachedRuleRepo, SqlAlchemyRuleRepo)
 from tradecopier.infrastructure.repositories.terminal_repo import \
     SqlAlchemyTerminalRepo
@@ -0,0 +1,229 @@
+import abc
+import asyncio
+import json
+import struct
+from enum import IntEnum
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from uuid import UUID
+
+from tradecopier.application.domain.value_objects import Priority, TerminalId
+from tradecopier.infrastructure.adapters import codec as wire
+
+FrameHandler = Callable[[TerminalId, wire.Frame, Priority, Optional[float]], None]
+DisconnectHandler = Callable[[TerminalId], None]
+PresenceHandler = Callable[[TerminalId], None]
+
+_HEADER = struct.Struct("!BI")
+# terminal id, text flag and priority, deadline (0 if none)
+_FRAME_HEADER = struct.Struct("!16sBd")
+
+
+class Record(IntEnum):
+    HELLO = 0
+    PRESENCE = 1
+    FRAME = 2
+    DISCONNECT = 3
+
+
+def encode_record(kind: Record, payload: bytes) -> bytes:
+    return _HEADER.pack(kind, len(payload)) + payload
+
+
+async def read_record(reader: asyncio.StreamReader) -> Tuple[Record, bytes]:
+    kind, length = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return Record(kind), await reader.readexactly(length)
+
+
+def presence_record(
+    terminal_id: TerminalId, codec: Optional[str], node: Optional[str] = None
+) -> bytes:
+    presence = {"terminal_id": str(terminal_id), "codec": codec}
+    if node is not None:
+        presence["node"] = node
+    return encode_record(Record.PRESENCE, json.dumps(presence).encode())
+
+
+def parse_presence(payload: bytes) -> Tuple[TerminalId, Optional[str], Optional[str]]:
+    presence = json.loads(payload)
+    return UUID(presence["terminal_id"]), presence["codec"], presence.get("node")
+
+
+def frame_record(
+    terminal_id: TerminalId,
+    frame: wire.Frame,
+    priority: Priority = Priority.REGULAR,
+    deadline: Optional[float] = None,
+) -> bytes:
+    is_text = isinstance(frame, str)
+    payload = frame.encode() if is_text else frame
+    header = _FRAME_HEADER.pack(
+        terminal_id.bytes, is_text | priority << 1, deadline or 0.0
+    )
+    return encode_record(Record.FRAME, header + payload)
+
+
+def parse_frame(
+    payload: bytes,
+) -> Tuple[TerminalId, wire.Frame, Priority, Optional[float]]:
+    terminal_id, flags, deadline = _FRAME_HEADER.unpack_from(payload)
+    frame = payload[_FRAME_HEADER.size:]
+    return (
+        UUID(bytes=terminal_id),
+        frame.decode() if flags & 1 else frame,
+        Priority(flags >> 1),
+        deadline or None,
+    )
+
+
+class Backplane(metaclass=abc.ABCMeta):
+    """Carries frames to terminals connected to other router processes.
+
+    Every process announces the terminals it holds and in which wire format,
+    the backplane keeps the resulting presence registry, so a process can
+    tell whether a terminal is connected anywhere and encode its frames
+    before handing them over.
+    """
+
+    def __init__(self):
+        self._owners: Dict[TerminalId, Tuple[Hashable, wire.Codec]] = {}
+        self._present: Dict[TerminalId, str] = {}
+        self._presence_handlers: List[PresenceHandler] = []
+        self.forwarded = 0
+        self.dropped = 0
+
+    @abc.abstractmethod
+    async def start(
+        self, on_frame: FrameHandler, on_disconnect: DisconnectHandler
+    ) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def announce(self, terminal_id: TerminalId, codec: Optional[wire.Codec]) -> None:
+        """Publishes that this process holds `terminal_id`, None withdraws it."""
+
+    @abc.abstractmethod
+    def forward(
+        self,
+        terminal_id: TerminalId,
+        frame: wire.Frame,
+        priority: Priority = Priority.REGULAR,
+        deadline: Optional[float] = None,
+    ) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def disconnect(self, terminal_id: TerminalId) -> bool:
+        pass
+
+    def on_presence(self, handler: PresenceHandler) -> None:
+        """Calls `handler` whenever another process announces a terminal."""
+        self._presence_handlers.append(handler)
+
+    def owner(self, terminal_id: TerminalId) -> Optional[wire.Codec]:
+        """Wire format of `terminal_id` if another process holds it."""
+        owner = self._owners.get(terminal_id)
+        return owner[1] if owner is not None else None
+
+    def _remember(self, terminal_id: TerminalId, codec: Optional[wire.Codec]) -> bool:
+        if codec is not None:
+            self._present[terminal_id] = codec.name
+            return True
+        return self._present.pop(terminal_id, None) is not None
+
+    def _on_presence(
+        self, node: Hashable, terminal_id: TerminalId, codec: Optional[str]
+    ) -> None:
+        if codec is not None:
+            self._owners[terminal_id] = (node, wire.get_codec(codec))
+            for handler in self._presence_handlers:
+                handler(terminal_id)
+        elif self._owners.get(terminal_id, (None,))[0] == node:
+            # the terminal may already have reconnected elsewhere
+            del self._owners[terminal_id]
+
+    def _forget(self, node: Hashable) -> None:
+        self._owners = {
+            terminal_id: owner
+            for terminal_id, owner in self._owners.items()
+            if owner[0] != node
+        }
+
+
+class LoopbackHub:
+    """Shared medium of loopback backplanes living in one process."""
+
+    def __init__(self):
+        self.nodes: Dict[Hashable, "LoopbackBackplane"] = {}
+
+
+class LoopbackBackplane(Backplane):
+    """Backplane between router instances of one event loop, for tests and
+    single-box setups without a broker."""
+
+    def __init__(self, node_id: Hashable, hub: LoopbackHub):
+        super().__init__()
+        self.node_id = node_id
+        self._hub = hub
+        self._on_frame: Optional[FrameHandler] = None
+        self._on_disconnect: Optional[DisconnectHandler] = None
+
+    async def start(
+        self, on_frame: FrameHandler, on_disconnect: DisconnectHandler
+    ) -> None:
+        self._on_frame = on_frame
+        self._on_disconnect = on_disconnect
+        for node in self._hub.nodes.values():
+            for terminal_id, codec in node._present.items():
+                self._on_presence(node.node_id, terminal_id, codec)
+        self._hub.nodes[self.node_id] = self
+        self._publish(self._present.items())
+
+    async def close(self) -> None:
+        if self._hub.nodes.pop(self.node_id, None) is None:
+            return
+        for node in self._hub.nodes.values():
+            node._forget(self.node_id)
+
+    def announce(self, terminal_id: TerminalId, codec: Optional[wire.Codec]) -> None:
+        if self._remember(terminal_id, codec):
+            self._publish([(terminal_id, codec.name if codec else None)])
+
+    def forward(
+        self,
+        terminal_id: TerminalId,
+        frame: wire.Frame,
+        priority: Priority = Priority.REGULAR,
+        deadline: Optional[float] = None,
+    ) -> bool:
+        node = self._owner_node(terminal_id)
+        if node is None:
+            self.dropped += 1
+            return False
+        asyncio.get_running_loop().call_soon(
+            node._on_frame, terminal_id, frame, priority, deadline
+        )
+        self.forwarded += 1
+        return True
+
+    def disconnect(self, terminal_id: TerminalId) -> bool:
+        node = self._owner_node(terminal_id)
+        if node is None:
+            return False
+        asyncio.get_running_loop().call_soon(node._on_disconnect, terminal_id)
+        return True
+
+    def _owner_node(self, terminal_id: TerminalId) -> Optional["LoopbackBackplane"]:
+        owner = self._owners.get(terminal_id)
+        return self._hub.nodes.get(owner[0]) if owner is not None else None
+
+    def _publish(self, presence) -> None:
+        if self.node_id not in self._hub.nodes:
+            return
+        for node_id, node in self._hub.nodes.items():
+            if node_id != self.node_id:
+                for terminal_id, codec in presence:
+                    node._on_presence(self.node_id, terminal_id, codec)
@@ -0,0 +1,62 @@
+import json
+from typing import Any, Callable, Dict, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+Frame = Union[str, bytes]
+
+
+class Codec:
+    """Wire format of a connection, announced as a websocket subprotocol."""
+
+    def __init__(
+        self,
+        name: str,
+        dumps: Callable[[Dict[str, Any]], Frame],
+        loads: Callable[[Frame], Dict[str, Any]],
+    ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name})"
+
+
+def _msgpack_dumps(data: Dict[str, Any]) -> bytes:
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _msgpack_loads(frame: Frame) -> Dict[str, Any]:
+    return msgpack.unpackb(frame, raw=False)
+
+
+JSON = Codec("tradecopier.json", json.dumps, json.loads)
+MSGPACK = Codec("tradecopier.msgpack", _msgpack_dumps, _msgpack_loads)
+
+CODECS: Dict[str, Codec] = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MSGPACK.name] = MSGPACK
+    CODECS["msgpack"] = MSGPACK
+CODECS["json"] = JSON
+
+
+def get_codec(name: Optional[str]) -> Codec:
+    if name is None:
+        return JSON
+    return CODECS.get(name, JSON)
+
+
+def subprotocols():
+    return [name for name, codec in CODECS.items() if name == codec.name]
+
+
+def decode(frame: Frame) -> Dict[str, Any]:
+    # text frames are always json, binary ones always msgpack, so inbound
+    # traffic does not depend on what was negotiated
+    if isinstance(frame, str) or msgpack is None:
+        return json.loads(frame)
+    return _msgpack_loads(frame)
@@ -1,17 +1,30 @@
 import asyncio
-import json
-from logging import exception
-from typing import Dict, Iterable, List, Tuple, Union
+from time import monotonic, perf_counter_ns, time
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
 import websockets as ws
 from loguru import logger
+from tradecopier.application import tracing
 from tradecopier.application.adapters.connection_adapter import \
     ConnectionHandlerAdapter
-from tradecopier.application.domain.entities.message import (IncomingMessage,
-                                                             OutgoingMessage)
-from tradecopier.application.domain.value_objects import TerminalId
+from tradecopier.application.adapters.metrics import (MetricsAdapter,
+                                                      NullMetrics, Stage)
+from tradecopier.application.domain.entities.message import (
+    AskRegistrationMessage, IncomingMessage, OutgoingMessage, RegisterMessage)
+from tradecopier.application.domain.entities.order import Order
+from tradecopier.application.domain.value_objects import (CustomerType,
+                                                          Priority, TerminalId,
+                                                          TradeAction)
 from tradecopier.application.use_case.receiving_message import (
-    ReceivingMessageBoundary, ReceivingMessageUseCase)
+    ReceivingMessageBoundary, ReceivingMessageUseCase, Session)
+from tradecopier.infrastructure.adapters import codec as wire
+from tradecopier.infrastructure.adapters.decoder import decode_incoming
+from tradecopier.infrastructure.adapters.backplane import Backplane
+from tradecopier.infrastructure.adapters.outbound import (ExpiryPolicy,
+                                                          OutboundQueue,
+                                                          OverflowPolicy)
+from tradecopier.infrastructure.adapters.scheduler import (FairScheduler,
+                                                           NullScheduler)
 
 
 class ReceivingMessagePresenter(ReceivingMessageBoundary):
@@ -30,72 +43,334 @@ class ReceivingMessagePresenter(ReceivingMessageBoundary):
 
 
 class WebSocketsConnectionAdapter(ConnectionHandlerAdapter):
-    def __init__(self, host: str = "", port: int = 6789):
+    def __init__(
+        self,
+        host: str = "",
+        port: int = 6789,
+        send_timeout: float = 5.0,
+        queue_size: int = 256,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        backplane: Optional[Backplane] = None,
+        reuse_port: bool = False,
+        metrics: Optional[MetricsAdapter] = None,
+        tracer: Optional[tracing.Tracer] = None,
+        ask_registration_interval: float = 5.0,
+        max_age: Optional[Dict[TradeAction, float]] = None,
+        expiry_policy: ExpiryPolicy = ExpiryPolicy.DROP,
+        scheduler: Optional[FairScheduler] = None,
+    ):
         self._host = host
         self._port = port
-        self._server: Union[ws.server.Serve, None] = None
+        self._send_timeout = send_timeout
+        self._queue_size = queue_size
+        self._overflow_policy = overflow_policy
+        self._policies: Dict[str, OverflowPolicy] = {}
+        self._server: Union[ws.server.WebSocketServer, None] = None
         self._ws_register: Dict[str, ws.WebSocketServerProtocol] = {}
+        self._outbound: Dict[str, OutboundQueue] = {}
+        self._backplane = backplane
+        self._reuse_port = reuse_port
+        self._metrics = metrics if metrics is not None else NullMetrics()
+        self._tracer = tracer if tracer is not None else tracing.Tracer()
+        self._ask_interval = ask_registration_interval
+        # seconds a trade may spend in the router, by action
+        self._max_age = max_age or {}
+        self._expiry_policy = expiry_policy
+        self._scheduler = scheduler if scheduler is not None else NullScheduler()
 
-    def _callback(
-        self, uc: ReceivingMessageUseCase, presenter: ReceivingMessagePresenter
-    ):
+    def _callback(self, uc: ReceivingMessageUseCase):
         async def consumer_handler(in_ws: ws.WebSocketServerProtocol, path: str):
-            async for message in in_ws:
-                logger.debug(
-                    "{!r}, {!r}, {!r}, {!r}".format(type(message), message, in_ws, path)
-                )
-                try:
-                    inc_message = IncomingMessage(**json.loads(message))
-                    uc.execute(inc_message)
-                    for seq in presenter:
-                        terminals, out_message = seq
-                        logger.debug(f"{terminals}, {out_message}")
-                        for terminal_id in terminals:
-                            out_ws = self._ws_register.get(str(terminal_id))
-                            if (
-                                out_ws is None
-                                and inc_message.message.terminal_id == terminal_id
-                            ):
-                                await in_ws.send(json.dumps(out_message.dict()))
-                                logger.debug("is that used?")
-                            elif out_ws is not None:
-                                await out_ws.send(json.dumps(out_message.dict()))
-                    self._register_ws(inc_message.message.terminal_id, in_ws)
-                except ws.exceptions.ConnectionClosedError as e:
-                    logger.error(f"exception {e}")
-                    try:
-                        del self._ws_register[str(terminal_id)]
-                    finally:
-                        raise
+            registered_id: Optional[TerminalId] = None
+            # every terminal id the connection spoke for, each has a queue
+            registered: Set[TerminalId] = set()
+            session: Optional[Session] = None
+            codec = wire.get_codec(getattr(in_ws, "subprotocol", None))
+            observe = self._metrics.observe
+            tracer = self._tracer
+            scheduler = self._scheduler
+            traced = False
+            # terminal id the connection was last asked to register
+            unknown_id: Optional[str] = None
+            asked_at = 0.0
+            received_at = 0.0
+            try:
+                async for message in in_ws:
+                    if self._max_age:
+                        received_at = time()
+                    customer_type = (
+                        session.terminal.customer_type
+                        if session is not None and session.terminal is not None
+                        else CustomerType.BRONZE
+                    )
+                    # replies to the sender itself, sent once the turn is over so
+                    # a terminal not reading its socket only ever stalls itself
+                    replies: List[wire.Frame] = []
+                    source = registered_id or in_ws
+                    async with scheduler.turn(source, customer_type) as turn:
+                        started = perf_counter_ns()
+                        data = wire.decode(message)
+                        decoded = perf_counter_ns()
+                        observe(Stage.DECODE, decoded - started)
+                        if unknown_id is not None and self._is_noise(
+                            data, unknown_id, asked_at
+                        ):
+                            continue
+                        if registered_id is None:
+                            inc_message = IncomingMessage(**data)
+                        else:
+                            # the connection already introduced itself
+                            inc_message = decode_incoming(data, message)
+                        observe(Stage.PARSE, perf_counter_ns() - decoded)
+                        if tracer.enabled:
+                            traced = tracer.begin(inc_message.message.terminal_id)
+                            if traced:
+                                tracing.trace(
+                                    "{} <- {!r} on {}",
+                                    lambda: inc_message.message.terminal_id,
+                                    lambda: message,
+                                    lambda: path,
+                                )
+                        if (
+                            isinstance(inc_message.message, RegisterMessage)
+                            and inc_message.message.wire_format is not None
+                        ):
+                            codec = wire.get_codec(inc_message.message.wire_format)
+                        unknown_id = None
+                        for terminals, out_message in await turn.metered(
+                            uc.execute(inc_message, session)
+                        ):
+                            if isinstance(out_message.message, AskRegistrationMessage):
+                                # as spelled on the wire, that is what noise
+                                # is matched against
+                                unknown_id = data["message"]["terminal_id"]
+                                asked_at = monotonic()
+                            deadline = self._deadline(out_message, received_at)
+                            if traced:
+                                tracing.trace(
+                                    "{} -> {}: {}",
+                                    lambda: inc_message.message.terminal_id,
+                                    lambda: list(map(str, terminals)),
+                                    lambda: out_message,
+                                )
+                            for terminal_id in terminals:
+                                if (
+                                    str(terminal_id) not in self._outbound
+                                    and inc_message.message.terminal_id == terminal_id
+                                ):
+                                    started = perf_counter_ns()
+                                    frame = out_message.encode(codec.dumps)
+                                    observe(
+                                        Stage.SERIALIZE, perf_counter_ns() - started
+                                    )
+                                    replies.append(frame)
+                                else:
+                                    self._dispatch(
+                                        terminal_id,
+                                        out_message,
+                                        inc_message.message.terminal_id,
+                                        deadline,
+                                    )
+                        registered_id = inc_message.message.terminal_id
+                        registered.add(registered_id)
+                        self._register_ws(registered_id, in_ws, codec)
+                    for frame in replies:
+                        await self._send(registered_id, in_ws, frame)
+                    if session is None or session.terminal_id != registered_id:
+                        session = await uc.open_session(registered_id)
+            except ws.exceptions.ConnectionClosedError as e:
+                logger.error(f"exception {e}")
+                raise
+            finally:
+                scheduler.forget(in_ws)
+                for terminal_id in registered:
+                    scheduler.forget(terminal_id)
+                    self._unregister_ws(terminal_id, in_ws)
 
         return consumer_handler
 
+    def _is_noise(self, data: dict, unknown_id: str, asked_at: float) -> bool:
+        # until the interval is over, frames of the terminal which was asked to
+        # register are dropped unparsed unless they are the registration
+        message = data.get("message")
+        return (
+            isinstance(message, dict)
+            and message.get("terminal_id") == unknown_id
+            and "broker" not in message
+            and monotonic() - asked_at < self._ask_interval
+        )
+
+    def _dispatch(
+        self,
+        terminal_id: TerminalId,
+        message: OutgoingMessage,
+        source: Optional[TerminalId] = None,
+        deadline: Optional[float] = None,
+    ) -> bool:
+        queue = self._outbound.get(str(terminal_id))
+        if queue is not None:
+            codec = queue.codec
+        elif self._backplane is not None:
+            codec = self._backplane.owner(terminal_id)
+            if codec is None:
+                return False
+        else:
+            return False
+        started = perf_counter_ns()
+        frame = message.encode(codec.dumps)
+        self._metrics.observe(Stage.SERIALIZE, perf_counter_ns() - started)
+        if terminal_id in self._tracer.terminals:
+            tracing.trace("{} queued {!r}", lambda: terminal_id, lambda: frame)
+        priority, key, ticket, symbol = message.delivery()
+        if queue is not None:
+            # tickets are only unique per source terminal
+            if key is not None:
+                key = (source, key)
+            return queue.put(frame, priority, key, deadline, source, ticket, symbol)
+        return self._backplane.forward(terminal_id, frame, priority, deadline)
+
+    def _deadline(
+        self, message: OutgoingMessage, received_at: float
+    ) -> Optional[float]:
+        # a batch goes out as one frame, it is as urgent as its most urgent
+        # order
+        body = message.message.body
+        if not self._max_age or isinstance(body, str):
+            return None
+        orders = (body,) if isinstance(body, Order) else body
+        ages = [
+            age
+            for age in (self._max_age.get(order.action) for order in orders)
+            if age is not None
+        ]
+        return received_at + min(ages) if ages else None
+
+    def _on_remote_frame(
+        self,
+        terminal_id: TerminalId,
+        frame: wire.Frame,
+        priority: Priority = Priority.REGULAR,
+        deadline: Optional[float] = None,
+    ):
+        queue = self._outbound.get(str(terminal_id))
+        if queue is not None:
+            # ticket and symbol don't travel with the frame, a forwarded one
+            # only keeps the order of its lane
+            queue.put(frame, priority, deadline=deadline)
+
+    def _on_remote_disconnect(self, terminal_id: TerminalId):
+        queue = self._outbound.get(str(terminal_id))
+        if queue is not None:
+            queue.close(disconnect=True)
+
+    async def _send(
+        self,
+        terminal_id: TerminalId,
+        wsproto: ws.WebSocketServerProtocol,
+        frame: wire.Frame,
+    ):
+        try:
+            started = perf_counter_ns()
+            await asyncio.wait_for(wsproto.send(frame), self._send_timeout)
+            self._metrics.observe(Stage.SEND, perf_counter_ns() - started)
+        except asyncio.TimeoutError:
+            logger.warning(f"send to {terminal_id} timed out")
+        except ws.exceptions.ConnectionClosed as e:
+            logger.info(f"{terminal_id} is gone: {e}")
+            self._unregister_ws(terminal_id, wsproto)
+        except Exception as e:
+            logger.error(f"send to {terminal_id} failed: {e}")
+
     def _register_ws(
-        self, terminal_id: TerminalId, wsproto: ws.WebSocketServerProtocol
+        self,
+        terminal_id: TerminalId,
+        wsproto: ws.WebSocketServerProtocol,
+        codec: wire.Codec = wire.JSON,
     ):
-        self._ws_register[str(terminal_id)] = wsproto
+        key = str(terminal_id)
+        if self._ws_register.get(key) is wsproto:
+            if self._outbound[key].codec is not codec:
+                self._outbound[key].codec = codec
+                self._announce(terminal_id, codec)
+            return
+        if (stale := self._outbound.get(key)) is not None:
+            stale.close()
+        self._ws_register[key] = wsproto
+        queue = OutboundQueue(
+            terminal_id,
+            wsproto,
+            maxsize=self._queue_size,
+            policy=self._policies.get(key, self._overflow_policy),
+            send_timeout=self._send_timeout,
+            on_close=self._on_queue_closed,
+            codec=codec,
+            metrics=self._metrics,
+            expiry_policy=self._expiry_policy,
+        )
+        self._outbound[key] = queue
+        queue.start()
+        self._announce(terminal_id, codec)
 
-    def start_server(
-        self, uc: ReceivingMessageUseCase, presenter: ReceivingMessagePresenter
+    def _unregister_ws(
+        self, terminal_id: TerminalId, wsproto: ws.WebSocketServerProtocol
     ):
-        self._server = ws.serve(self._callback(uc, presenter), self._host, self._port)
+        queue = self._outbound.get(str(terminal_id))
+        if queue is not None and queue.wsproto is wsproto:
+            queue.close()
+
+    def _on_queue_closed(self, queue: OutboundQueue):
+        key = str(queue.terminal_id)
+        if self._outbound.get(key) is queue:
+            del self._outbound[key]
+            del self._ws_register[key]
+            self._announce(queue.terminal_id, None)
+
+    def _announce(self, terminal_id: TerminalId, codec: Optional[wire.Codec]):
+        if self._backplane is not None:
+            self._backplane.announce(terminal_id, codec)
+
+    def set_overflow_policy(self, terminal_id: TerminalId, policy: OverflowPolicy):
+        key = str(terminal_id)
+        self._policies[key] = policy
+        if (queue := self._outbound.get(key)) is not None:
+            queue.policy = policy
+
+    def outbound_stats(self) -> Dict[str, Dict[str, int]]:
+        return {key: queue.stats() for key, queue in self._outbound.items()}
+
+    async def _serve(self, uc: ReceivingMessageUseCase):
+        if self._backplane is not None:
+            await self._backplane.start(
+                self._on_remote_frame, self._on_remote_disconnect
+            )
+        options = {"reuse_port": True} if self._reuse_port else {}
+        self._server = await ws.serve(
+            self._callback(uc),
+            self._host,
+            self._port,
+            subprotocols=wire.subprotocols(),
+            **options,
+        )
         logger.debug(str(self._server))
         return self._server
 
+    def start_server(self, uc: ReceivingMessageUseCase):
+        return self._serve(uc)
+
     def disconnect(self, terminal_id: TerminalId):
         logger.info("disconnect")
-        assert str(terminal_id) in self._ws_register, "not known"
-        self._ws_register[str(terminal_id)].close()
+        if (queue := self._outbound.get(str(terminal_id))) is not None:
+            queue.close(disconnect=True)
+            return
+        assert (
+            self._backplane is not None and self._backplane.disconnect(terminal_id)
+        ), "not known"
 
     def is_connected(self, terminal_id: TerminalId) -> bool:
-        return str(terminal_id) in self._ws_register
+        return str(terminal_id) in self._ws_register or (
+            self._backplane is not None and self._backplane.owner(terminal_id) is not None
+        )
 
     def send_message(self, terminal_id: TerminalId, message: OutgoingMessage):
-        async def _send_message(ws, message: OutgoingMessage):
-            await ws.send(json.dumps(message.dict()))
-
-        logger.debug(f"send: {message}")
-        loop = asyncio.get_event_loop()
-        asyncio.ensure_future(
-            _send_message(self._ws_register[str(terminal_id)], message), loop=loop
-        )
+        logger.opt(lazy=True).debug("send: {}", lambda: message)
+        assert self.is_connected(terminal_id), "not known"
+        self._dispatch(terminal_id, message)
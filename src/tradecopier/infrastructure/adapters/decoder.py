@@ -0,0 +1,266 @@
+import json
+import re
+from enum import Enum, IntEnum
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+from uuid import UUID
+
+from pydantic import BaseModel
+from pydantic.fields import ModelField
+from tradecopier.application.domain.entities.message import (
+    IncomingMessage, InTradeBatchMessage, InTradeMessage)
+from tradecopier.application.domain.entities.order import Order
+from tradecopier.infrastructure.adapters import codec as wire
+
+M = TypeVar("M", bound=BaseModel)
+
+_setattr = object.__setattr__
+
+
+class FastPathError(ValueError):
+    """The frame needs full validation, let pydantic deal with it."""
+
+
+def _build(model: Type[M], values: Dict[str, Any]) -> M:
+    # BaseModel.construct without the per-field default handling, values
+    # must already hold every field in declaration order
+    obj = model.__new__(model)
+    _setattr(obj, "__dict__", values)
+    _setattr(obj, "__fields_set__", set(values))
+    return obj
+
+
+# bool before int, it is a subclass of it; int is accepted wherever pydantic
+# would turn it into a float or str without loss, anything else is left to it
+_TYPE_CHECKS = {
+    bool: ["if type(v) is not bool: raise FastPathError({name!r})"],
+    float: [
+        "if type(v) is not float:",
+        "    if type(v) is not int: raise FastPathError({name!r})",
+        "    v = float(v)",
+    ],
+    int: ["if type(v) is not int: raise FastPathError({name!r})"],
+    str: [
+        "if type(v) is not str:",
+        "    if type(v) is not int: raise FastPathError({name!r})",
+        "    v = str(v)",
+    ],
+}
+
+
+def _field_checks(field: ModelField, env: Dict[str, Any]) -> List[str]:
+    name, type_ = field.name, field.type_
+    if isinstance(type_, type) and issubclass(type_, Enum):
+        env[f"_{name}"] = {member.value: member for member in type_}
+        return [f"v = _{name}[v]"]
+    base = next(
+        (t for t in _TYPE_CHECKS if isinstance(type_, type) and issubclass(type_, t)),
+        None,
+    )
+    if base is None:
+        # datetimes and anything more exotic
+        return [f"raise FastPathError({name!r})"]
+    lines = [line.format(name=name) for line in _TYPE_CHECKS[base]]
+    info = field.field_info
+    ge = getattr(type_, "ge", None) if info.ge is None else info.ge
+    le = getattr(type_, "le", None) if info.le is None else info.le
+    # written as pydantic does, so NaN fails them as well
+    if ge is not None:
+        lines.append(f"if not v >= {ge!r}: raise FastPathError({name!r})")
+    if le is not None:
+        lines.append(f"if not v <= {le!r}: raise FastPathError({name!r})")
+    return lines
+
+
+def compile_checks(model: Type[M]) -> Callable[[Dict[str, Any]], M]:
+    """Turns the fields of a flat model into a single straight-line function
+    checking types, `ge`/`le` bounds and enum values of a decoded dict."""
+    env: Dict[str, Any] = {
+        "FastPathError": FastPathError,
+        "_build": _build,
+        "_model": model,
+        "_missing": object(),
+    }
+    body = ["get = data.get"]
+    for field in model.__fields__.values():
+        name = field.name
+        checks = [f"    {line}" for line in _field_checks(field, env)]
+        if field.required:
+            body.append(f"v = data[{name!r}]")
+            body.append(f"if v is None: raise FastPathError({name!r})")
+            body.append("else:")
+        else:
+            env[f"_{name}_default"] = field.get_default()
+            body.append(f"v = get({name!r}, _missing)")
+            body.append(f"if v is _missing: v = _{name}_default")
+            if field.allow_none:
+                body.append("elif v is not None:")
+            else:
+                body.append(f"elif v is None: raise FastPathError({name!r})")
+                body.append("else:")
+        body.extend(checks)
+        body.append(f"{name} = v")
+    fields = ", ".join(f"{name!r}: {name}" for name in model.__fields__)
+    body.append(f"return _build(_model, {{{fields}}})")
+    source = "def check(data):\n" + "".join(f"    {line}\n" for line in body)
+    exec(compile(source, f"<checks of {model.__name__}>", "exec"), env)
+    return env["check"]
+
+
+decode_order = compile_checks(Order)
+
+
+@lru_cache(maxsize=4096)
+def _terminal_id(value: str) -> UUID:
+    return UUID(value)
+
+
+_missing = object()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_scan_value = json.JSONDecoder().raw_decode
+_scan_string = json.decoder.scanstring
+_SPLICE_ERRORS: Tuple[Type[Exception], ...] = (ValueError, IndexError, TypeError)
+if wire.msgpack is not None:
+    _SPLICE_ERRORS += (wire.msgpack.UnpackException,)
+    # {"message": {"body": <body>}} up to the body
+    _MSGPACK_ENVELOPE = wire.MSGPACK.dumps({"message": {"body": None}})[:-1]
+
+
+def _verbatim(raw: Dict[str, Any], order: Order) -> bool:
+    # whether serializing `order` gives back `raw`: every field present and
+    # no value coerced on the way in
+    values = order.__dict__
+    if len(raw) != len(values):
+        return False
+    for name, value in raw.items():
+        decoded = values.get(name, _missing)
+        if type(value) is not type(decoded) and not (
+            type(value) is int and isinstance(decoded, IntEnum)
+        ):
+            return False
+    return True
+
+
+def _json_member(frame: str, start: int, key: str) -> Tuple[int, int]:
+    # span of the value of `key` in the object opening at `start`, the last
+    # one wins like in json.loads
+    span = None
+    end = _WHITESPACE.match(frame, start + 1).end()
+    while frame[end] == '"':
+        name, end = _scan_string(frame, end + 1)
+        end = _WHITESPACE.match(frame, end).end()
+        if frame[end] != ":":
+            raise ValueError("':' expected")
+        value_start = _WHITESPACE.match(frame, end + 1).end()
+        _, end = _scan_value(frame, value_start)
+        if name == key:
+            span = value_start, end
+        end = _WHITESPACE.match(frame, end).end()
+        if frame[end] == ",":
+            end = _WHITESPACE.match(frame, end + 1).end()
+    if span is None:
+        raise ValueError(f"{key!r} not found")
+    return span
+
+
+def _msgpack_member(unpacker, key: str) -> Tuple[int, int]:
+    span = None
+    for _ in range(unpacker.read_map_header()):
+        name = unpacker.unpack()
+        start = unpacker.tell()
+        unpacker.skip()
+        if name == key:
+            span = start, unpacker.tell()
+    if span is None:
+        raise ValueError(f"{key!r} not found")
+    return span
+
+
+class _RawBody:
+    """Encodes the outgoing copy of a trade message by splicing the body of
+    the inbound frame into a new envelope, so the orders are not serialized
+    again. Only done when the frame is already in the requested format."""
+
+    def __init__(self, frame: wire.Frame):
+        self._frame = frame
+
+    def __call__(self, dumps) -> Optional[wire.Frame]:
+        frame = self._frame
+        try:
+            if isinstance(frame, str):
+                if dumps is not wire.JSON.dumps:
+                    return None
+                start = _WHITESPACE.match(frame).end()
+                if frame[start] != "{":
+                    return None
+                start = _json_member(frame, start, "message")[0]
+                if frame[start] != "{":
+                    return None
+                start, end = _json_member(frame, start, "body")
+                return '{"message": {"body": ' + frame[start:end] + "}}"
+            if wire.msgpack is None or dumps is not wire.MSGPACK.dumps:
+                return None
+            unpacker = wire.msgpack.Unpacker(raw=False)
+            unpacker.feed(frame)
+            start, end = _msgpack_member(unpacker, "message")
+            unpacker = wire.msgpack.Unpacker(raw=False)
+            unpacker.feed(frame[start:end])
+            body_start, body_end = _msgpack_member(unpacker, "body")
+            return _MSGPACK_ENVELOPE + frame[start + body_start:start + body_end]
+        except _SPLICE_ERRORS:
+            return None
+
+
+def _decode_trade(message: Dict[str, Any], frame: Optional[wire.Frame] = None):
+    body = message["body"]
+    account_id = message["account_id"]
+    if type(account_id) is not str:
+        if type(account_id) is not int:
+            raise FastPathError("account_id")
+        account_id = str(account_id)
+    is_cyphered = message.get("is_cyphered", False)
+    if type(is_cyphered) is not bool:
+        raise FastPathError("is_cyphered")
+    raw = body
+    if type(body) is dict:
+        model, body = InTradeMessage, decode_order(body)
+        verbatim = frame is not None and _verbatim(raw, body)
+    elif type(body) is list and body:
+        model, body = InTradeBatchMessage, [decode_order(order) for order in body]
+        verbatim = frame is not None and all(map(_verbatim, raw, body))
+    else:
+        raise FastPathError("body")
+    result = _build(
+        model,
+        {
+            "terminal_id": _terminal_id(message["terminal_id"]),
+            "body": body,
+            "account_id": account_id,
+            "is_cyphered": is_cyphered,
+        },
+    )
+    _setattr(result, "_raw_encoder", _RawBody(frame) if verbatim else None)
+    return result
+
+
+def decode_incoming(
+    data: Dict[str, Any], frame: Optional[wire.Frame] = None
+) -> IncomingMessage:
+    """Builds an `IncomingMessage` from a trusted frame without pydantic.
+
+    Trade messages are told apart by their `account_id`/`body` keys and their
+    orders go through checks precompiled from the `Order` model. Anything the
+    fast path is unsure about (register messages, datetimes, coercions) gets
+    full validation, so invalid frames are reported exactly as before.
+
+    Given the `frame` `data` was decoded from, trade messages whose orders
+    hold every field uncoerced keep it to be forwarded without
+    re-serializing the orders.
+    """
+    try:
+        message = data["message"]
+        if "account_id" in message and "body" in message:
+            return _build(IncomingMessage, {"message": _decode_trade(message, frame)})
+    except (KeyError, TypeError, ValueError, AttributeError):
+        pass
+    return IncomingMessage(**data)
@@ -0,0 +1,153 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+from uuid import UUID
+
+from loguru import logger
+from tradecopier.application.domain.value_objects import Priority, TerminalId
+from tradecopier.infrastructure.adapters import codec as wire
+from tradecopier.infrastructure.adapters.backplane import (
+    Backplane, DisconnectHandler, FrameHandler, Record, encode_record,
+    frame_record, parse_frame, parse_presence, presence_record, read_record)
+
+
+class Forwarder(Backplane):
+    """Backplane between the worker processes of one router box.
+
+    Every worker listens on its own unix socket and keeps one outgoing
+    connection to each peer, records go straight to the owning worker.
+    """
+
+    def __init__(
+        self,
+        worker_id: int,
+        workers: int,
+        socket_dir: str,
+        *,
+        reconnect_delay: float = 0.5,
+        max_buffer: int = 4 * 1024 * 1024,
+    ):
+        super().__init__()
+        self.worker_id = worker_id
+        self._paths = [
+            os.path.join(socket_dir, f"worker-{i}.sock") for i in range(workers)
+        ]
+        self._reconnect_delay = reconnect_delay
+        self._max_buffer = max_buffer
+        self._peers: Dict[int, asyncio.StreamWriter] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: List[asyncio.Future] = []
+        self._readers: Set[asyncio.Future] = set()
+        self._on_frame: Optional[FrameHandler] = None
+        self._on_disconnect: Optional[DisconnectHandler] = None
+
+    async def start(
+        self, on_frame: FrameHandler, on_disconnect: DisconnectHandler
+    ) -> None:
+        self._on_frame = on_frame
+        self._on_disconnect = on_disconnect
+        path = self._paths[self.worker_id]
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=path)
+        self._tasks = [
+            asyncio.ensure_future(self._connect(peer_id))
+            for peer_id in range(len(self._paths))
+            if peer_id != self.worker_id
+        ]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for writer in self._peers.values():
+            writer.close()
+        self._peers.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._readers:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._readers, return_exceptions=True)
+
+    def announce(self, terminal_id: TerminalId, codec: Optional[wire.Codec]) -> None:
+        if not self._remember(terminal_id, codec):
+            return
+        record = presence_record(terminal_id, codec.name if codec else None)
+        for writer in self._peers.values():
+            writer.write(record)
+
+    def forward(
+        self,
+        terminal_id: TerminalId,
+        frame: wire.Frame,
+        priority: Priority = Priority.REGULAR,
+        deadline: Optional[float] = None,
+    ) -> bool:
+        owner = self._owners.get(terminal_id)
+        writer = self._peers.get(owner[0]) if owner is not None else None
+        if writer is None or (
+            writer.transport.get_write_buffer_size() > self._max_buffer
+        ):
+            self.dropped += 1
+            return False
+        writer.write(frame_record(terminal_id, frame, priority, deadline))
+        self.forwarded += 1
+        return True
+
+    def disconnect(self, terminal_id: TerminalId) -> bool:
+        owner = self._owners.get(terminal_id)
+        writer = self._peers.get(owner[0]) if owner is not None else None
+        if writer is None:
+            return False
+        writer.write(encode_record(Record.DISCONNECT, terminal_id.bytes))
+        return True
+
+    async def _connect(self, peer_id: int) -> None:
+        # outgoing side: (re)connects forever and replays local presence
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(self._paths[peer_id])
+            except OSError:
+                await asyncio.sleep(self._reconnect_delay)
+                continue
+            writer.write(encode_record(Record.HELLO, str(self.worker_id).encode()))
+            for terminal_id, codec in self._present.items():
+                writer.write(presence_record(terminal_id, codec))
+            self._peers[peer_id] = writer
+            logger.debug(f"worker {self.worker_id} linked to {peer_id}")
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            finally:
+                if self._peers.get(peer_id) is writer:
+                    del self._peers[peer_id]
+            await asyncio.sleep(self._reconnect_delay)
+
+    async def _serve_peer(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # incoming side: records from one peer, whose terminals are forgotten
+        # when it goes away
+        peer_id: Optional[int] = None
+        task = asyncio.current_task()
+        self._readers.add(task)
+        try:
+            while True:
+                kind, payload = await read_record(reader)
+                if kind == Record.HELLO:
+                    peer_id = int(payload)
+                elif kind == Record.PRESENCE and peer_id is not None:
+                    terminal_id, codec, _ = parse_presence(payload)
+                    self._on_presence(peer_id, terminal_id, codec)
+                elif kind == Record.FRAME:
+                    self._on_frame(*parse_frame(payload))
+                elif kind == Record.DISCONNECT:
+                    self._on_disconnect(UUID(bytes=payload))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._readers.discard(task)
+            writer.close()
+            if peer_id is not None:
+                self._forget(peer_id)
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import math
+from typing import Dict, List, Optional
+
+from loguru import logger
+from tradecopier.application.adapters.metrics import MetricsAdapter, Stage
+
+
+class LatencyHistogram:
+    """HDR-style histogram of nanosecond latencies.
+
+    Buckets are linear within each power of two, so every recorded value is
+    known within 1 / 2 ** (significant_bits - 1) of itself while recording
+    stays a bit_length and a list increment.
+    """
+
+    def __init__(self, significant_bits: int = 7, highest_ns: int = 60 * 10 ** 9):
+        self._bits = significant_bits
+        self._shift = significant_bits - 1
+        self._half = 1 << self._shift
+        self._highest = highest_ns
+        self._counts: List[int] = [0] * (self._index(highest_ns) + 1)
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+
+    def _index(self, value: int) -> int:
+        exp = value.bit_length() - self._bits
+        if exp <= 0:
+            return value
+        return (exp << self._shift) + (value >> exp)
+
+    def _highest_equivalent(self, index: int) -> int:
+        if index < 2 * self._half:
+            return index
+        exp = index // self._half - 1
+        return ((index - exp * self._half + 1) << exp) - 1
+
+    def record(self, value: int) -> None:
+        # hot path, _index is inlined
+        if value > self._highest:
+            value = self._highest
+        exp = value.bit_length() - self._bits
+        self._counts[value if exp <= 0 else (exp << self._shift) + (value >> exp)] += 1
+        if value > self.max_ns:
+            self.max_ns = value
+        if value < self.min_ns or not self.count:
+            self.min_ns = value
+        self.count += 1
+        self.total_ns += value
+
+    def percentile(self, q: float) -> int:
+        if not self.count:
+            return 0
+        target = max(math.ceil(q / 100 * self.count), 1)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max_ns)
+        return self.max_ns
+
+    def reset(self) -> None:
+        self._counts = [0] * len(self._counts)
+        self.count = self.total_ns = self.min_ns = self.max_ns = 0
+
+    def summary(self) -> Dict[str, float]:
+        """Count and percentiles in microseconds."""
+        return {
+            "count": self.count,
+            "min": self.min_ns / 1000,
+            "mean": self.total_ns / self.count / 1000 if self.count else 0.0,
+            "p50": self.percentile(50) / 1000,
+            "p99": self.percentile(99) / 1000,
+            "p999": self.percentile(99.9) / 1000,
+            "max": self.max_ns / 1000,
+        }
+
+
+class HistogramMetrics(MetricsAdapter):
+    def __init__(self, significant_bits: int = 7):
+        self._histograms = {stage: LatencyHistogram(significant_bits) for stage in Stage}
+
+    def observe(self, stage: Stage, elapsed_ns: int):
+        self._histograms[stage].record(elapsed_ns)
+
+    def histogram(self, stage: Stage) -> LatencyHistogram:
+        return self._histograms[stage]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage.name.lower(): self._histograms[stage].summary()
+            for stage in Stage
+            if self._histograms[stage].count
+        }
+
+    def reset(self) -> None:
+        for histogram in self._histograms.values():
+            histogram.reset()
+
+
+class MetricsEndpoint:
+    """Serves the current snapshot as JSON to any HTTP GET, meant to be bound
+    to localhost and scraped or curled by operators."""
+
+    def __init__(
+        self, metrics: HistogramMetrics, host: str = "127.0.0.1", port: int = 9100
+    ):
+        self._metrics = metrics
+        self._host = host
+        self._port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            return self._port
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self._host, self._port)
+        logger.info(f"metrics on http://{self._host}:{self.port}/")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            # the request itself doesn't matter, drain it up to the blank line
+            while await reader.readline() not in (b"\r\n", b"\n", b""):
+                pass
+            body = json.dumps(self._metrics.snapshot()).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body)
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,301 @@
+import asyncio
+from collections import deque
+from enum import IntEnum
+from time import perf_counter_ns, time
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+import websockets as ws
+from loguru import logger
+from tradecopier.application.adapters.metrics import (MetricsAdapter,
+                                                      NullMetrics, Stage)
+from tradecopier.application.domain.value_objects import Priority, TerminalId
+from tradecopier.infrastructure.adapters.codec import JSON, Codec, Frame
+
+
+class OverflowPolicy(IntEnum):
+    DROP_OLDEST = 0
+    DROP_NEWEST = 1
+    DISCONNECT = 2
+
+
+class ExpiryPolicy(IntEnum):
+    # what becomes of a trade still queued past its deadline
+    DROP = 0
+    REPORT = 1
+
+
+class _Entry:
+    __slots__ = (
+        "frame",
+        "key",
+        "deadline",
+        "priority",
+        "seq",
+        "queued",
+        "followers",
+        "index",
+    )
+
+    def __init__(
+        self,
+        frame: Frame,
+        key: Optional[Hashable],
+        deadline: Optional[float],
+        priority: Priority,
+        seq: int,
+    ):
+        self.frame = frame
+        self.key = key
+        self.deadline = deadline
+        self.priority = priority
+        self.seq = seq
+        # False while it waits for another entry to go out first
+        self.queued = True
+        self.followers: Optional[List["_Entry"]] = None
+        # where the queue looks it up as the latest of its ticket or symbol
+        self.index: Optional[Tuple[Dict, Hashable]] = None
+
+
+class OutboundQueue:
+    """Bounded queue of frames for one destination socket, drained by its own
+    writer task so a slow destination only ever delays itself.
+
+    Frames wait in one lane per `Priority` and protective ones go out first,
+    so their latency does not depend on the regular backlog of other
+    sources. A protective frame only waits for the frames of its source it
+    may depend on: the last pending one for its ticket and the last pending
+    opening deal or order on its symbol, which may be the one opening its
+    position. A frame put with a key replaces the pending one of the same
+    key in place.
+
+    Frames put with a deadline (wall clock, so it survives the backplane)
+    are checked against it right before they are sent.
+    """
+
+    def __init__(
+        self,
+        terminal_id: TerminalId,
+        wsproto: ws.WebSocketServerProtocol,
+        *,
+        maxsize: int = 256,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        send_timeout: float = 5.0,
+        on_close: Optional[Callable[["OutboundQueue"], None]] = None,
+        codec: Codec = JSON,
+        metrics: Optional[MetricsAdapter] = None,
+        expiry_policy: ExpiryPolicy = ExpiryPolicy.DROP,
+    ):
+        self.terminal_id = terminal_id
+        self.wsproto = wsproto
+        self._maxsize = maxsize
+        self.policy = policy
+        self._send_timeout = send_timeout
+        self._on_close = on_close
+        self.codec = codec
+        self._metrics = metrics if metrics is not None else NullMetrics()
+        self._expiry_policy = expiry_policy
+        self._lanes: Tuple[Deque[_Entry], ...] = tuple(deque() for _ in Priority)
+        self._pending: Dict[Hashable, _Entry] = {}
+        # last pending entry of each (source, ticket) and, of the entries
+        # without a ticket, of each (source, symbol)
+        self._tickets: Dict[Tuple[Hashable, int], _Entry] = {}
+        self._openings: Dict[Tuple[Hashable, str], _Entry] = {}
+        self._following = 0
+        self._seq = 0
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Future] = None
+        self._closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.expired = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(map(len, self._lanes)) + self._following
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "expired": self.expired,
+        }
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._writer())
+
+    def put(
+        self,
+        frame: Frame,
+        priority: Priority = Priority.REGULAR,
+        key: Optional[Hashable] = None,
+        deadline: Optional[float] = None,
+        source: Optional[Hashable] = None,
+        ticket: Optional[int] = None,
+        symbol: Optional[str] = None,
+    ) -> bool:
+        if self._closed:
+            self.dropped += 1
+            return False
+        if (
+            deadline is not None
+            and self._expiry_policy == ExpiryPolicy.DROP
+            and self._expired(deadline)
+        ):
+            return False
+        if key is not None and (entry := self._pending.get(key)) is not None:
+            entry.frame, entry.deadline = frame, deadline
+            self.coalesced += 1
+            return True
+        if self.depth >= self._maxsize and not self._make_room(priority):
+            return False
+        self._seq += 1
+        entry = _Entry(frame, key, deadline, priority, self._seq)
+        if key is not None:
+            self._pending[key] = entry
+        blocker = None
+        if source is not None:
+            if priority < Priority.REGULAR:
+                blocker = self._blocker(priority, source, ticket, symbol)
+            if ticket:
+                entry.index = (self._tickets, (source, ticket))
+            elif symbol and priority == Priority.REGULAR:
+                entry.index = (self._openings, (source, symbol))
+            if entry.index is not None:
+                index, index_key = entry.index
+                index[index_key] = entry
+        if blocker is None:
+            self._lanes[priority].append(entry)
+        else:
+            entry.queued = False
+            if blocker.followers is None:
+                blocker.followers = []
+            blocker.followers.append(entry)
+            self._following += 1
+        self._ready.set()
+        return True
+
+    def _blocker(
+        self,
+        priority: Priority,
+        source: Hashable,
+        ticket: Optional[int],
+        symbol: Optional[str],
+    ) -> Optional[_Entry]:
+        # the latest entry the new one must not overtake, None if its own
+        # lane keeps the order already
+        blocker = None
+        for queued in (
+            self._tickets.get((source, ticket)) if ticket else None,
+            self._openings.get((source, symbol)) if symbol else None,
+        ):
+            if (
+                queued is not None
+                and (not queued.queued or queued.priority > priority)
+                and (blocker is None or queued.seq > blocker.seq)
+            ):
+                blocker = queued
+        return blocker
+
+    def _make_room(self, priority: Priority) -> bool:
+        self.dropped += 1
+        if self.policy == OverflowPolicy.DISCONNECT:
+            logger.warning(f"{self.terminal_id} can't keep up, disconnecting")
+            self.close(disconnect=True)
+            return False
+        # a less urgent frame gives way to the new one first, a more urgent
+        # one never does
+        victims = next(
+            (lane for lane in reversed(self._lanes[priority + 1:]) if lane), None
+        )
+        if victims is None:
+            victims = self._lanes[priority]
+            if self.policy == OverflowPolicy.DROP_NEWEST or not victims:
+                return False
+        if self.policy == OverflowPolicy.DROP_NEWEST:
+            self._forget(victims.pop())
+        else:
+            self._forget(victims.popleft())
+        return True
+
+    def _forget(self, entry: _Entry) -> None:
+        if entry.key is not None:
+            del self._pending[entry.key]
+        if entry.index is not None:
+            index, index_key = entry.index
+            if index.get(index_key) is entry:
+                del index[index_key]
+        if entry.followers:
+            self._following -= len(entry.followers)
+            for follower in entry.followers:
+                follower.queued = True
+                self._lanes[follower.priority].append(follower)
+
+    def _expired(self, deadline: float) -> bool:
+        # True if the trade must not be sent anymore
+        late = time() - deadline
+        if late <= 0:
+            return False
+        self.expired += 1
+        if self._expiry_policy == ExpiryPolicy.DROP:
+            return True
+        logger.warning(f"trade to {self.terminal_id} is {late:.3f}s past its deadline")
+        return False
+
+    def _next(self) -> Optional[Frame]:
+        for lane in self._lanes:
+            while lane:
+                entry = lane.popleft()
+                self._forget(entry)
+                if entry.deadline is None or not self._expired(entry.deadline):
+                    return entry.frame
+        return None
+
+    def close(self, disconnect: bool = False) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.dropped += self.depth
+        for lane in self._lanes:
+            lane.clear()
+        self._pending.clear()
+        self._tickets.clear()
+        self._openings.clear()
+        self._following = 0
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        if disconnect:
+            asyncio.ensure_future(self.wsproto.close())
+        if self._on_close is not None:
+            self._on_close(self)
+
+    async def _writer(self):
+        while not self._closed:
+            frame = self._next()
+            if frame is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            try:
+                started = perf_counter_ns()
+                await asyncio.wait_for(self.wsproto.send(frame), self._send_timeout)
+                self._metrics.observe(Stage.SEND, perf_counter_ns() - started)
+                self.sent += 1
+            except asyncio.TimeoutError:
+                self.failed += 1
+                logger.warning(f"send to {self.terminal_id} timed out")
+            except ws.exceptions.ConnectionClosed as e:
+                logger.info(f"{self.terminal_id} is gone: {e}")
+                self.close()
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"send to {self.terminal_id} failed: {e}")
@@ -0,0 +1,225 @@
+import asyncio
+from collections import deque
+from time import monotonic, perf_counter_ns
+from typing import Any, Awaitable, Callable, Coroutine, Deque, Dict, Hashable, Optional
+
+from tradecopier.application.domain.value_objects import CustomerType
+
+
+class TokenBucket:
+    def __init__(
+        self, rate: float, burst: float, clock: Callable[[], float] = monotonic
+    ):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+
+    def take(self) -> float:
+        """Takes a token, returns how long to wait until it is due."""
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # tokens are reserved, the debt delays the next taker
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class _Metered:
+    """Awaits a coroutine on behalf of a turn, the time it spends suspended
+    (waiting on i/o) is not charged to the source."""
+
+    __slots__ = ("_source", "_coro")
+
+    def __init__(self, source: "_Source", coro: Coroutine):
+        self._source = source
+        self._coro = coro
+
+    def __await__(self):
+        coro = self._coro
+        value: Any = None
+        error: Optional[BaseException] = None
+        while True:
+            try:
+                if error is None:
+                    yielded = coro.send(value)
+                else:
+                    yielded = coro.throw(error)
+            except StopIteration as e:
+                return e.value
+            suspended = perf_counter_ns()
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+            self._source.idle += perf_counter_ns() - suspended
+
+
+class _Source:
+    """Scheduling state of one source, used as the context of its turns."""
+
+    __slots__ = (
+        "scheduler",
+        "customer_type",
+        "weight",
+        "deficit",
+        "waiters",
+        "queued",
+        "bucket",
+        "started",
+        "idle",
+    )
+
+    def __init__(self, scheduler: "FairScheduler", customer_type: CustomerType):
+        self.scheduler = scheduler
+        self.customer_type = customer_type
+        self.weight = max(scheduler.weights.get(customer_type, 1), 1)
+        # processing time, in ns, the source may still take before yielding
+        self.deficit = scheduler.quantum * self.weight
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.queued = False
+        self.bucket: Optional[TokenBucket] = None
+        rate = scheduler.rates.get(customer_type)
+        if rate:
+            self.bucket = TokenBucket(rate, max(rate * scheduler.burst, 1.0))
+        self.started = 0
+        self.idle = 0
+
+    def metered(self, coro: Coroutine) -> Awaitable:
+        return _Metered(self, coro)
+
+    async def __aenter__(self) -> "_Source":
+        await self.scheduler._acquire(self)
+        self.idle = 0
+        self.started = perf_counter_ns()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.scheduler._release(self, perf_counter_ns() - self.started - self.idle)
+
+
+class FairScheduler:
+    """Shares the event loop between the sources of inbound messages.
+
+    Deficit round robin over processing time: a source keeps going until it
+    used up its quantum, scaled by the weight of its `CustomerType`, then it
+    queues behind the sources with messages waiting. A source with a rate
+    holds its messages back once its token bucket is empty, which slows down
+    reading its socket rather than everyone else.
+
+    Up to `concurrency` turns are in progress at once. A turn should only
+    await what it can't do without, like database lookups, and await those
+    through `metered` so the wait is not charged to its source.
+    """
+
+    def __init__(
+        self,
+        *,
+        quantum: float = 0.001,
+        weights: Optional[Dict[CustomerType, int]] = None,
+        rates: Optional[Dict[CustomerType, float]] = None,
+        burst: float = 1.0,
+        concurrency: int = 16,
+    ):
+        self.quantum = int(quantum * 1e9)
+        self.weights = (
+            weights
+            if weights is not None
+            else {CustomerType.BRONZE: 1, CustomerType.SILVER: 2, CustomerType.GOLD: 4}
+        )
+        # messages per second, burst in seconds of the rate
+        self.rates = rates or {}
+        self.burst = burst
+        self._concurrency = concurrency
+        self._busy = 0
+        self._sources: Dict[Hashable, _Source] = {}
+        self._ring: Deque[_Source] = deque()
+        self._scheduled = False
+        self.throttled = 0
+        self.waited = 0
+
+    def turn(self, source: Hashable, customer_type: CustomerType) -> _Source:
+        """Async context of processing one message of `source`."""
+        state = self._sources.get(source)
+        if state is None or state.customer_type != customer_type:
+            state = self._sources[source] = _Source(self, customer_type)
+        return state
+
+    def forget(self, source: Hashable) -> None:
+        self._sources.pop(source, None)
+
+    async def _acquire(self, state: _Source) -> None:
+        if state.bucket is not None and (delay := state.bucket.take()) > 0:
+            self.throttled += 1
+            await asyncio.sleep(delay)
+        if state.deficit > 0 and not self._ring and self._busy < self._concurrency:
+            self._busy += 1
+            return
+        self.waited += 1
+        future = asyncio.get_running_loop().create_future()
+        state.waiters.append(future)
+        if not state.queued:
+            state.queued = True
+            self._ring.append(state)
+        if not self._scheduled:
+            # granted from the next loop iteration, so sockets of other
+            # sources are read before
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._grant)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(state, 0)
+            raise
+
+    def _release(self, state: _Source, elapsed_ns: int) -> None:
+        self._busy -= 1
+        state.deficit -= elapsed_ns
+        if self._ring and not self._scheduled:
+            self._grant()
+
+    def _grant(self) -> None:
+        self._scheduled = False
+        ring = self._ring
+        while ring and self._busy < self._concurrency:
+            state = ring[0]
+            if state.deficit <= 0:
+                state.deficit += self.quantum * state.weight
+                ring.rotate(-1)
+                continue
+            future = state.waiters.popleft()
+            if not state.waiters:
+                ring.popleft()
+                state.queued = False
+            if future.cancelled():
+                continue
+            self._busy += 1
+            future.set_result(None)
+
+
+class _NoTurn:
+    def metered(self, coro: Coroutine) -> Awaitable:
+        return coro
+
+    async def __aenter__(self) -> "_NoTurn":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class NullScheduler:
+    """Processes every message right away."""
+
+    _turn = _NoTurn()
+
+    def turn(self, source: Hashable, customer_type: CustomerType) -> _NoTurn:
+        return self._turn
+
+    def forget(self, source: Hashable) -> None:
+        pass
@@ -0,0 +1,222 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from loguru import logger
+from tradecopier.application.domain.value_objects import Priority, TerminalId
+from tradecopier.infrastructure.adapters import codec as wire
+from tradecopier.infrastructure.adapters.backplane import (
+    Backplane, DisconnectHandler, FrameHandler, Record, encode_record,
+    frame_record, parse_frame, parse_presence, presence_record, read_record)
+
+
+class TcpBackplane(Backplane):
+    """Cluster node talking to a `BackplaneBroker` over one TCP connection.
+
+    The broker owns the presence registry and routes frames to the node
+    holding their terminal, nodes only keep a replica of the registry to
+    answer `owner` locally.
+    """
+
+    def __init__(
+        self,
+        node_id: str,
+        host: str = "127.0.0.1",
+        port: int = 7000,
+        *,
+        reconnect_delay: float = 0.5,
+        max_buffer: int = 4 * 1024 * 1024,
+    ):
+        super().__init__()
+        self.node_id = node_id
+        self._host = host
+        self._port = port
+        self._reconnect_delay = reconnect_delay
+        self._max_buffer = max_buffer
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Future] = None
+        self._on_frame: Optional[FrameHandler] = None
+        self._on_disconnect: Optional[DisconnectHandler] = None
+        self.linked = asyncio.Event()
+
+    async def start(
+        self, on_frame: FrameHandler, on_disconnect: DisconnectHandler
+    ) -> None:
+        self._on_frame = on_frame
+        self._on_disconnect = on_disconnect
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def announce(self, terminal_id: TerminalId, codec: Optional[wire.Codec]) -> None:
+        if self._remember(terminal_id, codec) and self._writer is not None:
+            self._writer.write(
+                presence_record(terminal_id, codec.name if codec else None)
+            )
+
+    def forward(
+        self,
+        terminal_id: TerminalId,
+        frame: wire.Frame,
+        priority: Priority = Priority.REGULAR,
+        deadline: Optional[float] = None,
+    ) -> bool:
+        writer = self._writer
+        if (
+            writer is None
+            or terminal_id not in self._owners
+            or writer.transport.get_write_buffer_size() > self._max_buffer
+        ):
+            self.dropped += 1
+            return False
+        writer.write(frame_record(terminal_id, frame, priority, deadline))
+        self.forwarded += 1
+        return True
+
+    def disconnect(self, terminal_id: TerminalId) -> bool:
+        if self._writer is None or terminal_id not in self._owners:
+            return False
+        self._writer.write(encode_record(Record.DISCONNECT, terminal_id.bytes))
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self._host, self._port)
+            except OSError as e:
+                logger.warning(f"backplane broker unreachable: {e}")
+                await asyncio.sleep(self._reconnect_delay)
+                continue
+            writer.write(encode_record(Record.HELLO, self.node_id.encode()))
+            for terminal_id, codec in self._present.items():
+                writer.write(presence_record(terminal_id, codec))
+            self._writer = writer
+            self.linked.set()
+            logger.info(f"node {self.node_id} joined the backplane")
+            try:
+                while True:
+                    kind, payload = await read_record(reader)
+                    if kind == Record.PRESENCE:
+                        terminal_id, codec, node = parse_presence(payload)
+                        self._on_presence(node, terminal_id, codec)
+                    elif kind == Record.FRAME:
+                        self._on_frame(*parse_frame(payload))
+                    elif kind == Record.DISCONNECT:
+                        self._on_disconnect(UUID(bytes=payload))
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+                logger.warning(f"node {self.node_id} lost the backplane: {e!r}")
+            finally:
+                # the broker replays the registry on reconnect
+                self.linked.clear()
+                self._writer = None
+                self._owners = {}
+                writer.close()
+            await asyncio.sleep(self._reconnect_delay)
+
+
+class BackplaneBroker:
+    """Minimal broker for `TcpBackplane` nodes: keeps the cluster-wide
+    presence registry and relays frames to the node holding the terminal.
+
+    Stands in for an external pub/sub service in tests and small setups.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 7000,
+        *,
+        max_buffer: int = 16 * 1024 * 1024,
+    ):
+        self._host = host
+        self._port = port
+        self._max_buffer = max_buffer
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._nodes: Dict[str, asyncio.StreamWriter] = {}
+        self._owners: Dict[TerminalId, Tuple[str, str]] = {}
+        self.relayed = 0
+        self.dropped = 0
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            return self._port
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._serve_node, self._host, self._port
+        )
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._nodes.values()):
+            writer.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    def _broadcast(self, record: bytes, sender: str) -> None:
+        for node, writer in self._nodes.items():
+            if node != sender:
+                writer.write(record)
+
+    def _relay(self, terminal_id: TerminalId, record: bytes) -> None:
+        owner = self._owners.get(terminal_id)
+        writer = self._nodes.get(owner[0]) if owner is not None else None
+        if writer is None or writer.transport.get_write_buffer_size() > self._max_buffer:
+            self.dropped += 1
+            return
+        writer.write(record)
+        self.relayed += 1
+
+    async def _serve_node(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        node: Optional[str] = None
+        try:
+            kind, payload = await read_record(reader)
+            if kind != Record.HELLO:
+                return
+            node = payload.decode()
+            if (stale := self._nodes.get(node)) is not None:
+                stale.close()
+            self._nodes[node] = writer
+            for terminal_id, (owner, codec) in self._owners.items():
+                if owner != node:
+                    writer.write(presence_record(terminal_id, codec, owner))
+            logger.info(f"node {node} joined")
+            while True:
+                kind, payload = await read_record(reader)
+                if kind == Record.PRESENCE:
+                    terminal_id, codec, _ = parse_presence(payload)
+                    if codec is not None:
+                        self._owners[terminal_id] = (node, codec)
+                    elif self._owners.get(terminal_id, (None,))[0] == node:
+                        del self._owners[terminal_id]
+                    else:
+                        continue
+                    self._broadcast(presence_record(terminal_id, codec, node), node)
+                elif kind == Record.FRAME:
+                    self._relay(
+                        UUID(bytes=payload[:16]), encode_record(kind, payload)
+                    )
+                elif kind == Record.DISCONNECT:
+                    self._relay(UUID(bytes=payload), encode_record(kind, payload))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            if node is not None and self._nodes.get(node) is writer:
+                del self._nodes[node]
+                gone = [t for t, owner in self._owners.items() if owner[0] == node]
+                for terminal_id in gone:
+                    del self._owners[terminal_id]
+                    self._broadcast(presence_record(terminal_id, None, node), node)
+                logger.info(f"node {node} left, {len(gone)} terminals withdrawn")
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, List, Optional
+
+from sqlalchemy.engine import Connection, Engine
+from tradecopier.application.domain.entities.route import Route
+from tradecopier.application.domain.entities.rule import Rule
+from tradecopier.application.domain.entities.terminal import Terminal
+from tradecopier.application.domain.value_objects import (RouteId, TerminalId,
+                                                          TerminalType)
+from tradecopier.application.repositories.route_repo import (AsyncRouteRepo,
+                                                             RouteRepo)
+from tradecopier.application.repositories.rule_repo import (AsyncRuleRepo,
+                                                            RuleRepo)
+from tradecopier.application.repositories.terminal_repo import (
+    AsyncTerminalRepo, TerminalRepo)
+
+
+class ThreadLocalConnection:
+    """Connection look-alike which gives every thread its own pooled connection.
+
+    Lets the synchronous repositories be shared by the workers of a thread
+    pool without sharing a DBAPI connection between threads.
+    """
+
+    def __init__(self, engine: Engine):
+        self._engine = engine
+        self._local = threading.local()
+
+    def _connection(self) -> Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            conn = self._local.conn = self._engine.connect()
+        return conn
+
+    def execute(self, *args, **kwargs):
+        return self._connection().execute(*args, **kwargs)
+
+
+class ExecutorRepo:
+    def __init__(self, repo: Any, executor: Optional[ThreadPoolExecutor] = None):
+        self._repo = repo
+        self._executor = executor
+
+    async def _run(self, func: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+
+class ExecutorRouteRepo(ExecutorRepo, AsyncRouteRepo):
+    def __init__(self, repo: RouteRepo, executor: Optional[ThreadPoolExecutor] = None):
+        super().__init__(repo, executor)
+
+    async def get(self, route_id: RouteId) -> Route:
+        return await self._run(self._repo.get, route_id)
+
+    async def delete(self, route_id: RouteId) -> None:
+        return await self._run(self._repo.delete, route_id)
+
+    async def save(self, route: Route) -> RouteId:
+        return await self._run(self._repo.save, route)
+
+    async def get_by_terminal_id(
+        self, terminal_id: TerminalId, term_type: TerminalType
+    ) -> List[Route]:
+        return await self._run(
+            self._repo.get_by_terminal_id, terminal_id, term_type=term_type
+        )
+
+    async def get_all(self) -> List[Route]:
+        return await self._run(self._repo.get_all)
+
+
+class ExecutorRuleRepo(ExecutorRepo, AsyncRuleRepo):
+    def __init__(self, repo: RuleRepo, executor: Optional[ThreadPoolExecutor] = None):
+        super().__init__(repo, executor)
+
+    async def get(self, terminal_id: TerminalId) -> Rule:
+        return await self._run(self._repo.get, terminal_id)
+
+    async def save(self, rule: Rule):
+        return await self._run(self._repo.save, rule)
+
+
+class ExecutorTerminalRepo(ExecutorRepo, AsyncTerminalRepo):
+    def __init__(
+        self, repo: TerminalRepo, executor: Optional[ThreadPoolExecutor] = None
+    ):
+        super().__init__(repo, executor)
+
+    async def get(self, terminal_id: TerminalId) -> Optional[Terminal]:
+        return await self._run(self._repo.get, terminal_id)
+
+    async def get_by_tail(self, terminal_id_tail: str) -> Optional[Terminal]:
+        return await self._run(self._repo.get_by_tail, terminal_id_tail)
+
+    async def save(self, terminal: Terminal) -> TerminalId:
+        return await self._run(self._repo.save, terminal)
@@ -1,6 +1,7 @@
 from typing import List
 
 from loguru import logger
+from pydantic import ValidationError
 from sqlalchemy import and_, select
 from sqlalchemy.engine import Connection
 from sqlalchemy.exc import NoResultFound
@@ -31,6 +32,39 @@ class SqlAlchemyRouteRepo(RouteRepo):
         )
         return [self.get(r.route_id) for r in route_id_lst]
 
+    def get_all(self) -> List[Route]:
+        route_rows = self._conn.execute(RouteModel.select()).all()
+        terminal_ids = set()
+        for row in route_rows:
+            terminal_ids.update((row.src_terminal_id, row.dst_terminal_id))
+        terminals = {
+            row.terminal_id: Terminal(**{k: v for k, v in row._mapping.items()})
+            for row in self._conn.execute(
+                TerminalModel.select().where(
+                    TerminalModel.c.terminal_id.in_(terminal_ids)
+                )
+            )
+        }
+        routes = []
+        for row in route_rows:
+            source = terminals.get(row.src_terminal_id)
+            destination = terminals.get(row.dst_terminal_id)
+            if source is None or destination is None:
+                logger.debug(f"terminal[s] for the route {row.route_id} were not found")
+                continue
+            try:
+                routes.append(
+                    Route(
+                        route_id=row.route_id,
+                        source=source,
+                        destination=destination,
+                        status=row.status,
+                    )
+                )
+            except ValidationError:
+                logger.debug(f"route {row.route_id} has inactive terminal[s]")
+        return routes
+
     def delete(self, route_id: RouteId) -> None:
         self._conn.execute(RouteModel.delete().where(RouteModel.c.route_id == route_id))
 
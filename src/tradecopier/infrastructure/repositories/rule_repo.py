@@ -1,13 +1,16 @@
-from typing import Callable, Generator, Iterable, Type, Union
+from collections import OrderedDict
+from typing import Callable, Generator, Iterable, Optional, Type, Union
 
 from sqlalchemy.engine import Connection
 from tradecopier.application.domain.entities.rule import (ComplexRule,
+                                                          CompiledRule,
                                                           Expression,
                                                           FilterRule, Rule,
                                                           TransformRule)
 from tradecopier.application.domain.value_objects import (
     EntityNotFoundException, FilterOperation, TerminalId, TransformOperation)
-from tradecopier.application.repositories.rule_repo import RuleRepo
+from tradecopier.application.repositories.rule_repo import (AsyncRuleRepo,
+                                                            RuleRepo)
 from tradecopier.infrastructure.repositories.sql_model import RuleModel
 
 
@@ -92,3 +95,73 @@ class SqlAlchemyRuleRepo(RuleRepo):
                     }
                 )
             )
+
+
+class RuleCache:
+    """LRU of compiled rules keyed by terminal id."""
+
+    def __init__(self, maxsize: int = 4096):
+        self._maxsize = maxsize
+        self._cache: "OrderedDict[TerminalId, CompiledRule]" = OrderedDict()
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, terminal_id: TerminalId) -> Optional[CompiledRule]:
+        compiled = self._cache.get(terminal_id)
+        if compiled is not None:
+            self._cache.move_to_end(terminal_id)
+        return compiled
+
+    def put(self, rule: Rule) -> CompiledRule:
+        compiled = CompiledRule(rule)
+        self._cache[rule.terminal_id] = compiled
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+        return compiled
+
+    def invalidate(self, terminal_id: TerminalId) -> None:
+        self._cache.pop(terminal_id, None)
+        self._version += 1
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._version += 1
+
+
+class CachedRuleRepo(RuleRepo):
+    def __init__(self, repo: RuleRepo, cache: Optional[RuleCache] = None):
+        self._repo = repo
+        self.cache = cache if cache is not None else RuleCache()
+
+    def get(self, terminal_id: TerminalId) -> Optional[CompiledRule]:
+        compiled = self.cache.get(terminal_id)
+        if compiled is None and (rule := self._repo.get(terminal_id)) is not None:
+            compiled = self.cache.put(rule)
+        return compiled
+
+    def save(self, rule: Rule):
+        self._repo.save(rule)
+        self.cache.invalidate(rule.terminal_id)
+
+
+class AsyncCachedRuleRepo(AsyncRuleRepo):
+    def __init__(self, repo: AsyncRuleRepo, cache: Optional[RuleCache] = None):
+        self._repo = repo
+        self.cache = cache if cache is not None else RuleCache()
+
+    async def get(self, terminal_id: TerminalId) -> Optional[CompiledRule]:
+        compiled = self.cache.get(terminal_id)
+        if compiled is None and (rule := await self._repo.get(terminal_id)) is not None:
+            compiled = self.cache.put(rule)
+        return compiled
+
+    async def save(self, rule: Rule):
+        await self._repo.save(rule)
+        self.cache.invalidate(rule.terminal_id)
+
+    @property
+    def version(self) -> int:
+        return self.cache.version
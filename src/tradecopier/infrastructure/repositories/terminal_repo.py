@@ -1,10 +1,13 @@
-from typing import Optional
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
 
 from sqlalchemy.engine import Connection
 from sqlalchemy.exc import StatementError
 from tradecopier.application.domain.entities.terminal import Terminal
 from tradecopier.application.domain.value_objects import TerminalId
-from tradecopier.application.repositories.terminal_repo import TerminalRepo
+from tradecopier.application.repositories.terminal_repo import (
+    AsyncTerminalRepo, TerminalRepo)
 from tradecopier.infrastructure.repositories.sql_model import TerminalModel
 
 
@@ -51,3 +54,71 @@ class SqlAlchemyTerminalRepo(TerminalRepo):
         elif update_res.rowcount > 1:
             raise Exception("More than one row updated")
         return terminal.terminal_id
+
+
+class UnknownTerminalCache:
+    """Bounded set of terminal ids known to be missing, each one forgotten
+    `ttl` seconds after it was added."""
+
+    def __init__(
+        self,
+        ttl: float = 10.0,
+        maxsize: int = 65536,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._clock = clock
+        # insertion order is expiry order, the ttl is the same for all
+        self._expiry: "OrderedDict[TerminalId, float]" = OrderedDict()
+
+    def __contains__(self, terminal_id: TerminalId) -> bool:
+        expires = self._expiry.get(terminal_id)
+        if expires is None:
+            return False
+        if self._clock() < expires:
+            return True
+        del self._expiry[terminal_id]
+        return False
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def add(self, terminal_id: TerminalId) -> None:
+        self._expiry.pop(terminal_id, None)
+        self._expiry[terminal_id] = self._clock() + self._ttl
+        if len(self._expiry) > self._maxsize:
+            self._expiry.popitem(last=False)
+
+    def discard(self, terminal_id: TerminalId) -> None:
+        self._expiry.pop(terminal_id, None)
+
+
+class AsyncCachedTerminalRepo(AsyncTerminalRepo):
+    """Answers lookups of recently missing terminals without asking `repo`."""
+
+    def __init__(
+        self, repo: AsyncTerminalRepo, unknown: Optional[UnknownTerminalCache] = None
+    ):
+        self._repo = repo
+        self.unknown = unknown if unknown is not None else UnknownTerminalCache()
+
+    async def get(self, terminal_id: TerminalId) -> Optional[Terminal]:
+        if terminal_id in self.unknown:
+            return None
+        terminal = await self._repo.get(terminal_id)
+        if terminal is None:
+            self.unknown.add(terminal_id)
+        return terminal
+
+    async def get_by_tail(self, terminal_id_tail: str) -> Optional[Terminal]:
+        return await self._repo.get_by_tail(terminal_id_tail)
+
+    async def save(self, terminal: Terminal) -> TerminalId:
+        terminal_id = await self._repo.save(terminal)
+        self.unknown.discard(terminal.terminal_id)
+        return terminal_id
+
+    def forget(self, terminal_id: TerminalId) -> None:
+        self.unknown.discard(terminal_id)
+        self._repo.forget(terminal_id)
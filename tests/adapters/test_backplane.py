@@ -0,0 +1,118 @@
+import asyncio
+from uuid import uuid4
+
+import factories
+from tradecopier.application.domain.entities.message import (OutgoingMessage,
+                                                             OutTradeMessage)
+from tradecopier.application.domain.value_objects import Priority
+from tradecopier.infrastructure.adapters import codec as wire
+from tradecopier.infrastructure.adapters.backplane import (LoopbackBackplane,
+                                                           LoopbackHub,
+                                                           frame_record,
+                                                           parse_frame)
+from tradecopier.infrastructure.adapters.connection_adapter import \
+    WebSocketsConnectionAdapter
+from tradecopier.infrastructure.adapters.tcp_backplane import (
+    BackplaneBroker, TcpBackplane)
+
+
+class FakeWs:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send(self, frame):
+        self.sent.append(frame)
+
+    async def close(self):
+        self.closed = True
+
+
+async def until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def out_message():
+    return OutgoingMessage(
+        message=OutTradeMessage(body=factories.TradeMessageFactory().body)
+    )
+
+
+def test_loopback_between_nodes(event_loop):
+    hub = LoopbackHub()
+    backplanes = [LoopbackBackplane(i, hub) for i in range(2)]
+    owner, other = [WebSocketsConnectionAdapter(backplane=b) for b in backplanes]
+    terminal_id = uuid4()
+    dst_ws = FakeWs()
+    message = out_message()
+    announced = []
+    backplanes[1].on_presence(announced.append)
+
+    async def scenario():
+        # presence of a node started earlier is picked up on start
+        owner._register_ws(terminal_id, dst_ws, wire.JSON)
+        for wsca, backplane in zip((owner, other), backplanes):
+            await backplane.start(wsca._on_remote_frame, wsca._on_remote_disconnect)
+        assert other.is_connected(terminal_id)
+
+        other.send_message(terminal_id, message)
+        await until(lambda: dst_ws.sent)
+        assert dst_ws.sent == [message.encode(wire.JSON.dumps)]
+
+        other.disconnect(terminal_id)
+        await until(lambda: dst_ws.closed)
+        await until(lambda: not other.is_connected(terminal_id))
+
+        owner._register_ws(terminal_id, FakeWs(), wire.MSGPACK)
+        await until(lambda: backplanes[1].owner(terminal_id) is wire.MSGPACK)
+        await backplanes[0].close()
+        assert not other.is_connected(terminal_id)
+        await backplanes[1].close()
+
+    event_loop.run_until_complete(scenario())
+    assert backplanes[1].forwarded == 1
+    assert announced == [terminal_id, terminal_id]
+
+
+def test_frame_record():
+    terminal_id = uuid4()
+    for frame in ("text", b"binary"):
+        for priority, deadline in ((Priority.REGULAR, None), (Priority.PROTECTIVE, 1.5)):
+            # past the record header
+            payload = frame_record(terminal_id, frame, priority, deadline)[5:]
+            assert parse_frame(payload) == (terminal_id, frame, priority, deadline)
+
+
+def test_tcp_backplane_through_broker(event_loop):
+    broker = BackplaneBroker(port=0)
+    terminal_id = uuid4()
+    frame = out_message().encode(wire.MSGPACK.dumps)
+    received = []
+
+    async def scenario():
+        await broker.start()
+        first, second = [
+            TcpBackplane(f"node-{i}", port=broker.port, reconnect_delay=0.01)
+            for i in range(2)
+        ]
+        first.announce(terminal_id, wire.MSGPACK)
+        await first.start(lambda *args: received.append(args), lambda _: None)
+        await second.start(lambda *_: None, lambda _: None)
+        await until(lambda: second.owner(terminal_id) is wire.MSGPACK)
+
+        assert second.forward(terminal_id, frame)
+        assert not second.forward(uuid4(), frame)
+        await until(lambda: received)
+        assert received == [(terminal_id, frame, Priority.REGULAR, None)]
+
+        # a node leaving withdraws its terminals from the others
+        await first.close()
+        await until(lambda: second.owner(terminal_id) is None)
+        await second.close()
+        await broker.close()
+
+    event_loop.run_until_complete(scenario())
+    assert broker.relayed == 1
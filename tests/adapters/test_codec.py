@@ -0,0 +1,28 @@
+from tradecopier.application.domain.entities.message import (IncomingMessage,
+                                                             OutgoingMessage,
+                                                             OutTradeMessage)
+from tradecopier.infrastructure.adapters import codec as wire
+
+
+def test_codecs_roundtrip(ord_incoming_message_factory):
+    inc_message = ord_incoming_message_factory()
+    for codec in (wire.JSON, wire.MSGPACK):
+        frame = codec.dumps(inc_message.dict())
+        assert isinstance(frame, str if codec is wire.JSON else bytes)
+        assert IncomingMessage(**wire.decode(frame)) == inc_message
+
+
+def test_negotiation():
+    assert wire.get_codec(None) is wire.JSON
+    assert wire.get_codec("unknown") is wire.JSON
+    assert wire.get_codec("msgpack") is wire.MSGPACK
+    assert wire.subprotocols() == ["tradecopier.json", "tradecopier.msgpack"]
+
+
+def test_outgoing_frame_cached_per_codec(trade_message_factory):
+    msg = OutgoingMessage(message=OutTradeMessage(body=trade_message_factory().body))
+    json_frame = msg.encode(wire.JSON.dumps)
+    msgpack_frame = msg.encode(wire.MSGPACK.dumps)
+    assert msg.encode() is json_frame
+    assert msg.encode(wire.MSGPACK.dumps) is msgpack_frame
+    assert wire.decode(msgpack_frame) == wire.decode(json_frame)
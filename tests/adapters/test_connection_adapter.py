@@ -0,0 +1,413 @@
+import asyncio
+import contextvars
+import json
+import time
+from uuid import uuid4
+
+import factories
+import pytest
+from loguru import logger
+from tradecopier.application import tracing
+from tradecopier.application.domain.entities.message import (
+    AskRegistrationMessage, OutgoingMessage, OutTradeBatchMessage,
+    OutTradeMessage)
+from tradecopier.application.domain.value_objects import Priority, TradeAction
+from tradecopier.infrastructure.adapters.connection_adapter import \
+    WebSocketsConnectionAdapter
+from tradecopier.infrastructure.adapters.outbound import (ExpiryPolicy,
+                                                          OutboundQueue,
+                                                          OverflowPolicy)
+from tradecopier.infrastructure.adapters.scheduler import FairScheduler
+
+
+class FakeWs:
+    def __init__(self, frames=(), delay=0.0):
+        self._frames = list(frames)
+        self._delay = delay
+        self.sent = []
+        self.sent_at = []
+
+    async def send(self, frame):
+        await asyncio.sleep(self._delay)
+        self.sent.append(frame)
+        self.sent_at.append(time.monotonic())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._frames:
+            raise StopAsyncIteration
+        return self._frames.pop(0)
+
+
+def test_fan_out_isolates_slow_destination(event_loop, mocker):
+    inc_message = factories.OrdIncomingMessageFactory()
+    out_message = OutgoingMessage(
+        message=OutTradeMessage(body=inc_message.message.body)
+    )
+    slow_id, fast_id = uuid4(), uuid4()
+    slow_ws, fast_ws = FakeWs(delay=10), FakeWs(delay=0.05)
+    src_ws = FakeWs(frames=[json.dumps(inc_message.dict())])
+
+    wsca = WebSocketsConnectionAdapter(send_timeout=0.3)
+    uc = mocker.AsyncMock()
+    uc.execute.return_value = [([slow_id, fast_id], out_message)]
+
+    async def scenario():
+        wsca._register_ws(slow_id, slow_ws)
+        wsca._register_ws(fast_id, fast_ws)
+        started = time.monotonic()
+        await wsca._callback(uc)(src_ws, "/")
+        # the source read loop only enqueues
+        assert time.monotonic() - started < 0.05
+        await asyncio.sleep(0.2)
+        stats = wsca.outbound_stats()
+        wsca._unregister_ws(slow_id, slow_ws)
+        wsca._unregister_ws(fast_id, fast_ws)
+        return started, stats
+
+    started, stats = event_loop.run_until_complete(scenario())
+    assert fast_ws.sent == [out_message.encode()]
+    # the fast destination is not queued behind the stalled one
+    assert fast_ws.sent_at[0] - started < 0.15
+    assert slow_ws.sent == []
+    assert uc.execute.called
+    assert wsca.outbound_stats() == {}
+    assert stats[str(fast_id)]["sent"] == 1
+    assert stats[str(slow_id)]["depth"] == 0
+
+
+@pytest.mark.parametrize(
+    "policy,expected,dropped",
+    (
+        (OverflowPolicy.DROP_OLDEST, ["2", "3"], 1),
+        (OverflowPolicy.DROP_NEWEST, ["1", "2"], 1),
+        (OverflowPolicy.DISCONNECT, [], 3),
+    ),
+)
+def test_outbound_queue_overflow(event_loop, policy, expected, dropped):
+    wsproto = FakeWs()
+    wsproto.close = lambda: asyncio.sleep(0)
+
+    async def scenario():
+        queue = OutboundQueue(uuid4(), wsproto, maxsize=2, policy=policy)
+        for frame in ("1", "2", "3"):
+            queue.put(frame)
+        queue.start()
+        await asyncio.sleep(0.01)
+        queue.close()
+        return queue
+
+    queue = event_loop.run_until_complete(scenario())
+    assert wsproto.sent == expected
+    assert queue.dropped == dropped
+    assert queue.closed
+
+
+def test_overflow_policy_by_terminal(event_loop):
+    strict_id, live_id, other_id = uuid4(), uuid4(), uuid4()
+    wsca = WebSocketsConnectionAdapter(queue_size=2)
+
+    async def scenario():
+        wsca.set_overflow_policy(strict_id, OverflowPolicy.DISCONNECT)
+        for terminal_id in (strict_id, live_id, other_id):
+            wsca._register_ws(terminal_id, FakeWs())
+        # a connected terminal switches right away
+        wsca.set_overflow_policy(live_id, OverflowPolicy.DROP_NEWEST)
+        queues = dict(wsca._outbound)
+        for terminal_id in (strict_id, live_id, other_id):
+            wsca._unregister_ws(terminal_id, queues[str(terminal_id)].wsproto)
+        return queues
+
+    queues = event_loop.run_until_complete(scenario())
+    assert queues[str(strict_id)].policy == OverflowPolicy.DISCONNECT
+    assert queues[str(live_id)].policy == OverflowPolicy.DROP_NEWEST
+    assert queues[str(other_id)].policy == OverflowPolicy.DROP_OLDEST
+
+
+def test_outbound_queue_priority_lanes(event_loop):
+    wsproto = FakeWs()
+
+    async def scenario():
+        queue = OutboundQueue(uuid4(), wsproto, maxsize=100)
+        for i in range(50):
+            queue.put(f"open-{i}", source="busy")
+        queue.put("sl-1", Priority.PROTECTIVE, "ticket", source="quiet", ticket=7)
+        queue.put("close", Priority.PROTECTIVE, source="quiet", ticket=8)
+        # only the latest stop loss of the ticket is still worth sending
+        queue.put("sl-2", Priority.PROTECTIVE, "ticket", source="quiet", ticket=7)
+        queue.start()
+        await asyncio.sleep(0.01)
+        queue.put("sl-3", Priority.PROTECTIVE, "ticket", source="quiet", ticket=7)
+        await asyncio.sleep(0.01)
+        queue.close()
+        return queue
+
+    queue = event_loop.run_until_complete(scenario())
+    assert wsproto.sent[:3] == ["sl-2", "close", "open-0"]
+    assert wsproto.sent[-1] == "sl-3"
+    assert len(wsproto.sent) == 53
+    assert queue.coalesced == 1
+
+
+def test_outbound_queue_keeps_source_order(event_loop):
+    wsproto = FakeWs()
+
+    async def scenario():
+        queue = OutboundQueue(uuid4(), wsproto, maxsize=100)
+        queue.put("open-eu", source="source", symbol="EURUSD")
+        for i in range(3):
+            queue.put(f"open-gb-{i}", source="source", symbol="GBPUSD")
+        queue.put("modify-5", source="source", ticket=5, symbol="GBPUSD")
+        # nothing pending it may depend on, the backlog is overtaken
+        queue.put("sl-3", Priority.PROTECTIVE, source="source", ticket=3, symbol="JPY")
+        # may be about the position the deal opens
+        queue.put(
+            "sl-9", Priority.PROTECTIVE, source="source", ticket=9, symbol="EURUSD"
+        )
+        queue.put("close-9", Priority.PROTECTIVE, source="source", ticket=9)
+        queue.put("close-5", Priority.PROTECTIVE, source="source", ticket=5)
+        queue.start()
+        await asyncio.sleep(0.01)
+        queue.close()
+
+    event_loop.run_until_complete(scenario())
+    assert wsproto.sent == [
+        "sl-3",
+        "open-eu",
+        "sl-9",
+        "close-9",
+        "open-gb-0",
+        "open-gb-1",
+        "open-gb-2",
+        "modify-5",
+        "close-5",
+    ]
+
+
+def test_outbound_queue_evicted_blocker_releases(event_loop):
+    wsproto = FakeWs()
+
+    async def scenario():
+        queue = OutboundQueue(uuid4(), wsproto, maxsize=2)
+        queue.put("open", source="source", symbol="EURUSD")
+        queue.put("sl", Priority.PROTECTIVE, source="source", ticket=9, symbol="EURUSD")
+        assert queue.put("other")
+        queue.start()
+        await asyncio.sleep(0.01)
+        queue.close()
+        return queue
+
+    queue = event_loop.run_until_complete(scenario())
+    assert wsproto.sent == ["sl", "other"]
+    assert queue.dropped == 1
+
+
+@pytest.mark.parametrize(
+    "policy", (OverflowPolicy.DROP_OLDEST, OverflowPolicy.DROP_NEWEST)
+)
+def test_outbound_queue_overflow_spares_protective(event_loop, policy):
+    wsproto = FakeWs()
+
+    async def scenario():
+        queue = OutboundQueue(uuid4(), wsproto, maxsize=2, policy=policy)
+        assert queue.put("1", Priority.PROTECTIVE)
+        assert queue.put("2")
+        assert queue.put("3", Priority.PROTECTIVE)
+        assert not queue.put("4")
+        queue.start()
+        await asyncio.sleep(0.01)
+        queue.close()
+        return queue
+
+    queue = event_loop.run_until_complete(scenario())
+    assert wsproto.sent == ["1", "3"]
+    assert queue.dropped == 2
+
+
+@pytest.mark.parametrize(
+    "policy, sent", ((ExpiryPolicy.DROP, ["fresh"]), (ExpiryPolicy.REPORT, None))
+)
+def test_outbound_queue_expiry(event_loop, policy, sent):
+    wsproto = FakeWs(delay=0.05)
+
+    async def scenario():
+        queue = OutboundQueue(uuid4(), wsproto, expiry_policy=policy)
+        queue.put("stale", deadline=time.time() - 1)
+        queue.put("fresh")
+        # expires while the first frame is being sent
+        queue.put("late", deadline=time.time() + 0.02)
+        queue.start()
+        await asyncio.sleep(0.25)
+        queue.close()
+        return queue
+
+    queue = event_loop.run_until_complete(scenario())
+    assert wsproto.sent == (sent or ["stale", "fresh", "late"])
+    assert queue.expired == 2
+    assert queue.stats()["expired"] == 2
+
+
+def test_deadline_by_action():
+    wsca = WebSocketsConnectionAdapter(
+        max_age={TradeAction.DEAL: 2.0, TradeAction.SLTP: 10.0}
+    )
+    deal, sltp, pending = (
+        factories.OrderFactory(action=action)
+        for action in (TradeAction.DEAL, TradeAction.SLTP, TradeAction.PENDING)
+    )
+    single = OutgoingMessage(message=OutTradeMessage(body=deal))
+    assert wsca._deadline(single, 100) == 102
+    batch = OutgoingMessage(message=OutTradeBatchMessage(body=[pending, sltp, deal]))
+    assert wsca._deadline(batch, 100) == 102
+    single = OutgoingMessage(message=OutTradeMessage(body=pending))
+    assert wsca._deadline(single, 100) is None
+    ask = OutgoingMessage(message=AskRegistrationMessage(terminal_id=uuid4()))
+    assert wsca._deadline(ask, 100) is None
+    assert WebSocketsConnectionAdapter()._deadline(batch, 100) is None
+
+
+def test_scheduled_connection(event_loop, mocker):
+    inc_message = factories.OrdIncomingMessageFactory()
+    src_ws = FakeWs(frames=[json.dumps(inc_message.dict())] * 3)
+    scheduler = FairScheduler()
+    wsca = WebSocketsConnectionAdapter(scheduler=scheduler)
+    uc = mocker.AsyncMock()
+    uc.execute.return_value = []
+    uc.open_session.return_value = None
+
+    event_loop.run_until_complete(wsca._callback(uc)(src_ws, "/"))
+    assert uc.execute.call_count == 3
+    # the connection is gone, so is its scheduling state
+    assert not scheduler._sources
+    assert scheduler._busy == 0
+
+
+def test_stalled_senders_do_not_block_others(event_loop, mocker):
+    # unregistered terminals asked to register but not reading their socket
+    stalled = [
+        factories.OrdIncomingMessageFactory(message__terminal_id=uuid4())
+        for _ in range(4)
+    ]
+    other = factories.OrdIncomingMessageFactory(message__terminal_id=uuid4())
+    wsca = WebSocketsConnectionAdapter(
+        send_timeout=5, scheduler=FairScheduler(concurrency=2)
+    )
+    uc = mocker.AsyncMock()
+    uc.open_session.return_value = None
+
+    async def execute(inc_message, session):
+        if inc_message.message.terminal_id == other.message.terminal_id:
+            return []
+        terminal_id = inc_message.message.terminal_id
+        return [
+            (
+                (terminal_id,),
+                OutgoingMessage(message=AskRegistrationMessage(terminal_id=terminal_id)),
+            )
+        ]
+
+    uc.execute.side_effect = execute
+
+    async def scenario():
+        handlers = [
+            asyncio.ensure_future(
+                wsca._callback(uc)(
+                    FakeWs(frames=[json.dumps(message.dict())], delay=10), "/"
+                )
+            )
+            for message in stalled
+        ]
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        await wsca._callback(uc)(FakeWs(frames=[json.dumps(other.dict())]), "/")
+        elapsed = time.monotonic() - started
+        for handler in handlers:
+            handler.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        return elapsed
+
+    assert event_loop.run_until_complete(scenario()) < 0.1
+    assert uc.execute.call_count == 5
+
+
+def test_tracer_sampling():
+    watched = uuid4()
+    tracer = tracing.Tracer(sample_every=3, terminals=[watched])
+    assert tracer.enabled
+    assert not tracing.Tracer().enabled
+
+    def scenario():
+        assert [tracer.begin(uuid4()) for _ in range(6)] == [False, False, True] * 2
+        assert tracer.begin(watched) and tracing.active()
+
+    # the decision stays within the context of the message
+    contextvars.copy_context().run(scenario)
+    assert not tracing.active()
+
+
+def test_trace_only_watched_terminal(event_loop, mocker):
+    watched, other, dst_id = uuid4(), uuid4(), uuid4()
+    messages = [factories.OrdIncomingMessageFactory() for _ in range(2)]
+    messages[0].message.terminal_id = watched
+    messages[1].message.terminal_id = other
+    out_message = OutgoingMessage(
+        message=OutTradeMessage(body=messages[0].message.body)
+    )
+    src_ws = FakeWs(frames=[json.dumps(m.dict(), default=str) for m in messages])
+    wsca = WebSocketsConnectionAdapter(tracer=tracing.Tracer(terminals=[watched]))
+    uc = mocker.AsyncMock()
+    uc.execute.return_value = [([dst_id], out_message)]
+    records = []
+    sink = logger.add(records.append, filter=tracing.is_trace_record)
+
+    async def scenario():
+        wsca._register_ws(dst_id, FakeWs())
+        await wsca._callback(uc)(src_ws, "/")
+        wsca._unregister_ws(dst_id, wsca._ws_register[str(dst_id)])
+        # the writers of both ids the connection spoke for are gone as well
+        await asyncio.sleep(0)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    try:
+        pending = event_loop.run_until_complete(scenario())
+    finally:
+        logger.remove(sink)
+    assert pending == set()
+    assert wsca.outbound_stats() == {}
+    assert len(records) == 2
+    assert all(str(watched) in record for record in records)
+    assert str(other) not in "".join(records)
+
+
+@pytest.mark.parametrize("spelling", (str, lambda s: s.upper().replace("-", "")))
+@pytest.mark.parametrize("interval,executed", ((60, 2), (0, 4)))
+def test_unregistered_noise_rate_limited(
+    event_loop, mocker, interval, executed, spelling
+):
+    trade = factories.OrdIncomingMessageFactory()
+    register = factories.RegIncomingMessageFactory()
+    register.message.terminal_id = trade.message.terminal_id
+    frames = [json.dumps(trade.dict())] * 3 + [json.dumps(register.dict())]
+    terminal_id = str(trade.message.terminal_id)
+    frames = [frame.replace(terminal_id, spelling(terminal_id)) for frame in frames]
+    ask = OutgoingMessage(
+        message=AskRegistrationMessage(terminal_id=trade.message.terminal_id)
+    )
+    src_ws = FakeWs(frames=frames)
+    wsca = WebSocketsConnectionAdapter(ask_registration_interval=interval)
+    uc = mocker.AsyncMock()
+    uc.execute.side_effect = lambda message, session: (
+        [] if "broker" in message.message.dict() else [([trade.message.terminal_id], ask)]
+    )
+
+    async def scenario():
+        await wsca._callback(uc)(src_ws, "/")
+        await asyncio.sleep(0.01)
+
+    event_loop.run_until_complete(scenario())
+    # trades after the first reply are dropped unparsed, the registration
+    # always gets through
+    assert uc.execute.call_count == executed
+    assert src_ws.sent[0] == ask.encode()
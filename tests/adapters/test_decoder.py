@@ -0,0 +1,88 @@
+import json
+
+import factories
+import pytest
+from pydantic import ValidationError
+from tradecopier.application.domain.entities.message import (
+    IncomingMessage, InTradeBatchMessage, OutgoingMessage)
+from tradecopier.infrastructure.adapters import codec as wire
+from tradecopier.infrastructure.adapters import decoder
+
+
+def wire_dict(message) -> dict:
+    return json.loads(json.dumps(IncomingMessage(message=message).dict()))
+
+
+def test_fast_path_matches_pydantic(trade_message_factory):
+    for message in (trade_message_factory(), factories.TradeBatchMessageFactory()):
+        data = wire_dict(message)
+        assert decoder.decode_incoming(data) == IncomingMessage(**data)
+
+    data = wire_dict(trade_message_factory())
+    data["message"]["body"]["volume"] = 1
+    fast = decoder.decode_incoming(data)
+    assert type(fast.message.body.volume) is float
+    assert fast.message.body.order_type is not None
+    assert fast == IncomingMessage(**data)
+
+
+def test_fast_path_batch():
+    data = wire_dict(factories.TradeBatchMessageFactory())
+    assert isinstance(decoder.decode_incoming(data).message, InTradeBatchMessage)
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("volume_percent", 101),
+        ("magic", -1),
+        ("order_type", 999),
+        ("action", None),
+        ("volume", float("nan")),
+        ("sl_points", float("nan")),
+        ("volume_percent", float("inf")),
+    ],
+)
+def test_fast_path_falls_back_on_invalid(trade_message_factory, field, value):
+    data = wire_dict(trade_message_factory())
+    data["message"]["body"][field] = value
+    with pytest.raises(ValidationError):
+        decoder.decode_incoming(data)
+
+
+def test_fast_path_falls_back_on_coercion(
+    trade_message_factory, register_message_factory
+):
+    data = wire_dict(trade_message_factory())
+    data["message"]["body"]["magic"] = "42"
+    data["message"]["body"]["expiration"] = "2021-01-01T00:00:00"
+    assert decoder.decode_incoming(data) == IncomingMessage(**data)
+    data = wire_dict(register_message_factory())
+    assert decoder.decode_incoming(data) == IncomingMessage(**data)
+
+
+@pytest.mark.parametrize("codec", [wire.JSON, wire.MSGPACK])
+def test_passthrough_splices_body(trade_message_factory, codec):
+    for message in (trade_message_factory(), factories.TradeBatchMessageFactory()):
+        frame = codec.dumps(wire_dict(message))
+        inbound = decoder.decode_incoming(codec.loads(frame), frame).message
+        outgoing = OutgoingMessage.passthrough(inbound)
+        assert outgoing.encode(codec.dumps) == codec.dumps(outgoing.dict())
+
+
+def test_passthrough_keeps_frame_body(trade_message_factory):
+    data = wire_dict(trade_message_factory())
+    frame = json.dumps(data, indent=1)
+    assert decoder.decode_incoming(data).message._raw_encoder is None
+    inbound = decoder.decode_incoming(json.loads(frame), frame).message
+    spliced = OutgoingMessage.passthrough(inbound).encode()
+    assert json.dumps(data["message"]["body"], indent=1).replace("\n", "\n  ") in spliced
+    assert json.loads(spliced) == OutgoingMessage.passthrough(inbound).dict()
+    assert inbound._raw_encoder(wire.MSGPACK.dumps) is None
+
+    data["message"]["body"]["volume"] = 1
+    inbound = decoder.decode_incoming(data, json.dumps(data)).message
+    assert inbound._raw_encoder is None
+    del data["message"]["body"]["comment"]
+    inbound = decoder.decode_incoming(data, json.dumps(data)).message
+    assert inbound._raw_encoder is None
@@ -0,0 +1,81 @@
+import asyncio
+from uuid import uuid4
+
+import factories
+from tradecopier.application.domain.entities.message import (OutgoingMessage,
+                                                             OutTradeMessage)
+from tradecopier.infrastructure.adapters import codec as wire
+from tradecopier.infrastructure.adapters.connection_adapter import \
+    WebSocketsConnectionAdapter
+from tradecopier.infrastructure.adapters.forwarding import Forwarder
+
+
+class FakeWs:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send(self, frame):
+        self.sent.append(frame)
+
+    async def close(self):
+        self.closed = True
+
+
+async def until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_forwarding_between_workers(event_loop, tmp_path):
+    forwarders = [Forwarder(i, 2, str(tmp_path), reconnect_delay=0.01) for i in range(2)]
+    owner, other = [WebSocketsConnectionAdapter(backplane=f) for f in forwarders]
+    terminal_id = uuid4()
+    dst_ws = FakeWs()
+    out_message = OutgoingMessage(
+        message=OutTradeMessage(body=factories.TradeMessageFactory().body)
+    )
+
+    async def scenario():
+        for wsca, forwarder in zip((owner, other), forwarders):
+            await forwarder.start(wsca._on_remote_frame, wsca._on_remote_disconnect)
+        owner._register_ws(terminal_id, dst_ws, wire.MSGPACK)
+        await until(lambda: other.is_connected(terminal_id))
+
+        other.send_message(terminal_id, out_message)
+        await until(lambda: dst_ws.sent)
+        assert dst_ws.sent == [out_message.encode(wire.MSGPACK.dumps)]
+
+        other.disconnect(terminal_id)
+        await until(lambda: dst_ws.closed)
+        assert not owner.is_connected(terminal_id)
+        await until(lambda: not other.is_connected(terminal_id))
+        assert not other._dispatch(terminal_id, out_message)
+
+        for forwarder in forwarders:
+            await forwarder.close()
+
+    event_loop.run_until_complete(scenario())
+    assert forwarders[1].forwarded == 1
+    assert forwarders[1].dropped == 0
+
+
+def test_forwarder_forgets_dead_peer(event_loop, tmp_path):
+    first, second = [
+        Forwarder(i, 2, str(tmp_path), reconnect_delay=0.01) for i in range(2)
+    ]
+    terminal_id = uuid4()
+
+    async def scenario():
+        # presence announced before the peers are linked is replayed
+        first.announce(terminal_id, wire.JSON)
+        for forwarder in (first, second):
+            await forwarder.start(lambda *_: None, lambda *_: None)
+        await until(lambda: second.owner(terminal_id) is wire.JSON)
+        await first.close()
+        await until(lambda: second.owner(terminal_id) is None)
+        await second.close()
+
+    event_loop.run_until_complete(scenario())
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import random
+
+from tradecopier.application.adapters.metrics import Stage
+from tradecopier.infrastructure.adapters.metrics import (HistogramMetrics,
+                                                         LatencyHistogram,
+                                                         MetricsEndpoint)
+
+
+def test_histogram_percentiles_within_precision():
+    rnd = random.Random(7)
+    values = sorted(int(rnd.lognormvariate(11, 1.5)) for _ in range(20000))
+    histogram = LatencyHistogram(significant_bits=7)
+    for value in values:
+        histogram.record(value)
+
+    assert histogram.count == len(values)
+    assert histogram.min_ns == values[0]
+    assert histogram.max_ns == values[-1]
+    for q in (50, 99, 99.9):
+        exact = values[int(q / 100 * len(values)) - 1]
+        assert abs(histogram.percentile(q) - exact) <= exact / 64 + 1
+    assert histogram.percentile(100) == values[-1]
+
+    histogram.reset()
+    assert histogram.count == 0
+    assert histogram.percentile(50) == 0
+
+
+def test_histogram_small_values_exact():
+    histogram = LatencyHistogram(significant_bits=4)
+    for value in range(16):
+        histogram.record(value)
+    assert [histogram.percentile(q) for q in (25, 50, 100)] == [3, 7, 15]
+
+
+def test_metrics_endpoint(event_loop):
+    metrics = HistogramMetrics()
+    for elapsed in (1000, 2000, 3000):
+        metrics.observe(Stage.DECODE, elapsed)
+    metrics.observe(Stage.SEND, 50000)
+    endpoint = MetricsEndpoint(metrics, port=0)
+
+    async def scenario():
+        await endpoint.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", endpoint.port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        await endpoint.close()
+        return response
+
+    head, _, body = event_loop.run_until_complete(scenario()).partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200")
+    snapshot = json.loads(body)
+    assert set(snapshot) == {"decode", "send"}
+    assert snapshot["decode"]["count"] == 3
+    assert 2.0 <= snapshot["decode"]["p50"] <= 2.0 * (1 + 1 / 64)
+    assert snapshot["send"]["max"] == 50.0
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+from tradecopier.application.domain.value_objects import CustomerType
+from tradecopier.infrastructure.adapters.scheduler import (FairScheduler,
+                                                           NullScheduler,
+                                                           TokenBucket)
+
+
+def busy(seconds: float):
+    # processing that never yields to the event loop
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        pass
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.1)
+    # the reserved token is paid back first
+    now[0] = 0.15
+    assert bucket.take() == pytest.approx(0.05)
+    now[0] = 10
+    assert bucket.take() == 0
+
+
+@pytest.mark.parametrize(
+    "scheduler, at_most", [(NullScheduler(), 200), (FairScheduler(), 40)]
+)
+def test_noisy_source_does_not_starve_others(event_loop, scheduler, at_most):
+    processed = []
+
+    async def noisy():
+        for _ in range(200):
+            async with scheduler.turn("noisy", CustomerType.GOLD):
+                busy(0.0002)
+                processed.append("noisy")
+
+    async def quiet():
+        async with scheduler.turn("quiet", CustomerType.BRONZE):
+            processed.append("quiet")
+
+    async def scenario():
+        first = asyncio.ensure_future(noisy())
+        await asyncio.sleep(0)
+        await asyncio.gather(first, quiet())
+
+    event_loop.run_until_complete(scenario())
+    assert len(processed) == 201
+    assert processed.index("quiet") <= at_most
+    if at_most < 200:
+        assert processed.index("quiet") > 0
+
+
+def test_share_follows_customer_type(event_loop):
+    scheduler = FairScheduler(quantum=0.0005)
+    counts = {CustomerType.GOLD: 0, CustomerType.BRONZE: 0}
+    running = True
+
+    async def source(customer_type):
+        while running:
+            async with scheduler.turn(customer_type, customer_type):
+                busy(0.0001)
+                counts[customer_type] += 1
+
+    async def scenario():
+        nonlocal running
+        sources = [asyncio.ensure_future(source(t)) for t in counts]
+        await asyncio.sleep(0.3)
+        running = False
+        await asyncio.gather(*sources)
+
+    event_loop.run_until_complete(scenario())
+    assert counts[CustomerType.BRONZE] > 0
+    assert counts[CustomerType.GOLD] / counts[CustomerType.BRONZE] > 2
+
+
+def test_rate_limited_source(event_loop):
+    scheduler = FairScheduler(rates={CustomerType.BRONZE: 100}, burst=0.05)
+
+    async def scenario():
+        started = time.monotonic()
+        for _ in range(15):
+            async with scheduler.turn("source", CustomerType.BRONZE):
+                pass
+        return time.monotonic() - started
+
+    # 5 at once, the other 10 at the rate
+    assert event_loop.run_until_complete(scenario()) >= 0.09
+    assert scheduler.throttled == 10
+
+
+def test_waiting_is_not_charged(event_loop):
+    scheduler = FairScheduler(quantum=0.001)
+
+    async def fails():
+        await asyncio.sleep(0)
+        raise KeyError("lookup")
+
+    async def scenario():
+        async with scheduler.turn("source", CustomerType.BRONZE) as turn:
+            assert await turn.metered(asyncio.sleep(0.05, "found")) == "found"
+            with pytest.raises(KeyError):
+                await turn.metered(fails())
+
+    event_loop.run_until_complete(scenario())
+    assert scheduler._sources["source"].deficit > 0
@@ -0,0 +1,40 @@
+import json
+
+import factories
+import pytest
+from tradecopier.application.domain.entities.message import (
+    OutgoingMessage, OutTradeBatchMessage, OutTradeMessage)
+from tradecopier.application.domain.value_objects import Priority, TradeAction
+
+
+def test_outgoing_message_encode(trade_message_factory, mocker):
+    msg = OutgoingMessage(message=OutTradeMessage(body=trade_message_factory().body))
+    dumps = mocker.spy(json, "dumps")
+    frame = msg.encode()
+    assert json.loads(frame) == json.loads(json.dumps(msg.dict()))
+    dumps.reset_mock()
+    assert msg.encode() is frame
+    dumps.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "action, position, priority, key",
+    [
+        (TradeAction.DEAL, None, Priority.REGULAR, None),
+        (TradeAction.DEAL, 7, Priority.PROTECTIVE, None),
+        (TradeAction.PENDING, None, Priority.REGULAR, None),
+        (TradeAction.MODIFY, 7, Priority.REGULAR, (TradeAction.MODIFY, 7)),
+        (TradeAction.SLTP, 7, Priority.PROTECTIVE, (TradeAction.SLTP, 7)),
+        (TradeAction.SLTP, None, Priority.PROTECTIVE, None),
+        (TradeAction.REMOVE, 7, Priority.PROTECTIVE, None),
+        (TradeAction.CLOSE_BY, 7, Priority.PROTECTIVE, None),
+    ],
+)
+def test_outgoing_message_delivery(action, position, priority, key):
+    order = factories.OrderFactory(action=action, position=position)
+    msg = OutgoingMessage(message=OutTradeMessage(body=order))
+    assert msg.delivery() == (priority, key, position, order.symbol)
+
+    opening = factories.OrderFactory(action=TradeAction.DEAL, symbol=order.symbol)
+    batch = OutgoingMessage(message=OutTradeBatchMessage(body=[opening, order]))
+    assert batch.delivery() == (priority, None, None, order.symbol)
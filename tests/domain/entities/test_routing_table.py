@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from tradecopier.application.domain.entities.expiry_index import ExpiryIndex
+from tradecopier.application.domain.entities.route import Route
+from tradecopier.application.domain.entities.routing_table import \
+    RoutingTable
+from tradecopier.application.domain.value_objects import (CustomerType,
+                                                          RouteStatus)
+
+
+def test_routing_table(terminal_factory):
+    src, dst1, dst2 = terminal_factory.build_batch(
+        3, customer_type=CustomerType.SILVER
+    )
+    routes = [
+        Route(source=src, destination=dst1, status=RouteStatus.BOTH),
+        Route(source=src, destination=dst2, status=RouteStatus.SOURCE),
+    ]
+    table = RoutingTable(routes)
+    assert table.version == 1
+    assert len(table) == 2
+    assert table.destinations(src.terminal_id) == (dst1,)
+    assert table.destinations(dst1.terminal_id) == ()
+
+    # reloading the same content keeps the version
+    assert not table.load(list(routes))
+    assert table.version == 1
+
+    table.upsert(Route(source=src, destination=dst2, status=RouteStatus.BOTH))
+    assert table.version == 2
+    assert set(table.destinations(src.terminal_id)) == {dst1, dst2}
+
+    table.remove(src.terminal_id, dst1.terminal_id)
+    table.remove(src.terminal_id, dst1.terminal_id)
+    assert table.version == 3
+    assert table.destinations(src.terminal_id) == (dst2,)
+
+    table.remove(src.terminal_id, dst2.terminal_id)
+    assert table.get(src.terminal_id) == []
+    assert len(table) == 0
+
+
+def test_routing_table_deactivate(terminal_factory):
+    src, dst1, dst2 = terminal_factory.build_batch(
+        3, customer_type=CustomerType.SILVER
+    )
+    table = RoutingTable(
+        [
+            Route(source=src, destination=dst, status=RouteStatus.BOTH)
+            for dst in (dst1, dst2)
+        ]
+    )
+    version = table.version
+    assert table.deactivate(dst1.terminal_id)
+    assert not table.deactivate(dst1.terminal_id)
+    assert table.version == version + 1
+    assert table.destinations(src.terminal_id) == (dst2,)
+    assert not table.is_active(dst1)
+    assert dst1 not in table.terminals()
+    # terminals the table doesn't know are judged by themselves
+    assert table.is_active(terminal_factory.build(customer_type=CustomerType.GOLD))
+    expired = terminal_factory.build(
+        customer_type=CustomerType.BRONZE,
+        expire_at=datetime.now() - timedelta(seconds=1),
+    )
+    assert not table.is_active(expired)
+
+
+def test_expiry_index():
+    now = datetime.now()
+    first, second, third = uuid4(), uuid4(), uuid4()
+    index = ExpiryIndex()
+    index.schedule(first, now + timedelta(seconds=2))
+    index.schedule(second, now + timedelta(seconds=1))
+    index.schedule(third, now + timedelta(seconds=3))
+    assert index.next_expiry() == now + timedelta(seconds=1)
+
+    index.schedule(second, now + timedelta(seconds=5))
+    index.discard(third)
+    assert len(index) == 2
+    assert index.pop_expired(now) == []
+    assert index.pop_expired(now + timedelta(seconds=4)) == [first]
+    assert index.next_expiry() == now + timedelta(seconds=5)
+    assert index.pop_expired(now + timedelta(seconds=5)) == [second]
+    assert index.next_expiry() is None
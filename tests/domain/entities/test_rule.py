@@ -4,6 +4,7 @@ import pydantic
 import pytest
 from pydantic import ValidationError
 from tradecopier.application.domain.entities.rule import (ComplexRule,
+                                                          CompiledRule,
                                                           Expression,
                                                           FilterRule,
                                                           TransformRule)
@@ -109,3 +110,89 @@ def test_complex_rule(trade_message_factory, terminal_factory):
     fr = FilterRule(terminal.terminal_id, fe)
     cr.push_rule(fr)
     assert cr.apply(msg) is not None
+
+
+@pytest.mark.parametrize(
+    "expr",
+    (
+        Expression(field="magic", value=50, operator=FilterOperation.LT),
+        Expression(field="magic", value=50, operator=FilterOperation.GE),
+        Expression(field="symbol", value="EUR", operator=FilterOperation.IN),
+        Expression(field="order_type", value=1, operator=FilterOperation.NE),
+    ),
+)
+def test_compiled_filter(trade_message_factory, terminal_factory, expr):
+    terminal = terminal_factory()
+    fr = FilterRule(terminal.terminal_id, expr)
+    compiled = CompiledRule(fr)
+    for msg in trade_message_factory.build_batch(10):
+        assert (fr.apply(msg) is None) == (compiled.apply(msg) is None)
+    assert compiled == fr
+
+
+def test_compiled_complex_rule(trade_message_factory, terminal_factory):
+    terminal = terminal_factory()
+    cr = ComplexRule(terminal.terminal_id)
+    cr.push_rule(
+        TransformRule(
+            terminal.terminal_id,
+            Expression(field="volume", value=2.0, operator=TransformOperation.MULTIPLY),
+        )
+    )
+    cr.push_rule(
+        TransformRule(
+            terminal.terminal_id,
+            Expression(field="comment", value="-c", operator=TransformOperation.APPEND),
+        )
+    )
+    cr.push_rule(
+        TransformRule(
+            terminal.terminal_id,
+            Expression(field="", value="", operator=TransformOperation.REVERSE),
+        )
+    )
+    msg = trade_message_factory()
+    expected = cr.apply(msg.copy(deep=True))
+    compiled = CompiledRule(cr).apply(msg.copy(deep=True))
+    assert compiled.body == expected.body
+    assert compiled.body.order_type == OrderType.ORDER_TYPE_SELL
+
+    cr.push_rule(
+        FilterRule(
+            terminal.terminal_id,
+            Expression(field="symbol", value="GBPUSD", operator=FilterOperation.EQ),
+        )
+    )
+    assert CompiledRule(cr).apply(msg.copy(deep=True)) is None
+
+
+def test_compiled_transform_copy_on_write(trade_message_factory, terminal_factory):
+    terminal = terminal_factory()
+    msg = trade_message_factory(body__sl=1.0, body__sl_points=3, body__tp=None)
+    original = msg.copy(deep=True)
+    for expr in (
+        Expression(field="volume", value=2.0, operator=TransformOperation.MULTIPLY),
+        Expression(field="comment", value="-c", operator=TransformOperation.APPEND),
+        Expression(field="symbol", value="GBPUSD", operator=TransformOperation.SET),
+        Expression(field="", value="", operator=TransformOperation.REVERSE),
+    ):
+        tr = TransformRule(terminal.terminal_id, expr)
+        transformed = CompiledRule(tr).apply(msg)
+        assert transformed.body != msg.body
+        assert msg == original
+        assert transformed.body == tr.apply(msg.copy(deep=True)).body
+
+
+def test_fingerprint(terminal_factory):
+    first, second = terminal_factory.build_batch(2)
+    expr = Expression(field="volume", value=0.1, operator=TransformOperation.MULTIPLY)
+    tr = TransformRule(first.terminal_id, expr)
+    assert tr.fingerprint == TransformRule(second.terminal_id, expr).fingerprint
+    assert tr.fingerprint != FilterRule(second.terminal_id, expr).fingerprint
+    assert tr.fingerprint == CompiledRule(tr).fingerprint
+
+    cr = ComplexRule(first.terminal_id, [tr])
+    other = ComplexRule(second.terminal_id, [TransformRule(second.terminal_id, expr)])
+    assert cr.fingerprint == other.fingerprint
+    other.push_rule(tr)
+    assert cr.fingerprint != other.fingerprint
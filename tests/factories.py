@@ -79,6 +79,15 @@ class TradeMessageFactory(factory.Factory):
         model = msg.InTradeMessage
 
 
+class TradeBatchMessageFactory(factory.Factory):
+    terminal_id = new_uuid()
+    body = factory.List([factory.SubFactory(OrderFactory) for _ in range(3)])
+    account_id = factory.fuzzy.FuzzyInteger(1, 100)
+
+    class Meta:
+        model = msg.InTradeBatchMessage
+
+
 class RegIncomingMessageFactory(factory.Factory):
     message = factory.SubFactory(RegisterMessageFactory)
 
@@ -1,7 +1,9 @@
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
 
 import factories
+import pytest
 from tradecopier.application.domain.entities.route import Route
 from tradecopier.application.domain.entities.rule import (ComplexRule,
                                                           Expression,
@@ -15,10 +17,13 @@ from tradecopier.application.use_case.receiving_message import \
     ReceivingMessageUseCase
 from tradecopier.infrastructure.adapters.connection_adapter import \
     ReceivingMessagePresenter
+from tradecopier.infrastructure.repositories.executor_repo import (
+    ExecutorRouteRepo, ExecutorRuleRepo, ExecutorTerminalRepo,
+    ThreadLocalConnection)
 from tradecopier.infrastructure.repositories.route_repo import \
     SqlAlchemyRouteRepo
-from tradecopier.infrastructure.repositories.rule_repo import \
-    SqlAlchemyRuleRepo
+from tradecopier.infrastructure.repositories.rule_repo import (
+    CachedRuleRepo, RuleCache, SqlAlchemyRuleRepo)
 from tradecopier.infrastructure.repositories.terminal_repo import \
     SqlAlchemyTerminalRepo
 
@@ -68,6 +73,8 @@ def test_route_repo(route_table, terminal_table, sql_conn, route_factory):
             dst_terminals[0].terminal_id, term_type=TerminalType.SOURCE
         )
     )
+    all_routes = route_repo.get_all()
+    assert all(route in all_routes for route in routes)
     assert len(
         route_repo.get_by_terminal_id(
             src_terminals[0].terminal_id, term_type=TerminalType.SOURCE
@@ -119,7 +126,31 @@ def test_rule_repo(rule_table, sql_conn, rule_expression_factory, terminal_facto
     assert fe_from_db == fe
 
 
-def test_complex_rules(
+def test_cached_rule_repo(
+    rule_table, sql_conn, rule_expression_factory, terminal_factory, mocker
+):
+    terminal = terminal_factory()
+    sql_repo = SqlAlchemyRuleRepo(sql_conn)
+    repo = CachedRuleRepo(sql_repo, RuleCache(maxsize=1))
+    spy = mocker.spy(sql_repo, "get")
+    fe = FilterRule(terminal.terminal_id, rule_expression_factory())
+    repo.save(fe)
+    assert repo.get(terminal.terminal_id) == fe
+    assert repo.get(terminal.terminal_id) is repo.get(terminal.terminal_id)
+    assert spy.call_count == 1
+
+    fe = FilterRule(terminal.terminal_id, rule_expression_factory())
+    repo.save(fe)
+    assert repo.get(terminal.terminal_id) == fe
+    assert spy.call_count == 2
+
+    repo.get(terminal_factory().terminal_id)
+    repo.get(terminal.terminal_id)
+    assert spy.call_count == 4
+
+
+@pytest.mark.asyncio
+async def test_complex_rules(
     route_table,
     rule_table,
     terminal_table,
@@ -159,11 +190,15 @@ def test_complex_rules(
 
     wsca.is_connected.return_value = True
     presenter = ReceivingMessagePresenter()
+    executor = ThreadPoolExecutor(max_workers=1)
+    thread_conn = ThreadLocalConnection(sql_conn.engine)
     uc = ReceivingMessageUseCase(
         conn_handler=wsca,
-        route_repo=route_repo,
-        terminal_repo=term_repo,
-        rule_repo=rule_repo,
+        route_repo=ExecutorRouteRepo(SqlAlchemyRouteRepo(thread_conn), executor),
+        terminal_repo=ExecutorTerminalRepo(
+            SqlAlchemyTerminalRepo(thread_conn), executor
+        ),
+        rule_repo=ExecutorRuleRepo(SqlAlchemyRuleRepo(thread_conn), executor),
         outboundary=presenter,
     )
 
@@ -171,7 +206,7 @@ def test_complex_rules(
     trd_msg.message = factories.TradeMessageFactory(
         terminal_id=src_terminal.terminal_id
     )
-    uc.execute(trd_msg)
+    await uc.execute(trd_msg)
 
     assert len(presenter._reply) == 1
     assert dst_terminal.terminal_id in presenter._reply[0][0]
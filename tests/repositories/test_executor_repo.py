@@ -0,0 +1,92 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from tradecopier.application.domain.entities.rule import CompiledRule, Rule
+from tradecopier.infrastructure.repositories.executor_repo import (
+    ExecutorRuleRepo, ExecutorTerminalRepo)
+from tradecopier.infrastructure.repositories.rule_repo import \
+    AsyncCachedRuleRepo
+from tradecopier.infrastructure.repositories.terminal_repo import (
+    AsyncCachedTerminalRepo, UnknownTerminalCache)
+
+
+@pytest.mark.asyncio
+async def test_slow_lookup_does_not_block_loop(mocker, terminal_factory):
+    terminal = terminal_factory()
+
+    def slow_get(terminal_id):
+        time.sleep(0.2)
+        return terminal
+
+    sync_repo = mocker.MagicMock()
+    sync_repo.get.side_effect = slow_get
+    repo = ExecutorTerminalRepo(sync_repo, ThreadPoolExecutor(max_workers=2))
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.ensure_future(ticker())
+    assert await repo.get(terminal.terminal_id) is terminal
+    task.cancel()
+    assert ticks > 5
+
+
+@pytest.mark.asyncio
+async def test_async_cached_rule_repo(mocker, terminal_factory):
+    terminal = terminal_factory()
+    sync_repo = mocker.MagicMock()
+    sync_repo.get.return_value = Rule(terminal.terminal_id, None)
+    repo = AsyncCachedRuleRepo(ExecutorRuleRepo(sync_repo))
+
+    rule = await repo.get(terminal.terminal_id)
+    assert isinstance(rule, CompiledRule)
+    assert await repo.get(terminal.terminal_id) is rule
+    assert sync_repo.get.call_count == 1
+
+    await repo.save(Rule(terminal.terminal_id, None))
+    assert await repo.get(terminal.terminal_id) is not rule
+    assert sync_repo.get.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_async_cached_terminal_repo_remembers_unknown(mocker, terminal_factory):
+    terminal = terminal_factory()
+    now = 0.0
+    sync_repo = mocker.MagicMock()
+    sync_repo.get.return_value = None
+    unknown = UnknownTerminalCache(ttl=10, maxsize=2, clock=lambda: now)
+    repo = AsyncCachedTerminalRepo(ExecutorTerminalRepo(sync_repo), unknown)
+
+    for _ in range(3):
+        assert await repo.get(terminal.terminal_id) is None
+    assert sync_repo.get.call_count == 1
+
+    now = 10.0
+    assert await repo.get(terminal.terminal_id) is None
+    assert sync_repo.get.call_count == 2
+
+    # registration through another process is seen once forgotten
+    sync_repo.get.return_value = terminal
+    assert await repo.get(terminal.terminal_id) is None
+    repo.forget(terminal.terminal_id)
+    assert await repo.get(terminal.terminal_id) is terminal
+    assert sync_repo.get.call_count == 3
+
+    # registration is seen at once
+    unknown.add(terminal.terminal_id)
+    await repo.save(terminal)
+    assert await repo.get(terminal.terminal_id) is terminal
+
+    # bounded, the oldest ids go first
+    others = [terminal_factory().terminal_id for _ in range(3)]
+    for terminal_id in others:
+        unknown.add(terminal_id)
+    assert len(unknown) == 2
+    assert others[0] not in unknown and others[2] in unknown
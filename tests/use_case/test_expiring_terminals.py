@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from tradecopier.application.domain.entities.route import Route
+from tradecopier.application.domain.entities.routing_table import \
+    RoutingTable
+from tradecopier.application.domain.value_objects import (CustomerType,
+                                                          RouteStatus)
+from tradecopier.application.use_case.expiring_terminals import \
+    ExpiringTerminalsUseCase
+
+
+def bronze_route(terminal_factory, expire_at: datetime) -> Route:
+    return Route(
+        source=terminal_factory.build(customer_type=CustomerType.SILVER),
+        destination=terminal_factory.build(
+            customer_type=CustomerType.BRONZE, expire_at=expire_at
+        ),
+        status=RouteStatus.BOTH,
+    )
+
+
+def test_expiring_terminals(wsca, terminal_factory):
+    now = datetime.now()
+    soon = bronze_route(terminal_factory, now + timedelta(seconds=10))
+    later = bronze_route(terminal_factory, now + timedelta(seconds=20))
+    table = RoutingTable([soon, later])
+    clock = [now]
+    uc = ExpiringTerminalsUseCase(
+        conn_handler=wsca, routing_table=table, now=lambda: clock[0]
+    )
+    uc.sync()
+    wsca.is_connected.return_value = True
+
+    assert uc.execute() == []
+    clock[0] = now + timedelta(seconds=15)
+    assert uc.execute() == [soon.destination.terminal_id]
+    wsca.disconnect.assert_called_once_with(soon.destination.terminal_id)
+    assert table.destinations(soon.source.terminal_id) == ()
+    assert table.destinations(later.source.terminal_id) == (later.destination,)
+    assert uc.execute() == []
+
+
+@pytest.mark.asyncio
+async def test_expiring_terminals_run(wsca, terminal_factory):
+    route = bronze_route(terminal_factory, datetime.now() + timedelta(seconds=0.05))
+    table = RoutingTable([route])
+    uc = ExpiringTerminalsUseCase(conn_handler=wsca, routing_table=table)
+    wsca.is_connected.return_value = False
+    task = asyncio.ensure_future(uc.run())
+    await asyncio.sleep(0)
+    uc.sync()
+    await asyncio.sleep(0.02)
+    assert table.destinations(route.source.terminal_id) == (route.destination,)
+    await asyncio.sleep(0.1)
+    assert table.destinations(route.source.terminal_id) == ()
+    wsca.disconnect.assert_not_called()
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_expiring_terminals_survives_failures(wsca, terminal_factory):
+    now = datetime.now()
+    first = bronze_route(terminal_factory, now + timedelta(seconds=0.02))
+    second = bronze_route(terminal_factory, now + timedelta(seconds=0.05))
+    table = RoutingTable([first, second])
+    uc = ExpiringTerminalsUseCase(conn_handler=wsca, routing_table=table)
+    uc.sync()
+    wsca.is_connected.return_value = True
+    wsca.disconnect.side_effect = [ConnectionError("socket closed"), None]
+    task = asyncio.ensure_future(uc.run())
+    await asyncio.sleep(0.15)
+    assert not task.done()
+    task.cancel()
+    assert [c.args[0] for c in wsca.disconnect.call_args_list] == [
+        first.destination.terminal_id,
+        second.destination.terminal_id,
+    ]
+    assert table.destinations(second.source.terminal_id) == ()
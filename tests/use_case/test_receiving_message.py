@@ -1,11 +1,20 @@
+import asyncio
 import datetime
 from uuid import uuid1
 
 import factories
 import pytest
-from tradecopier.application.domain.entities.rule import Rule
+from tradecopier.application.adapters.metrics import MetricsAdapter, Stage
+from tradecopier.application.domain.entities.message import (
+    IncomingMessage, OutTradeBatchMessage, OutTradeMessage)
+from tradecopier.application.domain.entities.routing_table import \
+    RoutingTable
+from tradecopier.application.domain.entities.rule import (Expression,
+                                                          FilterRule, Rule,
+                                                          TransformRule)
 from tradecopier.application.domain.value_objects import (
-    CustomerType, EntityNotFoundException, RouteId, RouteStatus)
+    CustomerType, EntityNotFoundException, FilterOperation, RouteId,
+    RouteStatus, TransformOperation)
 from tradecopier.application.use_case.receiving_message import \
     ReceivingMessageUseCase
 
@@ -13,7 +22,7 @@ from tradecopier.application.use_case.receiving_message import \
 @pytest.fixture
 def route_repo(mocker):
     return mocker.patch(
-        "tradecopier.infrastructure.repositories.route_repo.SqlAlchemyRouteRepo",
+        "tradecopier.infrastructure.repositories.executor_repo.ExecutorRouteRepo",
         autospec=True,
     )
 
@@ -21,7 +30,7 @@ def route_repo(mocker):
 @pytest.fixture
 def term_repo(mocker):
     return mocker.patch(
-        "tradecopier.infrastructure.repositories.terminal_repo.SqlAlchemyTerminalRepo",
+        "tradecopier.infrastructure.repositories.executor_repo.ExecutorTerminalRepo",
         autospec=True,
     )
 
@@ -29,12 +38,13 @@ def term_repo(mocker):
 @pytest.fixture
 def rule_repo(mocker):
     return mocker.patch(
-        "tradecopier.infrastructure.repositories.rule_repo.SqlAlchemyRuleRepo",
+        "tradecopier.infrastructure.repositories.executor_repo.ExecutorRuleRepo",
         autospec=True,
     )
 
 
-def test_receiving_message_register_on_new(
+@pytest.mark.asyncio
+async def test_receiving_message_register_on_new(
     wsca, route_repo, term_repo, rule_repo, recv_msg_bnd
 ):
     """
@@ -65,8 +75,10 @@ def test_receiving_message_register_on_new(
         rule_repo=rule_repo,
         outboundary=recv_msg_bnd,
     )
-    uc.execute(reg_msg_plain)
+    await uc.execute(reg_msg_plain)
     assert term_repo.get.called
+    # not taken for unknown from a lookup before it registered elsewhere
+    term_repo.forget.assert_called_once_with(terminal_brz.terminal_id)
     term_repo.save.side_effect = None
 
     terminal_slv = factories.TerminalFactory(
@@ -81,11 +93,12 @@ def test_receiving_message_register_on_new(
     )
     assert reg_msg_cyp.message.terminal_id == terminal_slv.terminal_id
     term_repo.save.side_effect = cust_save(terminal_slv)
-    uc.execute(reg_msg_cyp)
+    await uc.execute(reg_msg_cyp)
     term_repo.save.side_effect = None
 
 
-def test_receiving_message_non_register_on_new(
+@pytest.mark.asyncio
+async def test_receiving_message_non_register_on_new(
     wsca, mocker, route_repo, term_repo, rule_repo, recv_msg_bnd
 ):
     """
@@ -102,11 +115,15 @@ def test_receiving_message_non_register_on_new(
     )
     reg_msg = factories.OrdIncomingMessageFactory()
     reg_msg.message = factories.TradeMessageFactory()
-    uc.execute(reg_msg)
+    await uc.execute(reg_msg)
     assert recv_msg_bnd.present.called
+    # the reply is built, and encoded, once per terminal
+    (_, ask), = await uc.execute(reg_msg)
+    assert ask is recv_msg_bnd.present.call_args[0][0][0][1]
 
 
-def test_resceiving_trade_msg_no_rules(
+@pytest.mark.asyncio
+async def test_resceiving_trade_msg_no_rules(
     wsca, route_repo, term_repo, rule_repo, recv_msg_bnd
 ):
     """
@@ -131,7 +148,7 @@ def test_resceiving_trade_msg_no_rules(
         outboundary=recv_msg_bnd,
     )
     term_repo.get.return_value = src_term
-    uc.execute(trd_msg)
+    await uc.execute(trd_msg)
 
     # is not active, thus - no processing
     rule_repo.get.assert_not_called()
@@ -140,10 +157,11 @@ def test_resceiving_trade_msg_no_rules(
     src_term = factories.TerminalFactory(customer_type=CustomerType.SILVER)
     term_repo.get.return_value = src_term
     with pytest.raises(EntityNotFoundException):
-        uc.execute(trd_msg)
+        await uc.execute(trd_msg)
 
 
-def test_resceiving_trade_msg_one_way_confirmed(
+@pytest.mark.asyncio
+async def test_resceiving_trade_msg_one_way_confirmed(
     wsca, route_repo, term_repo, rule_repo, recv_msg_bnd
 ):
     route = factories.RouteFactory(status=RouteStatus.SOURCE)
@@ -164,10 +182,361 @@ def test_resceiving_trade_msg_one_way_confirmed(
         outboundary=recv_msg_bnd,
     )
     term_repo.get.return_value = src_term
-    uc.execute(trd_msg)
+    await uc.execute(trd_msg)
     recv_msg_bnd.present.assert_called_with([])
 
     route = factories.RouteFactory(status=RouteStatus.DESTINATION)
     route_repo.get_by_terminal_id.return_value = [route]
-    uc.execute(trd_msg)
+    await uc.execute(trd_msg)
     recv_msg_bnd.present.assert_called_with([])
+
+
+@pytest.mark.asyncio
+async def test_resceiving_trade_msg_routing_table(
+    wsca, route_repo, term_repo, rule_repo, recv_msg_bnd
+):
+    route = factories.RouteFactory(status=RouteStatus.BOTH)
+    trd_msg = factories.OrdIncomingMessageFactory()
+    trd_msg.message = factories.TradeMessageFactory(
+        terminal_id=route.source.terminal_id
+    )
+
+    wsca.is_connected.return_value = True
+    rule_repo.get.return_value = Rule(route.source.terminal_id, None)
+    term_repo.get.return_value = route.source
+
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+        outboundary=recv_msg_bnd,
+        routing_table=RoutingTable([route]),
+    )
+    await uc.execute(trd_msg)
+    route_repo.get_by_terminal_id.assert_not_called()
+    reply = recv_msg_bnd.present.call_args[0][0]
+    assert len(reply) == 1
+    assert reply[0][0] == {route.destination.terminal_id}
+
+
+@pytest.mark.asyncio
+async def test_resceiving_trade_stage_latencies(
+    wsca, route_repo, term_repo, rule_repo, mocker
+):
+    route = factories.RouteFactory(status=RouteStatus.BOTH)
+    trd_msg = factories.OrdIncomingMessageFactory()
+    trd_msg.message = factories.TradeMessageFactory(
+        terminal_id=route.source.terminal_id
+    )
+    wsca.is_connected.return_value = True
+    rule_repo.get.return_value = Rule(route.source.terminal_id, None)
+    term_repo.get.return_value = route.source
+    metrics = mocker.Mock(spec=MetricsAdapter)
+
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+        routing_table=RoutingTable([route]),
+        metrics=metrics,
+    )
+    await uc.execute(trd_msg)
+    stages = [c.args[0] for c in metrics.observe.call_args_list]
+    assert stages == [
+        Stage.TERMINAL_LOOKUP,
+        Stage.ROUTE_LOOKUP,
+        Stage.SOURCE_RULE,
+        Stage.DESTINATION_RULE,
+    ]
+    assert all(c.args[1] >= 0 for c in metrics.observe.call_args_list)
+
+
+@pytest.mark.asyncio
+async def test_resceiving_trade_batch(
+    wsca, route_repo, term_repo, rule_repo, recv_msg_bnd
+):
+    routes = factories.RouteFactory.build_batch(2, status=RouteStatus.BOTH)
+    src_term = routes[0].source
+    routes[1].source = src_term
+    batch = factories.TradeBatchMessageFactory(terminal_id=src_term.terminal_id)
+    batch.body[0].magic = 1000
+    for order in batch.body[1:]:
+        order.magic = 1
+
+    def get_rule(terminal_id):
+        if terminal_id == routes[1].destination.terminal_id:
+            return FilterRule(
+                terminal_id,
+                Expression(field="magic", value=1000, operator=FilterOperation.EQ),
+            )
+        return Rule(terminal_id, None)
+
+    wsca.is_connected.return_value = True
+    term_repo.get.return_value = src_term
+    rule_repo.get.side_effect = get_rule
+
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+        outboundary=recv_msg_bnd,
+        routing_table=RoutingTable(routes),
+    )
+    await uc.execute(IncomingMessage(message=batch))
+    term_repo.get.assert_called_once()
+    # source once, each destination once
+    assert rule_repo.get.call_count == 3
+    reply = {
+        tuple(terminals)[0]: msg.message
+        for terminals, msg in recv_msg_bnd.present.call_args[0][0]
+    }
+    full = reply[routes[0].destination.terminal_id]
+    assert isinstance(full, OutTradeBatchMessage)
+    assert full.body == batch.body
+    filtered = reply[routes[1].destination.terminal_id]
+    assert isinstance(filtered, OutTradeMessage)
+    assert filtered.body == batch.body[0]
+
+
+@pytest.mark.asyncio
+async def test_resceiving_trade_transforms_isolated(
+    wsca, route_repo, term_repo, rule_repo, recv_msg_bnd
+):
+    routes = factories.RouteFactory.build_batch(3, status=RouteStatus.BOTH)
+    src_term = routes[0].source
+    for route in routes:
+        route.source = src_term
+    trd_msg = factories.TradeMessageFactory(terminal_id=src_term.terminal_id)
+    original = trd_msg.copy(deep=True)
+    volumes = {
+        routes[0].destination.terminal_id: 2.0,
+        routes[1].destination.terminal_id: 3.0,
+    }
+
+    def get_rule(terminal_id):
+        if terminal_id in volumes:
+            return TransformRule(
+                terminal_id,
+                Expression(
+                    field="volume",
+                    value=volumes[terminal_id],
+                    operator=TransformOperation.MULTIPLY,
+                ),
+            )
+        return Rule(terminal_id, None)
+
+    wsca.is_connected.return_value = True
+    term_repo.get.return_value = src_term
+    rule_repo.get.side_effect = get_rule
+
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+        outboundary=recv_msg_bnd,
+        routing_table=RoutingTable(routes),
+    )
+    await uc.execute(IncomingMessage(message=trd_msg))
+    reply = {
+        tuple(terminals)[0]: msg.message
+        for terminals, msg in recv_msg_bnd.present.call_args[0][0]
+    }
+    assert trd_msg == original
+    for terminal_id, factor in volumes.items():
+        assert reply[terminal_id].body.volume == original.body.volume * factor
+    assert reply[routes[2].destination.terminal_id].body == original.body
+
+
+@pytest.mark.asyncio
+async def test_resceiving_trade_rule_sets_evaluated_once(
+    mocker, wsca, route_repo, term_repo, rule_repo, recv_msg_bnd
+):
+    routes = factories.RouteFactory.build_batch(4, status=RouteStatus.BOTH)
+    src_term = routes[0].source
+    for route in routes:
+        route.source = src_term
+    trd_msg = factories.TradeMessageFactory(terminal_id=src_term.terminal_id)
+
+    def get_rule(terminal_id):
+        if terminal_id == src_term.terminal_id:
+            return Rule(terminal_id, None)
+        return TransformRule(
+            terminal_id,
+            Expression(field="volume", value=0.1, operator=TransformOperation.MULTIPLY),
+        )
+
+    wsca.is_connected.return_value = True
+    term_repo.get.return_value = src_term
+    rule_repo.get.side_effect = get_rule
+    compile_spy = mocker.spy(TransformRule, "compile")
+
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+        outboundary=recv_msg_bnd,
+        routing_table=RoutingTable(routes),
+    )
+    await uc.execute(IncomingMessage(message=trd_msg))
+    assert compile_spy.call_count == 1
+    reply = recv_msg_bnd.present.call_args[0][0]
+    assert len(reply) == 1
+    assert reply[0][0] == {route.destination.terminal_id for route in routes}
+
+
+@pytest.mark.asyncio
+async def test_resceiving_trade_concurrently(wsca, route_repo, term_repo, rule_repo):
+    routes = factories.RouteFactory.build_batch(2, status=RouteStatus.BOTH)
+    sources = {route.source.terminal_id: route.source for route in routes}
+
+    async def get_terminal(terminal_id):
+        return sources.get(terminal_id)
+
+    async def get_rule(terminal_id):
+        # the first source is answered last, so both calls interleave
+        await asyncio.sleep(0.02 if terminal_id == routes[0].source.terminal_id else 0)
+        return Rule(terminal_id, None)
+
+    wsca.is_connected.return_value = True
+    term_repo.get.side_effect = get_terminal
+    rule_repo.get.side_effect = get_rule
+
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+        routing_table=RoutingTable(routes),
+    )
+    messages = [
+        IncomingMessage(
+            message=factories.TradeMessageFactory(terminal_id=route.source.terminal_id)
+        )
+        for route in routes
+    ]
+    replies = await asyncio.gather(*(uc.execute(m) for m in messages))
+    for route, message, reply in zip(routes, messages, replies):
+        assert len(reply) == 1
+        assert reply[0][0] == {route.destination.terminal_id}
+        assert reply[0][1].message.body == message.message.body
+
+
+@pytest.mark.asyncio
+async def test_resceiving_trade_with_session(wsca, route_repo, term_repo, rule_repo):
+    route = factories.RouteFactory(status=RouteStatus.BOTH)
+    src_id, dst_id = route.source.terminal_id, route.destination.terminal_id
+    message = IncomingMessage(message=factories.TradeMessageFactory(terminal_id=src_id))
+
+    wsca.is_connected.return_value = True
+    term_repo.get.return_value = route.source
+    rule_repo.get.side_effect = lambda terminal_id: Rule(terminal_id, None)
+    rule_repo.version = 0
+    routing_table = RoutingTable([route])
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+        routing_table=routing_table,
+    )
+
+    session = await uc.open_session(src_id)
+    for _ in range(2):
+        reply = await uc.execute(message, session)
+        assert reply[0][0] == {dst_id}
+    # later frames only evaluate the destination rules
+    assert term_repo.get.call_count == 1
+    assert [c.args[0] for c in rule_repo.get.call_args_list] == [src_id, dst_id, dst_id]
+
+    # refreshed on rule changes, route changes and expiry
+    rule_repo.version = 1
+    await uc.execute(message, session)
+    assert term_repo.get.call_count == 2
+    routing_table.remove(src_id, dst_id)
+    assert await uc.execute(message, session) == []
+    assert term_repo.get.call_count == 3
+    routing_table.upsert(route)
+    assert (await uc.execute(message, session))[0][0] == {dst_id}
+    assert term_repo.get.call_count == 4
+    # expiry reaches the session as a change of the table
+    assert routing_table.deactivate(src_id)
+    assert await uc.execute(message, session) == []
+    assert term_repo.get.call_count == 5
+    # an expired terminal staying connected is not looked up again
+    for _ in range(100):
+        assert await uc.execute(message, session) == []
+    assert term_repo.get.call_count == 5
+
+    # frames of another terminal on the connection are looked up as usual
+    await uc.execute(IncomingMessage(message=factories.TradeMessageFactory()), session)
+    assert term_repo.get.call_count == 6
+    assert session.terminal_id == src_id
+
+
+@pytest.mark.asyncio
+async def test_session_needs_change_tracking(wsca, route_repo, term_repo, rule_repo):
+    term_repo.get.return_value = factories.TerminalFactory()
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+    )
+    assert await uc.open_session(term_repo.get.return_value.terminal_id) is None
+    term_repo.get.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_resceiving_trade_passthrough_shared(
+    wsca, route_repo, term_repo, rule_repo, recv_msg_bnd
+):
+    routes = factories.RouteFactory.build_batch(3, status=RouteStatus.BOTH)
+    src_term = routes[0].source
+    for route in routes:
+        route.source = src_term
+    trd_msg = factories.TradeMessageFactory(terminal_id=src_term.terminal_id)
+    filtered, transformed = (route.destination.terminal_id for route in routes[1:])
+
+    def get_rule(terminal_id):
+        if terminal_id == filtered:
+            return FilterRule(
+                terminal_id,
+                Expression(
+                    field="magic", value=trd_msg.body.magic, operator=FilterOperation.EQ
+                ),
+            )
+        if terminal_id == transformed:
+            return TransformRule(
+                terminal_id,
+                Expression(field="volume", value=2, operator=TransformOperation.MULTIPLY),
+            )
+        return Rule(terminal_id, None)
+
+    wsca.is_connected.return_value = True
+    term_repo.get.return_value = src_term
+    rule_repo.get.side_effect = get_rule
+
+    uc = ReceivingMessageUseCase(
+        conn_handler=wsca,
+        route_repo=route_repo,
+        terminal_repo=term_repo,
+        rule_repo=rule_repo,
+        outboundary=recv_msg_bnd,
+        routing_table=RoutingTable(routes),
+    )
+    await uc.execute(IncomingMessage(message=trd_msg))
+    reply = {
+        frozenset(terminals): msg
+        for terminals, msg in recv_msg_bnd.present.call_args[0][0]
+    }
+    assert len(reply) == 2
+    unchanged = reply[frozenset((routes[0].destination.terminal_id, filtered))]
+    assert unchanged.message == OutTradeMessage(body=trd_msg.body)
+    assert reply[frozenset((transformed,))].message.body.volume == (
+        trd_msg.body.volume * 2
+    )